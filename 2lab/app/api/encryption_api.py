@@ -1,20 +1,424 @@
-from fastapi import APIRouter
-from app.schemas.encryption_schemas import EncodeRequest, EncodeResponse, DecodeRequest, DecodeResponse
-from app.services.encryption_service import encode_text, decode_text
+import asyncio
+import base64
+import codecs
+import json
+import tempfile
+import time
+from concurrent.futures.process import BrokenProcessPool
+from collections import Counter
+from urllib.parse import unquote
+from fastapi import APIRouter, HTTPException, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import StreamingResponse
+from pydantic import ValidationError
+from app.schemas.encryption_schemas import (
+    EncodeRequest, EncodeResponse, DecodeRequest, DecodeResponse, DecodeRangeRequest, DecodeRangeResponse,
+    EncodeBatchRequest, EncodeBatchItemResult, EncodeBatchResponse,
+    DecodeBatchRequest, DecodeBatchItemResult, DecodeBatchResponse, ExecutorStatsResponse,
+    SharedDictionaryRequest, SharedDictionaryResponse, SharedDictionaryListResponse, CodeCacheStatsResponse
+)
+from app.services.executor import codec_executor, ExecutorSaturated
+from app.services.code_cache import shared_dictionaries, huffman_code_cache, decode_table_cache
+from app.services.encryption_service import (
+    decode_text, encode_bytes, decode_bytes, build_huffman_tree, cached_huffman_codes,
+    validate_codes, check_codes_cover
+)
+from app.services.code_table import code_table_fields, code_table_from_base64, code_table_to_base64
+from app.services.container import decode_container, pack_container
+from app.services.block_codec import (
+    BLOCK_MIN_TEXT_SIZE, encode_bytes_parallel, encode_bytes_indexed, build_block_index,
+    decode_range_base64, decode_container_range_base64
+)
+from app.services.streaming_service import (
+    encoded_bit_length, iter_encoded_chunks, iter_decoded_chunks,
+    container_stream_size, iter_container_chunks, open_container_stream
+)
 
 router = APIRouter()
 
-@router.post("/encode", response_model=EncodeResponse)
-async def encode(request: EncodeRequest):
-    encoded_data, key, huffman_codes, padding = encode_text(request.text, request.key)
+# Бинарный режим: тело запроса и ответа - сырые байты, остальное едет в заголовках.
+# Ключ передается в percent-encoding (заголовки только latin-1), коды - JSON объектом
+# или компактной таблицей в base64
+BINARY_MEDIA_TYPE = "application/octet-stream"
+KEY_HEADER = "X-Encryption-Key"
+CODES_HEADER = "X-Huffman-Codes"
+CODE_TABLE_HEADER = "X-Code-Table" # вместо X-Huffman-Codes
+CODE_FORMAT_HEADER = "X-Code-Format" # compact: ответ с X-Code-Table; container: тело - контейнер
+PADDING_HEADER = "X-Padding"
+DICTIONARY_HEADER = "X-Shared-Dictionary" # вместо X-Huffman-Codes
+# Таблица кодов в заголовке не длиннее: больше не пропустят прокси (nginx - 8 КБ на строку
+# заголовка) и сам сервер. Большие алфавиты - компактной таблицей или контейнером
+CODES_HEADER_MAX_SIZE = 8 << 10
+
+def _request_body_doc(binary_description: str, json_model=None) -> dict:
+    content = {BINARY_MEDIA_TYPE: {"schema": {"type": "string", "format": "binary", "description": binary_description}}}
+    if json_model is not None:
+        content = {"application/json": {"schema": json_model.model_json_schema()}, **content}
+    return {"requestBody": {"required": True, "content": content}}
+
+def _is_binary(request: Request) -> bool:
+    return request.headers.get("content-type", "").split(";")[0].strip() == BINARY_MEDIA_TYPE
+
+def _required_header(request: Request, name: str) -> str:
+    value = request.headers.get(name)
+    if value is None:
+        raise HTTPException(status_code=400, detail=f"Header {name} is required for {BINARY_MEDIA_TYPE} requests.")
+    return value
+
+def _shared_dictionary(name: str):
+    codes = shared_dictionaries.get(name)
+    if codes is None:
+        raise HTTPException(status_code=404, detail=f"Shared dictionary '{name}' not found.")
+    return codes
+
+def _decode_codes(dictionary, code_table, huffman_codes):
+    # Таблица для декодирования: общий словарь, компактная таблица или старый словарь кодов
+    if dictionary is not None:
+        return _shared_dictionary(dictionary)
+    if code_table is not None:
+        try:
+            return code_table_from_base64(code_table)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"Invalid code_table: {e}")
+    if huffman_codes is not None:
+        return huffman_codes
+    raise HTTPException(status_code=400, detail="One of huffman_codes, code_table or dictionary is required.")
+
+def _code_headers(request: Request, huffman_codes) -> dict:
+    # Таблица в формате, который просил клиент, а если она не влезает в CODES_HEADER_MAX_SIZE -
+    # в другом (компактная есть только у канонического кода). Не влезает никак - нужен контейнер
+    codes_json = json.dumps(huffman_codes)
+    code_table = code_table_to_base64(huffman_codes)
+    options = [(CODES_HEADER, codes_json), (CODE_TABLE_HEADER, code_table)]
+    if request.headers.get(CODE_FORMAT_HEADER, "map") == "compact":
+        options.reverse()
+    for name, value in options:
+        if value is not None and len(value) <= CODES_HEADER_MAX_SIZE:
+            return {name: value}
+    raise HTTPException(
+        status_code=400,
+        detail=f"Code table does not fit into a {CODES_HEADER_MAX_SIZE}-byte response header; "
+               f"request {CODE_FORMAT_HEADER}: container to get it inside the body."
+    )
+
+def _is_container_request(request: Request) -> bool:
+    # Без таблицы кодов в заголовках тело должно быть контейнером
+    return not any(request.headers.get(name) is not None for name in (CODES_HEADER, CODE_TABLE_HEADER, DICTIONARY_HEADER))
+
+def _binary_decode_params(request: Request):
+    key = unquote(_required_header(request, KEY_HEADER))
+    dictionary = request.headers.get(DICTIONARY_HEADER)
+    code_table = request.headers.get(CODE_TABLE_HEADER)
+    if len(request.headers.get(CODES_HEADER, "")) > CODES_HEADER_MAX_SIZE:
+        raise HTTPException(
+            status_code=431,
+            detail=f"{CODES_HEADER} is longer than {CODES_HEADER_MAX_SIZE} bytes. Send a canonical table in "
+                   f"{CODE_TABLE_HEADER}, or the data as a container with the table inside."
+        )
+    try:
+        padding = int(_required_header(request, PADDING_HEADER))
+        if dictionary is not None or code_table is not None:
+            return key, _decode_codes(dictionary, code_table, None), padding
+        huffman_codes = json.loads(_required_header(request, CODES_HEADER))
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"{CODES_HEADER} must be a JSON object and {PADDING_HEADER} an integer.")
+    if not isinstance(huffman_codes, dict) or not all(isinstance(code, str) for code in huffman_codes.values()):
+        raise HTTPException(status_code=400, detail=f"{CODES_HEADER} must be a JSON object.")
+    return key, huffman_codes, padding
+
+async def _run_codec(size: int, func, *args, blocks: bool = False):
+    # Большие запросы идут в пул процессов (см. executor), ошибки кодека превращаются в 400.
+    # blocks - func блочная и сама раздает работу пулу
+    try:
+        if blocks:
+            return await codec_executor.run_blocks(func, *args)
+        return await codec_executor.run(size, func, *args)
+    except ExecutorSaturated:
+        raise HTTPException(status_code=429, detail="Encoder is busy, retry later.", headers={"Retry-After": "1"})
+    except BrokenProcessPool:
+        raise HTTPException(status_code=503, detail="Encoder worker crashed, retry later.", headers={"Retry-After": "1"})
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+async def _parse_json_body(request: Request, model):
+    try:
+        return model.model_validate_json(await request.body())
+    except ValidationError as e:
+        # Тот же формат 422, что FastAPI отдает для тела, разобранного автоматически
+        raise RequestValidationError([{**error, "loc": ("body", *error["loc"])} for error in e.errors()])
+
+async def _encode_payload(text: str, key: str, shared_codes, index_interval: int = None):
+    # -> (поток, коды, padding, индекс блоков или None).
+    # Очень большие тексты кодируются блоками на всех процессах пула, поток тот же самый
+    if len(text) >= BLOCK_MIN_TEXT_SIZE and codec_executor.workers > 1:
+        payload, huffman_codes, padding, _ = await _run_codec(len(text), encode_bytes_parallel, text, key, shared_codes, blocks=True)
+        block_index = await _run_codec(len(text), build_block_index, text, huffman_codes, index_interval) if index_interval else None
+        return payload, huffman_codes, padding, block_index
+    if index_interval:
+        return await _run_codec(len(text), encode_bytes_indexed, text, key, shared_codes, index_interval)
+    return (*await _run_codec(len(text), encode_bytes, text, key, shared_codes), None)
+
+@router.post("/encode", response_model=EncodeResponse,
+             openapi_extra=_request_body_doc(f"Текст в UTF-8, ключ в заголовке {KEY_HEADER}", EncodeRequest))
+async def encode(request: Request):
+    if _is_binary(request):
+        key = unquote(_required_header(request, KEY_HEADER))
+        dictionary = request.headers.get(DICTIONARY_HEADER)
+        shared_codes = _shared_dictionary(dictionary) if dictionary is not None else None
+        try:
+            text = (await request.body()).decode('utf-8')
+        except UnicodeDecodeError:
+            raise HTTPException(status_code=400, detail="Request body must be UTF-8 text.")
+        payload, huffman_codes, padding, _ = await _encode_payload(text, key, shared_codes)
+        if request.headers.get(CODE_FORMAT_HEADER) == "container":
+            container = pack_container(payload, huffman_codes, len(payload) * 8 - padding)
+            return Response(content=container, media_type=BINARY_MEDIA_TYPE)
+        return Response(
+            content=bytes(payload),
+            media_type=BINARY_MEDIA_TYPE,
+            headers={**_code_headers(request, huffman_codes), PADDING_HEADER: str(padding)}
+        )
+
+    return await _encode_json(await _parse_json_body(request, EncodeRequest))
+
+async def _encode_json(body: EncodeRequest) -> EncodeResponse:
+    shared_codes = _shared_dictionary(body.dictionary) if body.dictionary is not None else None
+    payload, huffman_codes, padding, block_index = await _encode_payload(body.text, body.key, shared_codes, body.index_interval)
+    if body.code_format == "container": # таблица кодов и длина потока внутри encoded_data
+        container = pack_container(payload, huffman_codes, len(payload) * 8 - padding)
+        return EncodeResponse(
+            encoded_data=base64.b64encode(container).decode('utf-8'),
+            key=body.key,
+            padding=padding,
+            dictionary=body.dictionary,
+            block_index=block_index
+        )
     return EncodeResponse(
-        encoded_data=encoded_data,
-        key=key,
-        huffman_codes=huffman_codes,
-        padding=padding
+        encoded_data=base64.b64encode(payload).decode('utf-8'),
+        key=body.key,
+        **code_table_fields(huffman_codes, body.code_format),
+        padding=padding,
+        dictionary=body.dictionary,
+        block_index=block_index
     )
 
-@router.post("/decode", response_model=DecodeResponse)
-async def decode(request: DecodeRequest):
-    decoded_text_result = decode_text(request.encoded_data, request.key, request.huffman_codes, request.padding)
-    return DecodeResponse(decoded_text=decoded_text_result) 
\ No newline at end of file
+@router.post("/decode", response_model=DecodeResponse,
+             openapi_extra=_request_body_doc(f"Зашифрованные байты, ключ/коды/padding в заголовках {KEY_HEADER}, {CODES_HEADER} или {CODE_TABLE_HEADER}, {PADDING_HEADER}; либо контейнер и только ключ", DecodeRequest))
+async def decode(request: Request):
+    if _is_binary(request):
+        if _is_container_request(request):
+            key = unquote(_required_header(request, KEY_HEADER))
+            data = await request.body()
+            decoded_text_result = await _run_codec(len(data), decode_container, data, key)
+        else:
+            key, huffman_codes, padding = _binary_decode_params(request)
+            data = await request.body()
+            decoded_text_result = await _run_codec(len(data), decode_bytes, data, key, huffman_codes, padding)
+        return Response(content=decoded_text_result.encode('utf-8'), media_type=BINARY_MEDIA_TYPE)
+
+    return await _decode_json(await _parse_json_body(request, DecodeRequest))
+
+async def _decode_json(body: DecodeRequest) -> DecodeResponse:
+    if body.dictionary is None and body.code_table is None and body.huffman_codes is None:
+        try:
+            data = base64.b64decode(body.encoded_data)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="encoded_data is not valid base64.")
+        return DecodeResponse(decoded_text=await _run_codec(len(data), decode_container, data, body.key))
+    huffman_codes = _decode_codes(body.dictionary, body.code_table, body.huffman_codes)
+    if body.padding is None:
+        raise HTTPException(status_code=400, detail="padding is required unless encoded_data is a container.")
+    decoded_text_result = await _run_codec(len(body.encoded_data), decode_text, body.encoded_data, body.key, huffman_codes, body.padding)
+    return DecodeResponse(decoded_text=decoded_text_result)
+
+# Частичное декодирование: по индексу блоков из base64 разворачиваются, расшифровываются
+# и декодируются только байты нужного диапазона символов
+@router.post("/decode/range", response_model=DecodeRangeResponse)
+async def decode_range(body: DecodeRangeRequest):
+    # Работа пропорциональна диапазону, а не всему encoded_data; без end - до конца текста
+    size = body.end - body.start if body.end is not None else len(body.encoded_data)
+    if body.dictionary is None and body.code_table is None and body.huffman_codes is None:
+        decoded_text = await _run_codec(
+            size, decode_container_range_base64, body.encoded_data, body.key, body.block_index, body.start, body.end
+        )
+    else:
+        huffman_codes = _decode_codes(body.dictionary, body.code_table, body.huffman_codes)
+        if body.padding is None:
+            raise HTTPException(status_code=400, detail="padding is required unless encoded_data is a container.")
+        decoded_text = await _run_codec(
+            size, decode_range_base64, body.encoded_data, body.key, huffman_codes, body.padding,
+            body.block_index, body.start, body.end
+        )
+    return DecodeRangeResponse(decoded_text=decoded_text, start=body.start, end=body.start + len(decoded_text))
+
+# Пакетный режим: элементы обрабатываются теми же функциями, что и одиночные запросы,
+# ошибка одного элемента не валит весь пакет. Маленькие элементы выполняются inline,
+# поэтому между ними отдаем управление event loop, большие уходят в пул процессов
+BATCH_MAX_ITEMS = 50_000
+
+async def _run_batch(items, handle, item_result_model):
+    started = time.perf_counter()
+    results = []
+    failed = 0
+    for index, item in enumerate(items):
+        await asyncio.sleep(0)
+        try:
+            results.append(item_result_model(index=index, result=await handle(item)))
+        except HTTPException as e:
+            results.append(item_result_model(index=index, error=str(e.detail)))
+            failed += 1
+        except Exception as e:
+            results.append(item_result_model(index=index, error=str(e)))
+            failed += 1
+    elapsed = time.perf_counter() - started
+    return {
+        "items": results,
+        "succeeded": len(results) - failed,
+        "failed": failed,
+        "elapsed_seconds": elapsed,
+        "items_per_second": len(results) / elapsed if elapsed > 0 else 0.0,
+    }
+
+def _check_batch_size(items):
+    if len(items) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"Batch is limited to {BATCH_MAX_ITEMS} items.")
+
+@router.post("/encode/batch", response_model=EncodeBatchResponse)
+async def encode_batch(request: EncodeBatchRequest):
+    _check_batch_size(request.items)
+    return EncodeBatchResponse(**await _run_batch(request.items, _encode_json, EncodeBatchItemResult))
+
+@router.post("/decode/batch", response_model=DecodeBatchResponse)
+async def decode_batch(request: DecodeBatchRequest):
+    _check_batch_size(request.items)
+    return DecodeBatchResponse(**await _run_batch(request.items, _decode_json, DecodeBatchItemResult))
+
+# Потоковый режим для больших текстов: загрузка копится во временном файле
+# (в памяти только первые STREAM_SPOOL_MEMORY байт), ответ отдается кусками
+STREAM_SPOOL_MEMORY = 8 << 20
+
+def _spool_chunk(spool, chunk: bytes, text_decoder=None, frequency: Counter = None):
+    spool.write(chunk)
+    if frequency is not None:
+        frequency.update(text_decoder.decode(chunk))
+
+async def _spool_upload(request: Request, frequency: Counter = None):
+    # Первый проход по загрузке: складываем ее на диск и, если нужно, считаем частоты
+    spool = tempfile.SpooledTemporaryFile(max_size=STREAM_SPOOL_MEMORY)
+    text_decoder = codecs.getincrementaldecoder('utf-8')()
+    try:
+        async for chunk in request.stream():
+            await run_in_threadpool(_spool_chunk, spool, chunk, text_decoder, frequency)
+        if frequency is not None:
+            frequency.update(text_decoder.decode(b"", final=True))
+    except UnicodeDecodeError:
+        spool.close()
+        raise HTTPException(status_code=400, detail="Request body must be UTF-8 text.")
+    except BaseException:
+        spool.close()
+        raise
+    spool.seek(0)
+    return spool
+
+def _close_after(chunks, spool):
+    try:
+        yield from chunks
+    finally:
+        spool.close()
+
+@router.post("/stream/encode", response_class=StreamingResponse,
+             openapi_extra=_request_body_doc(f"Текст в UTF-8 (chunked), ключ в заголовке {KEY_HEADER}"))
+async def encode_stream(request: Request):
+    key = unquote(_required_header(request, KEY_HEADER))
+    dictionary = request.headers.get(DICTIONARY_HEADER)
+    shared_codes = _shared_dictionary(dictionary) if dictionary is not None else None
+    frequency = Counter()
+    spool = await _spool_upload(request, frequency)
+    if shared_codes is None:
+        huffman_codes = cached_huffman_codes(frequency)
+    else:
+        huffman_codes = shared_codes
+        try:
+            check_codes_cover(frequency, huffman_codes)
+        except ValueError as e:
+            spool.close()
+            raise HTTPException(status_code=400, detail=str(e))
+    bit_length = encoded_bit_length(frequency, huffman_codes)
+    if request.headers.get(CODE_FORMAT_HEADER) == "container":
+        return StreamingResponse(
+            _close_after(iter_container_chunks(spool, huffman_codes, key, bit_length), spool),
+            media_type=BINARY_MEDIA_TYPE,
+            headers={"Content-Length": str(container_stream_size(huffman_codes, bit_length))}
+        )
+    try:
+        code_headers = _code_headers(request, huffman_codes)
+    except HTTPException:
+        spool.close()
+        raise
+    return StreamingResponse(
+        _close_after(iter_encoded_chunks(spool, huffman_codes, key), spool),
+        media_type=BINARY_MEDIA_TYPE,
+        headers={
+            **code_headers,
+            PADDING_HEADER: str(-bit_length % 8),
+            "Content-Length": str((bit_length + 7) // 8),
+        }
+    )
+
+@router.post("/stream/decode", response_class=StreamingResponse,
+             openapi_extra=_request_body_doc(f"Зашифрованные байты (chunked), ключ/коды/padding в заголовках {KEY_HEADER}, {CODES_HEADER} или {CODE_TABLE_HEADER}, {PADDING_HEADER}; либо контейнер и только ключ"))
+async def decode_stream(request: Request):
+    if _is_container_request(request):
+        key = unquote(_required_header(request, KEY_HEADER))
+        spool = await _spool_upload(request)
+        try:
+            huffman_codes, padding, size = await run_in_threadpool(open_container_stream, spool)
+        except ValueError as e:
+            spool.close()
+            raise HTTPException(status_code=400, detail=str(e))
+    else:
+        key, huffman_codes, padding = _binary_decode_params(request)
+        spool = await _spool_upload(request)
+        size = None
+    return StreamingResponse(
+        _close_after(iter_decoded_chunks(spool, huffman_codes, key, padding, size), spool),
+        media_type=BINARY_MEDIA_TYPE
+    )
+
+@router.put("/dictionaries/{name}", response_model=SharedDictionaryResponse)
+async def put_shared_dictionary(name: str, request: SharedDictionaryRequest):
+    if request.huffman_codes is not None:
+        huffman_codes = request.huffman_codes
+        try:
+            validate_codes(huffman_codes)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    elif request.sample_text:
+        _, huffman_codes = build_huffman_tree(request.sample_text)
+    else:
+        raise HTTPException(status_code=400, detail="Either huffman_codes or sample_text is required.")
+    shared_dictionaries.put(name, huffman_codes)
+    return SharedDictionaryResponse(name=name, huffman_codes=huffman_codes)
+
+@router.get("/dictionaries", response_model=SharedDictionaryListResponse)
+async def list_shared_dictionaries():
+    return SharedDictionaryListResponse(dictionaries=shared_dictionaries.names())
+
+@router.get("/dictionaries/{name}", response_model=SharedDictionaryResponse)
+async def get_shared_dictionary(name: str):
+    return SharedDictionaryResponse(name=name, huffman_codes=_shared_dictionary(name))
+
+@router.delete("/dictionaries/{name}")
+async def delete_shared_dictionary(name: str):
+    if not shared_dictionaries.delete(name):
+        raise HTTPException(status_code=404, detail=f"Shared dictionary '{name}' not found.")
+    return {"status": "deleted", "name": name}
+
+@router.get("/cache/stats", response_model=CodeCacheStatsResponse)
+async def code_cache_stats():
+    return CodeCacheStatsResponse(huffman_codes=huffman_code_cache.stats(), decode_tables=decode_table_cache.stats())
+
+@router.get("/executor/stats", response_model=ExecutorStatsResponse)
+async def executor_stats():
+    return ExecutorStatsResponse(**codec_executor.stats())
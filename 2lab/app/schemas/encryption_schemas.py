@@ -1,21 +1,112 @@
-from pydantic import BaseModel
-from typing import Dict
+from pydantic import BaseModel, Field
+from typing import Dict, List, Literal, Optional, Tuple
 
 class EncodeRequest(BaseModel):
     text: str
     key: str
+    dictionary: Optional[str] = None # имя общего словаря вместо построения дерева
+    # compact: в ответе code_table вместо huffman_codes;
+    # container: encoded_data - контейнер (base64) с таблицей и длиной потока внутри
+    code_format: Literal["map", "compact", "container"] = "map"
+    # Контрольная точка индекса для частичного декодирования каждые index_interval символов
+    index_interval: Optional[int] = Field(None, ge=1024)
 
 class EncodeResponse(BaseModel):
     encoded_data: str
     key: str
-    huffman_codes: Dict[str, str]
+    huffman_codes: Optional[Dict[str, str]] = None
+    code_table: Optional[str] = None
     padding: int
+    dictionary: Optional[str] = None
+    block_index: Optional[List[Tuple[int, int]]] = None # [(символ, бит), ...] при index_interval
 
 class DecodeRequest(BaseModel):
-    encoded_data: str
+    encoded_data: str # без таблицы кодов ожидается контейнер
     key: str
-    huffman_codes: Dict[str, str]
-    padding: int
+    huffman_codes: Optional[Dict[str, str]] = None # можно не передавать, если указан dictionary или code_table
+    padding: Optional[int] = None # для контейнера не нужен
+    dictionary: Optional[str] = None
+    code_table: Optional[str] = None # компактная таблица (base64) из ответа с code_format="compact"
 
 class DecodeResponse(BaseModel):
-    decoded_text: str 
\ No newline at end of file
+    decoded_text: str
+
+class DecodeRangeRequest(DecodeRequest):
+    block_index: List[Tuple[int, int]] # из ответа на кодирование с index_interval
+    start: int = Field(0, ge=0) # символы [start, end)
+    end: Optional[int] = Field(None, ge=0) # None - до конца текста
+
+class DecodeRangeResponse(BaseModel):
+    decoded_text: str
+    start: int
+    end: int
+
+# Пакетный режим: массив обычных запросов, результат или ошибка по каждому элементу
+
+class EncodeBatchRequest(BaseModel):
+    items: List[EncodeRequest] = Field(..., min_length=1)
+
+class EncodeBatchItemResult(BaseModel):
+    index: int
+    result: Optional[EncodeResponse] = None
+    error: Optional[str] = None
+
+class EncodeBatchResponse(BaseModel):
+    items: List[EncodeBatchItemResult]
+    succeeded: int
+    failed: int
+    elapsed_seconds: float
+    items_per_second: float
+
+class DecodeBatchRequest(BaseModel):
+    items: List[DecodeRequest] = Field(..., min_length=1)
+
+class DecodeBatchItemResult(BaseModel):
+    index: int
+    result: Optional[DecodeResponse] = None
+    error: Optional[str] = None
+
+class DecodeBatchResponse(BaseModel):
+    items: List[DecodeBatchItemResult]
+    succeeded: int
+    failed: int
+    elapsed_seconds: float
+    items_per_second: float
+
+class SharedDictionaryRequest(BaseModel):
+    # Либо готовая таблица кодов, либо образец текста, по которому она строится
+    huffman_codes: Optional[Dict[str, str]] = None
+    sample_text: Optional[str] = None
+
+class SharedDictionaryResponse(BaseModel):
+    name: str
+    huffman_codes: Dict[str, str]
+
+class SharedDictionaryListResponse(BaseModel):
+    dictionaries: List[str]
+
+class CacheStats(BaseModel):
+    size: int
+    max_entries: int
+    hits: int
+    misses: int
+    evictions: int
+
+class CodeCacheStatsResponse(BaseModel):
+    huffman_codes: CacheStats
+    decode_tables: CacheStats
+
+class LatencyHistogramStats(BaseModel):
+    count: int
+    mean_ms: Optional[float] = None
+    p50_ms: Optional[float] = None # верхняя граница корзины
+    p99_ms: Optional[float] = None
+    buckets: Dict[str, int]
+
+class ExecutorStatsResponse(BaseModel):
+    inline_max_size: int
+    workers: int
+    max_pending: int
+    pending: int
+    rejected: int
+    latency: Dict[str, LatencyHistogramStats] # inline, pool, loop_lag
@@ -0,0 +1,154 @@
+import base64
+from bisect import bisect_left, bisect_right
+from collections import Counter
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+from app.services.encryption_service import (
+    cached_huffman_codes, cached_decode_table, check_codes_cover, pack_codes, xor_cipher_inplace,
+    decode_bits_from, encode_bytes
+)
+from app.services.container import CONTAINER_HEADER, is_container, read_container_header
+
+# Блочный режим для больших текстов: текст режется на блоки по BLOCK_SIZE символов,
+# частоты считаются и блоки упаковываются параллельно в пуле процессов. Длина каждого
+# блока в битах известна заранее по его частотам, поэтому блоки сразу кодируются со своего
+# битового смещения и склеиваются в тот же поток, что и при обычном кодировании
+BLOCK_SIZE = 1 << 20
+# Меньше - пересылка текста в процессы стоит дороже выигрыша
+BLOCK_MIN_TEXT_SIZE = 4 * BLOCK_SIZE
+
+def split_blocks(text: str, block_size: int = BLOCK_SIZE) -> List[str]:
+    return [text[start:start + block_size] for start in range(0, len(text), block_size)]
+
+def _shift_right(data: bytearray, shift: int, bit_length: int) -> bytearray:
+    # Сдвигает поток на shift (< 8) бит вправо: впереди shift нулевых бит
+    value = int.from_bytes(data, 'big') << (8 - shift)
+    size = (shift + bit_length + 7) // 8
+    return bytearray(value.to_bytes(len(data) + 1, 'big')[:size])
+
+def _encode_block(args: Tuple[str, Dict[str, str], int, str]) -> bytearray:
+    # -> байты потока с start_bit // 8 по последний байт блока, уже зашифрованные.
+    # Байт на стыке двух блоков шифрует тот блок, которому принадлежит старший бит байта,
+    # второй кладет свои биты как есть: биты не пересекаются, так что при склейке хватает XOR
+    block, huffman_codes, start_bit, key = args
+    out, bit_length = pack_codes(block, huffman_codes)
+    shift = start_bit & 7
+    if shift:
+        out = _shift_right(out, shift, bit_length)
+    skip = 1 if shift else 0
+    with memoryview(out) as view:
+        xor_cipher_inplace(view[skip:], key, (start_bit >> 3) + skip)
+    return out
+
+def block_bit_length(frequency: Dict[str, int], huffman_codes: Dict[str, str]) -> int:
+    return sum(count * len(huffman_codes[char]) for char, count in frequency.items())
+
+def encode_bytes_parallel(text: str, key: str, huffman_codes: Optional[Dict[str, str]], executor,
+                          block_size: int = BLOCK_SIZE) -> Tuple[bytearray, Dict[str, str], int, List[Tuple[int, int]]]:
+    # То же, что encode_bytes, плюс индекс блоков [(смещение в символах, смещение в битах)].
+    # executor - любой пул с map(func, iterable): ProcessPoolExecutor или пул billiard
+    if not text:
+        return bytearray(), huffman_codes or {}, 0, []
+    blocks = split_blocks(text, block_size)
+    block_frequencies = list(executor.map(Counter, blocks))
+    frequency = Counter()
+    for block_frequency in block_frequencies:
+        frequency.update(block_frequency)
+    if huffman_codes is None:
+        huffman_codes = cached_huffman_codes(frequency)
+    else:
+        check_codes_cover(frequency, huffman_codes)
+
+    starts = []
+    bit_length = 0
+    for block_frequency in block_frequencies:
+        starts.append(bit_length)
+        bit_length += block_bit_length(block_frequency, huffman_codes)
+
+    jobs = [(block, huffman_codes, start, key) for block, start in zip(blocks, starts)]
+    payload = bytearray((bit_length + 7) // 8)
+    for start, out in zip(starts, executor.map(_encode_block, jobs)):
+        pos = start >> 3
+        if start & 7:
+            payload[pos] ^= out[0]
+            payload[pos + 1:pos + len(out)] = memoryview(out)[1:]
+        else:
+            payload[pos:pos + len(out)] = out
+    block_index = [(i * block_size, start) for i, start in enumerate(starts)]
+    return payload, huffman_codes, -bit_length % 8, block_index
+
+# Индекс для частичного декодирования: контрольные точки (символ, бит) каждые interval символов.
+# Байт потока зависит только от своих бит и позиции в ключе, поэтому кусок между двумя
+# точками расшифровывается и декодируется сам по себе, без всего, что перед ним
+
+def build_block_index(text: str, huffman_codes: Dict[str, str], interval: int) -> List[Tuple[int, int]]:
+    index = []
+    bit_offset = 0
+    for start in range(0, len(text), interval):
+        index.append((start, bit_offset))
+        bit_offset += block_bit_length(Counter(text[start:start + interval]), huffman_codes)
+    return index
+
+def encode_bytes_indexed(text: str, key: str, huffman_codes: Optional[Dict[str, str]],
+                         interval: int) -> Tuple[bytearray, Dict[str, str], int, List[Tuple[int, int]]]:
+    payload, huffman_codes, padding = encode_bytes(text, key, huffman_codes)
+    return payload, huffman_codes, padding, build_block_index(text, huffman_codes, interval)
+
+def _check_block_index(block_index: Sequence[Sequence[int]], bit_length: int) -> List[int]:
+    # -> смещения точек в символах
+    if not block_index or tuple(block_index[0]) != (0, 0):
+        raise ValueError("Block index must start at (0, 0)")
+    offsets = []
+    previous_bit = 0
+    for char_offset, bit_offset in block_index:
+        if offsets and char_offset <= offsets[-1] or bit_offset < previous_bit or bit_offset > bit_length:
+            raise ValueError("Block index does not match encoded data")
+        offsets.append(char_offset)
+        previous_bit = bit_offset
+    return offsets
+
+def decode_range(read: Callable[[int, int], bytes], key: str, huffman_codes: Dict[str, str], bit_length: int,
+                 block_index: Sequence[Sequence[int]], start: int, end: Optional[int] = None) -> str:
+    # Символы [start, end) текста. read(a, b) отдает байты потока [a, b): читаются только
+    # байты от точки перед start до точки после end
+    if start < 0 or end is not None and end < start:
+        raise ValueError("Invalid character range")
+    decode_table = cached_decode_table(huffman_codes) if huffman_codes else None
+    if start == end or decode_table is None or bit_length <= 0:
+        return ""
+    offsets = _check_block_index(block_index, bit_length)
+    first = bisect_right(offsets, start) - 1
+    last = bisect_left(offsets, end) if end is not None else len(offsets)
+    first_char, first_bit = block_index[first]
+    last_bit = block_index[last][1] if last < len(offsets) else bit_length
+    byte_start = first_bit >> 3
+    chunk = bytearray(read(byte_start, (last_bit + 7) >> 3))
+    xor_cipher_inplace(chunk, key, byte_start)
+    text = decode_bits_from(chunk, first_bit & 7, last_bit - byte_start * 8, decode_table)[0]
+    return text[start - first_char:end - first_char if end is not None else None]
+
+def base64_payload_size(encoded_data: str) -> int:
+    return len(encoded_data) // 4 * 3 - encoded_data[-2:].count("=")
+
+def base64_slice(encoded_data: str, start: int, end: int) -> bytes:
+    # Байты [start, end) без декодирования всей строки: 3 байта - 4 символа base64
+    group = start // 3
+    data = base64.b64decode(encoded_data[group * 4:-(-end // 3) * 4])
+    return data[start - group * 3:end - group * 3]
+
+def decode_range_base64(encoded_data: str, key: str, huffman_codes: Dict[str, str], padding: int,
+                        block_index: Sequence[Sequence[int]], start: int, end: Optional[int] = None) -> str:
+    bit_length = base64_payload_size(encoded_data) * 8 - max(padding, 0)
+    return decode_range(lambda a, b: base64_slice(encoded_data, a, b), key, huffman_codes, bit_length, block_index, start, end)
+
+def decode_container_range_base64(encoded_data: str, key: str, block_index: Sequence[Sequence[int]],
+                                  start: int, end: Optional[int] = None) -> str:
+    # Из контейнера читаются заголовок, таблица и нужный кусок данных. CRC32 считается
+    # по всем данным, поэтому при частичном чтении не проверяется
+    header = base64_slice(encoded_data, 0, CONTAINER_HEADER.size)
+    if len(header) < CONTAINER_HEADER.size or not is_container(header):
+        raise ValueError("Data is not an encrypted container")
+    table_size = CONTAINER_HEADER.unpack(header)[3]
+    huffman_codes, bit_length, data_start, _ = read_container_header(base64_slice(encoded_data, 0, CONTAINER_HEADER.size + table_size))
+    read = lambda a, b: base64_slice(encoded_data, data_start + a, data_start + b)
+    return decode_range(read, key, huffman_codes, bit_length, block_index, start, end)
+
@@ -0,0 +1,88 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Optional
+
+CODE_CACHE_MAX_ENTRIES = 256
+CODE_CACHE_TTL_SECONDS = 600.0
+
+def frequency_fingerprint(frequency: Dict[str, int]) -> str:
+    # Одинаковая гистограмма частот дает один и тот же отпечаток, порядок символов не важен
+    return hashlib.blake2b(repr(sorted(frequency.items())).encode('utf-8', 'surrogatepass'), digest_size=16).hexdigest()
+
+def codes_fingerprint(codes: Dict[str, str]) -> str:
+    return hashlib.blake2b(repr(sorted(codes.items())).encode('utf-8', 'surrogatepass'), digest_size=16).hexdigest()
+
+class CodeTableCache:
+    # LRU с TTL для таблиц кодов. Значения общие для всех запросов, менять их нельзя
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_or_build(self, key: str, build: Callable):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            if entry is not None: # Протухла по TTL
+                del self._entries[key]
+                self.evictions += 1
+            self.misses += 1
+
+        value = build()
+        with self._lock:
+            self._entries[key] = (value, now + self.ttl_seconds)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+class SharedDictionaryRegistry:
+    # Именованные таблицы кодов от клиентов: кодирование по ним не строит дерево вовсе
+    def __init__(self):
+        self._dictionaries: Dict[str, Dict[str, str]] = {}
+        self._lock = threading.Lock()
+
+    def put(self, name: str, codes: Dict[str, str]):
+        with self._lock:
+            self._dictionaries[name] = dict(codes)
+
+    def get(self, name: str) -> Optional[Dict[str, str]]:
+        with self._lock:
+            return self._dictionaries.get(name)
+
+    def delete(self, name: str) -> bool:
+        with self._lock:
+            return self._dictionaries.pop(name, None) is not None
+
+    def names(self):
+        with self._lock:
+            return sorted(self._dictionaries)
+
+huffman_code_cache = CodeTableCache(CODE_CACHE_MAX_ENTRIES, CODE_CACHE_TTL_SECONDS)
+decode_table_cache = CodeTableCache(CODE_CACHE_MAX_ENTRIES, CODE_CACHE_TTL_SECONDS)
+shared_dictionaries = SharedDictionaryRegistry()
@@ -0,0 +1,96 @@
+import base64
+from typing import Dict, Optional
+from app.services.encryption_service import canonical_codes
+
+# Компактная таблица кодов вместо JSON-словаря {символ: "0101..."}. Канонический код
+# целиком задается длинами, поэтому передаем только их:
+#   байт 0     - версия формата
+#   байт 1     - максимальная длина кода L
+#   L varint   - сколько кодов каждой длины 1..L
+#   остальное  - символы в UTF-8 в каноническом порядке (по длине, затем по символу)
+CODE_TABLE_VERSION = 1
+
+def write_varint(out: bytearray, value: int):
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+def read_varint(data: bytes, pos: int):
+    value = 0
+    shift = 0
+    while True:
+        if pos >= len(data):
+            raise ValueError("Code table is truncated")
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+
+def pack_code_table(codes: Dict[str, str]) -> Optional[bytes]:
+    # Неканоническую таблицу (например, общий словарь от клиента) так не передать - отдаем None
+    lengths = {char: len(code) for char, code in codes.items()}
+    if not codes or canonical_codes(lengths) != codes:
+        return None
+    max_length = max(lengths.values())
+    if max_length > 0xFF:
+        return None
+    counts = [0] * (max_length + 1)
+    for length in lengths.values():
+        counts[length] += 1
+
+    out = bytearray((CODE_TABLE_VERSION, max_length))
+    for length in range(1, max_length + 1):
+        write_varint(out, counts[length])
+    out += "".join(sorted(codes, key=lambda char: (lengths[char], char))).encode('utf-8', 'surrogatepass')
+    return bytes(out)
+
+def unpack_code_table(data: bytes) -> Dict[str, str]:
+    if len(data) < 2 or data[0] != CODE_TABLE_VERSION:
+        raise ValueError("Unsupported code table format")
+    max_length = data[1]
+    pos = 2
+    counts = []
+    for _ in range(max_length):
+        count, pos = read_varint(data, pos)
+        counts.append(count)
+    try:
+        symbols = data[pos:].decode('utf-8', 'surrogatepass')
+    except UnicodeDecodeError:
+        raise ValueError("Code table symbols are not valid UTF-8")
+    if len(symbols) != sum(counts) or len(set(symbols)) != len(symbols):
+        raise ValueError("Code table symbol count does not match code lengths")
+
+    # Коды раздаем по порядку, как при построении канонического кода
+    codes: Dict[str, str] = {}
+    code = 0
+    i = 0
+    for length, count in enumerate(counts, 1):
+        if count and code + count > (1 << length):
+            raise ValueError("Code lengths do not form a prefix code")
+        for _ in range(count):
+            codes[symbols[i]] = format(code, f'0{length}b')
+            code += 1
+            i += 1
+        code <<= 1
+    if not codes:
+        raise ValueError("Code table is empty")
+    return codes
+
+def code_table_to_base64(codes: Dict[str, str]) -> Optional[str]:
+    packed = pack_code_table(codes)
+    return base64.b64encode(packed).decode('ascii') if packed is not None else None
+
+def code_table_from_base64(code_table: str) -> Dict[str, str]:
+    return unpack_code_table(base64.b64decode(code_table, validate=True))
+
+def code_table_fields(codes: Dict[str, str], code_format: str = "map") -> Dict[str, Optional[object]]:
+    # Поля ответа под выбранный клиентом формат. Неканоническую таблицу
+    # компактно не записать, тогда остается старый словарь
+    if code_format == "compact":
+        code_table = code_table_to_base64(codes)
+        if code_table is not None:
+            return {"huffman_codes": None, "code_table": code_table}
+    return {"huffman_codes": codes, "code_table": None}
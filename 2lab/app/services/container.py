@@ -0,0 +1,98 @@
+import base64
+import json
+import struct
+import zlib
+from typing import Dict, Optional, Tuple
+from app.services.code_table import pack_code_table, unpack_code_table
+from app.services.encryption_service import encode_bytes, decode_bytes, validate_codes
+
+# Самодостаточный контейнер: все, что нужно для расшифровки (кроме ключа), в одном блобе.
+#   заголовок  CONTAINER_HEADER: magic, версия, флаги, длина таблицы, длина потока в битах
+#   таблица    компактная (см. code_table) или JSON-словарь, если код неканонический
+#   данные     (bit_length + 7) // 8 байт зашифрованного потока
+#   CRC32      4 байта над данными, если выставлен FLAG_CHECKSUM. Стоит в конце,
+#              чтобы контейнер можно было отдавать потоком, не зная сумму заранее
+CONTAINER_MAGIC = b"HUFX"
+CONTAINER_VERSION = 1
+CONTAINER_HEADER = struct.Struct("<4sBBIQ")
+CHECKSUM_SIZE = 4
+FLAG_CHECKSUM = 0x01
+FLAG_JSON_CODES = 0x02
+
+def is_container(data: bytes) -> bool:
+    return bytes(data[:len(CONTAINER_MAGIC)]) == CONTAINER_MAGIC
+
+def is_base64_container(encoded_data: str) -> bool:
+    # Смотрим только на первые байты, весь base64 не разворачиваем
+    try:
+        return is_container(base64.b64decode(encoded_data[:8]))
+    except ValueError:
+        return False
+
+def container_header(huffman_codes: Dict[str, str], bit_length: int, checksum: bool = True) -> bytes:
+    flags = FLAG_CHECKSUM if checksum else 0
+    table = pack_code_table(huffman_codes) if huffman_codes else b""
+    if table is None:
+        table = json.dumps(huffman_codes, ensure_ascii=False).encode('utf-8', 'surrogatepass')
+        flags |= FLAG_JSON_CODES
+    return CONTAINER_HEADER.pack(CONTAINER_MAGIC, CONTAINER_VERSION, flags, len(table), bit_length) + table
+
+def checksum_trailer(crc: int) -> bytes:
+    return struct.pack("<I", crc & 0xFFFFFFFF)
+
+def pack_container(payload, huffman_codes: Dict[str, str], bit_length: int, checksum: bool = True) -> bytes:
+    parts = [container_header(huffman_codes, bit_length, checksum), payload]
+    if checksum:
+        parts.append(checksum_trailer(zlib.crc32(payload)))
+    return b"".join(parts)
+
+def read_container_header(data: bytes) -> Tuple[Dict[str, str], int, int, int]:
+    # -> (коды, длина потока в битах, смещение данных, флаги). Хватает начала контейнера
+    if len(data) < CONTAINER_HEADER.size or not is_container(data):
+        raise ValueError("Data is not an encrypted container")
+    _, version, flags, table_size, bit_length = CONTAINER_HEADER.unpack_from(data)
+    if version != CONTAINER_VERSION:
+        raise ValueError(f"Unsupported container version {version}")
+    start = CONTAINER_HEADER.size + table_size
+    if len(data) < start:
+        raise ValueError("Container is truncated")
+    table = bytes(data[CONTAINER_HEADER.size:start])
+    if not table:
+        huffman_codes = {}
+    elif flags & FLAG_JSON_CODES:
+        try:
+            huffman_codes = json.loads(table.decode('utf-8', 'surrogatepass'))
+        except ValueError:
+            raise ValueError("Container code table is not valid JSON")
+        if not isinstance(huffman_codes, dict):
+            raise ValueError("Container code table is not valid JSON")
+        try: # таблицу из чужого контейнера проверяем так же, как общий словарь
+            validate_codes(huffman_codes)
+        except ValueError as e:
+            raise ValueError(f"Invalid container code table: {e}")
+    else:
+        huffman_codes = unpack_code_table(table)
+    return huffman_codes, bit_length, start, flags
+
+def container_payload_size(bit_length: int) -> int:
+    return (bit_length + 7) // 8
+
+def unpack_container(data: bytes) -> Tuple[Dict[str, str], int, memoryview]:
+    # Данные отдаются срезом memoryview без копирования
+    huffman_codes, bit_length, start, flags = read_container_header(data)
+    end = start + container_payload_size(bit_length)
+    expected = end + (CHECKSUM_SIZE if flags & FLAG_CHECKSUM else 0)
+    if len(data) != expected:
+        raise ValueError("Container size does not match its header")
+    payload = memoryview(data)[start:end]
+    if flags & FLAG_CHECKSUM and checksum_trailer(zlib.crc32(payload)) != bytes(data[end:expected]):
+        raise ValueError("Container checksum mismatch")
+    return huffman_codes, bit_length, payload
+
+def encode_container(text: str, key: str, huffman_codes: Optional[Dict[str, str]] = None, checksum: bool = True) -> bytes:
+    payload, huffman_codes, padding = encode_bytes(text, key, huffman_codes)
+    return pack_container(payload, huffman_codes, len(payload) * 8 - padding, checksum)
+
+def decode_container(data: bytes, key: str) -> str:
+    huffman_codes, bit_length, payload = unpack_container(data)
+    return decode_bytes(bytearray(payload), key, huffman_codes, len(payload) * 8 - bit_length)
@@ -0,0 +1,152 @@
+import asyncio
+import bisect
+import importlib
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Optional
+
+# Кодек - чистый Python и держит GIL, поэтому большие запросы уходят в пул процессов,
+# иначе один такой запрос останавливает event loop для всех соединений воркера uvicorn.
+# Маленькие выполняются прямо в обработчике: пересылка в процесс стоит дороже самой работы.
+# Настраивается переменными окружения с теми же именами
+EXECUTOR_INLINE_MAX_SIZE = int(os.environ.get("EXECUTOR_INLINE_MAX_SIZE", 64 << 10)) # символов/байт
+EXECUTOR_WORKERS = int(os.environ.get("EXECUTOR_WORKERS", os.cpu_count() or 1)) # 0 - все inline
+# Сколько запросов может одновременно ждать или выполняться в пуле; сверх этого - 429
+EXECUTOR_MAX_PENDING = int(os.environ.get("EXECUTOR_MAX_PENDING", 4 * EXECUTOR_WORKERS))
+
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+class ExecutorSaturated(Exception):
+    pass
+
+def _preload(module_names):
+    for name in module_names:
+        importlib.import_module(name)
+
+class LatencyHistogram:
+    def __init__(self, buckets_ms=LATENCY_BUCKETS_MS):
+        self.buckets_ms = buckets_ms
+        self.counts = [0] * (len(buckets_ms) + 1) # последний - больше самой верхней границы
+        self.count = 0
+        self.total_ms = 0.0
+
+    def observe(self, seconds: float):
+        ms = seconds * 1000
+        self.counts[bisect.bisect_left(self.buckets_ms, ms)] += 1
+        self.count += 1
+        self.total_ms += ms
+
+    def quantile_ms(self, q: float) -> Optional[float]:
+        # Верхняя граница корзины, в которую попадает квантиль
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets_ms, self.counts):
+            seen += count
+            if seen >= rank:
+                return float(bound)
+        return float("inf")
+
+    def snapshot(self) -> Dict:
+        buckets = {f"le_{bound}ms": count for bound, count in zip(self.buckets_ms, self.counts)}
+        buckets["inf"] = self.counts[-1]
+        return {
+            "count": self.count,
+            "mean_ms": self.total_ms / self.count if self.count else None,
+            "p50_ms": self.quantile_ms(0.5),
+            "p99_ms": self.quantile_ms(0.99),
+            "buckets": buckets,
+        }
+
+class CodecExecutor:
+    # Все счетчики меняются только из event loop, поэтому без блокировок
+    def __init__(self, inline_max_size: int, workers: int, max_pending: int):
+        self.inline_max_size = inline_max_size
+        self.workers = workers
+        self.max_pending = max_pending
+        self.pending = 0
+        self.rejected = 0
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self.latency = {"inline": LatencyHistogram(), "pool": LatencyHistogram(), "loop_lag": LatencyHistogram()}
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # spawn: форк процесса с работающим event loop и потоками небезопасен
+            self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+        return self._pool
+
+    def start(self, preload_modules=()):
+        # Поднимаем процессы и импортируем в них кодек заранее, а не на первом большом запросе
+        if self.workers > 0:
+            pool = self._get_pool()
+            for _ in range(self.workers):
+                pool.submit(_preload, tuple(preload_modules))
+
+    async def run(self, size: int, func, *args):
+        # func и аргументы уходят в другой процесс: функция должна быть на уровне модуля,
+        # а ошибки - обычными исключениями (ValueError), HTTPException не переживет pickle
+        started = time.perf_counter()
+        if size < self.inline_max_size or self.workers <= 0:
+            try:
+                return func(*args)
+            finally:
+                self.latency["inline"].observe(time.perf_counter() - started)
+
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise ExecutorSaturated()
+        self.pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._get_pool(), func, *args)
+        except BrokenProcessPool:
+            self._pool = None # процесс пула упал (например, OOM): следующий запрос поднимет новый пул
+            raise
+        finally:
+            self.pending -= 1
+            self.latency["pool"].observe(time.perf_counter() - started)
+
+    async def run_blocks(self, func, *args):
+        # Блочный режим (см. block_codec): func(*args, executor) сама раздает блоки пулу и склеивает результат.
+        # Склейка идет в потоке, чтобы не держать event loop; в очереди это один запрос
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise ExecutorSaturated()
+        self.pending += 1
+        started = time.perf_counter()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(None, func, *args, self._get_pool())
+        except BrokenProcessPool:
+            self._pool = None
+            raise
+        finally:
+            self.pending -= 1
+            self.latency["pool"].observe(time.perf_counter() - started)
+
+    async def monitor_loop_lag(self, interval: float = 0.1):
+        # Насколько позже положенного просыпается event loop - на этом видно,
+        # блокирует ли его кто-то (до пула это были большие запросы)
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(interval)
+            self.latency["loop_lag"].observe(max(time.perf_counter() - started - interval, 0.0))
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def stats(self) -> Dict:
+        return {
+            "inline_max_size": self.inline_max_size,
+            "workers": self.workers,
+            "max_pending": self.max_pending,
+            "pending": self.pending,
+            "rejected": self.rejected,
+            "latency": {name: histogram.snapshot() for name, histogram in self.latency.items()},
+        }
+
+codec_executor = CodecExecutor(EXECUTOR_INLINE_MAX_SIZE, EXECUTOR_WORKERS, EXECUTOR_MAX_PENDING)
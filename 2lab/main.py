@@ -1,10 +1,22 @@
+import asyncio
 from fastapi import FastAPI
 from app.api import encryption_api
+from app.services.executor import codec_executor
 
 app = FastAPI()
 
 app.include_router(encryption_api.router, prefix="/encryption", tags=["encryption"])
 
+@app.on_event("startup")
+async def startup_event():
+    codec_executor.start(preload_modules=("app.services.container",))
+    app.state.loop_lag_monitor = asyncio.create_task(codec_executor.monitor_loop_lag())
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    app.state.loop_lag_monitor.cancel()
+    codec_executor.shutdown()
+
 @app.get("/")
 async def root():
     return {"message": "Encryption service is running"} 
\ No newline at end of file
@@ -1,66 +1,546 @@
-from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Path, HTTPException
+from fastapi import APIRouter, BackgroundTasks, WebSocket, WebSocketDisconnect, Path, Query, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import Response, StreamingResponse
 from app.schemas.encryption_schemas import (
     EncodeRestRequest, EncodeRestResponse, 
-    DecodeRestRequest, DecodeRestResponse
+    DecodeRestRequest, DecodeRestResponse, DecodeRangeRestRequest, DecodeRangeRestResponse,
+    EncodeBatchRestRequest, DecodeBatchRestRequest, BatchRestResponse, TaskStartedMessage, TaskCompletedMessage,
+    SharedDictionaryRequest, SharedDictionaryResponse, SharedDictionaryListResponse, CodeCacheStatsResponse,
+    AdaptiveSessionStart, AdaptiveSessionMessage, NotificationStatsResponse, ConnectionQueueStatsResponse,
+    QueueStatsResponse
+)
+from app.celery.tasks import encode_task, decode_task, encode_batch_chunk, decode_batch_chunk, dispatch_batch
+from app.celery.routing import route_task, queue_stats
+from app.core.config import settings
+from app.services.code_cache import shared_dictionaries, huffman_code_cache, decode_table_cache
+from app.services.encryption_service import build_huffman_tree, cached_huffman_codes, validate_codes, check_codes_cover
+from app.services.code_table import code_table_fields, code_table_from_base64, code_table_to_base64
+from app.services.container import is_base64_container
+from app.services.block_codec import decode_range_base64, decode_container_range_base64
+from app.services.adaptive_codec import AdaptiveSession
+from app.services.result_store import get_result_store
+from app.services.result_cache import result_cache, request_fingerprint
+from app.services.streaming_service import (
+    encoded_bit_length, iter_encoded_chunks, iter_decoded_chunks,
+    container_stream_size, iter_container_chunks, open_container_stream
 )
-from app.celery.tasks import encode_task, decode_task
 from app.websocket.connection_manager import manager
+from app.websocket.event_channel import route_event, delivery_stats
+import codecs
+import json
+import tempfile
 import uuid
-from pydantic import BaseModel
-from typing import Any
+from collections import Counter
+from urllib.parse import unquote
+from pydantic import BaseModel, ValidationError
+from typing import Any, Dict, List, Optional
 
 router = APIRouter()
 
+# Бинарный режим (потоковые эндпоинты): тело - сырые байты, остальное едет в заголовках.
+# Ключ передается в percent-encoding (заголовки только latin-1), коды - JSON объектом
+# или компактной таблицей в base64
+BINARY_MEDIA_TYPE = "application/octet-stream"
+KEY_HEADER = "X-Encryption-Key"
+CODES_HEADER = "X-Huffman-Codes"
+CODE_TABLE_HEADER = "X-Code-Table" # вместо X-Huffman-Codes
+CODE_FORMAT_HEADER = "X-Code-Format" # compact: ответ с X-Code-Table; container: тело - контейнер
+PADDING_HEADER = "X-Padding"
+DICTIONARY_HEADER = "X-Shared-Dictionary" # вместо X-Huffman-Codes
+# Таблица кодов в заголовке не длиннее: больше не пропустят прокси (nginx - 8 КБ на строку
+# заголовка) и сам сервер. Большие алфавиты - компактной таблицей или контейнером
+CODES_HEADER_MAX_SIZE = 8 << 10
+
+def _request_body_doc(binary_description: str) -> dict:
+    content = {BINARY_MEDIA_TYPE: {"schema": {"type": "string", "format": "binary", "description": binary_description}}}
+    return {"requestBody": {"required": True, "content": content}}
+
+def _required_header(request: Request, name: str) -> str:
+    value = request.headers.get(name)
+    if value is None:
+        raise HTTPException(status_code=400, detail=f"Header {name} is required for {BINARY_MEDIA_TYPE} requests.")
+    return value
+
+def _shared_dictionary(name: str):
+    # Может сходить в redis: из обработчиков - через run_in_threadpool
+    codes = shared_dictionaries.get(name)
+    if codes is None:
+        raise HTTPException(status_code=404, detail=f"Shared dictionary '{name}' not found.")
+    return codes
+
+def _decode_codes(dictionary, code_table, huffman_codes):
+    # Таблица для декодирования: общий словарь, компактная таблица или старый словарь кодов
+    if dictionary is not None:
+        return _shared_dictionary(dictionary)
+    if code_table is not None:
+        try:
+            return code_table_from_base64(code_table)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"Invalid code_table: {e}")
+    if huffman_codes is not None:
+        return huffman_codes
+    raise HTTPException(status_code=400, detail="One of huffman_codes, code_table or dictionary is required.")
+
+def _code_headers(request: Request, huffman_codes) -> dict:
+    # Таблица в формате, который просил клиент, а если она не влезает в CODES_HEADER_MAX_SIZE -
+    # в другом (компактная есть только у канонического кода). Не влезает никак - нужен контейнер
+    codes_json = json.dumps(huffman_codes)
+    code_table = code_table_to_base64(huffman_codes)
+    options = [(CODES_HEADER, codes_json), (CODE_TABLE_HEADER, code_table)]
+    if request.headers.get(CODE_FORMAT_HEADER, "map") == "compact":
+        options.reverse()
+    for name, value in options:
+        if value is not None and len(value) <= CODES_HEADER_MAX_SIZE:
+            return {name: value}
+    raise HTTPException(
+        status_code=400,
+        detail=f"Code table does not fit into a {CODES_HEADER_MAX_SIZE}-byte response header; "
+               f"request {CODE_FORMAT_HEADER}: container to get it inside the body."
+    )
+
+def _is_container_request(request: Request) -> bool:
+    # Без таблицы кодов в заголовках тело должно быть контейнером
+    return not any(request.headers.get(name) is not None for name in (CODES_HEADER, CODE_TABLE_HEADER, DICTIONARY_HEADER))
+
+def _binary_decode_params(request: Request):
+    key = unquote(_required_header(request, KEY_HEADER))
+    dictionary = request.headers.get(DICTIONARY_HEADER)
+    code_table = request.headers.get(CODE_TABLE_HEADER)
+    if len(request.headers.get(CODES_HEADER, "")) > CODES_HEADER_MAX_SIZE:
+        raise HTTPException(
+            status_code=431,
+            detail=f"{CODES_HEADER} is longer than {CODES_HEADER_MAX_SIZE} bytes. Send a canonical table in "
+                   f"{CODE_TABLE_HEADER}, or the data as a container with the table inside."
+        )
+    try:
+        padding = int(_required_header(request, PADDING_HEADER))
+        if dictionary is not None or code_table is not None:
+            return key, _decode_codes(dictionary, code_table, None), padding
+        huffman_codes = json.loads(_required_header(request, CODES_HEADER))
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"{CODES_HEADER} must be a JSON object and {PADDING_HEADER} an integer.")
+    if not isinstance(huffman_codes, dict) or not all(isinstance(code, str) for code in huffman_codes.values()):
+        raise HTTPException(status_code=400, detail=f"{CODES_HEADER} must be a JSON object.")
+    return key, huffman_codes, padding
+
 class NotificationPayload(BaseModel):
     client_id: str
     task_id: str
     message_data: dict[str, Any]
+    sent_at: Optional[float] = None # time.time() воркера, для метрики задержки
+
+class NotificationBatch(BaseModel):
+    events: List[NotificationPayload]
+    worker: Optional[Dict[str, int]] = None # счетчики отправителя: pid, sent, retries, failed, dropped
 
 @router.post("/internal/notify_client")
 async def notify_client_endpoint(payload: NotificationPayload):
     try:
-        await manager.send_personal_message_json(
-            data=payload.message_data,
-            client_id=payload.client_id,
-            task_id_for_subscription=payload.task_id 
-        )
+        await route_event(payload.client_id, payload.task_id, payload.message_data, payload.sent_at)
         return {"status": "notification sent to client", "client_id": payload.client_id, "task_id": payload.task_id}
     except Exception as e:
         print(f"Error in /internal/notify_client for client {payload.client_id}, task {payload.task_id}: {e}")
         raise HTTPException(status_code=500, detail=f"Failed to send WebSocket notification to client {payload.client_id}: {str(e)}")
 
+@router.post("/internal/notify_client/batch")
+async def notify_client_batch_endpoint(batch: NotificationBatch):
+    # Ошибка одного события не должна вызывать повтор всей пачки: иначе остальные придут дважды
+    delivered = 0
+    for payload in batch.events:
+        try:
+            await route_event(payload.client_id, payload.task_id, payload.message_data, payload.sent_at)
+            delivered += 1
+        except Exception as e:
+            delivery_stats.errors += 1
+            print(f"Error in /internal/notify_client/batch for client {payload.client_id}, task {payload.task_id}: {e}")
+    if batch.worker and "pid" in batch.worker:
+        delivery_stats.workers[batch.worker["pid"]] = {name: value for name, value in batch.worker.items() if name != "pid"}
+    return {"status": "notifications processed", "received": len(batch.events), "delivered": delivered}
+
+@router.get("/internal/notify_client/stats", response_model=NotificationStatsResponse)
+async def notify_client_stats():
+    return NotificationStatsResponse(**delivery_stats.snapshot())
+
+@router.get("/internal/connections", response_model=ConnectionQueueStatsResponse)
+async def connection_queue_stats(limit: int = Query(100, ge=0, le=10_000, description="Сколько соединений с самой длинной очередью показать")):
+    return ConnectionQueueStatsResponse(**manager.queue_stats(limit))
+
+@router.get("/internal/queues", response_model=QueueStatsResponse)
+async def task_queue_stats(clients: int = Query(20, ge=0, le=10_000, description="Сколько клиентов с наибольшим числом задач показать")):
+    return QueueStatsResponse(**await run_in_threadpool(queue_stats, clients))
+
+# Маленькие задачи выполняются прямо в процессе API: на них очередь, воркер и доставка
+# событий от воркера стоят в сотни раз дороже самой работы. Тот же код задачи (apply),
+# те же события STARTED/PROGRESS/COMPLETED/FAILED по WebSocket, клиент разницы не видит.
+# Запуск - фоном после ответа, так что task_id клиент, как и с Celery, получает первым
+def _run_inline(task, args: tuple, task_id: str):
+    task.apply(args, task_id=task_id)
+
+def _send_task(task, args: tuple, client_id: str, size: int, task_id: str):
+    # route_task и публикация в брокер - запросы к redis, из обработчиков - через run_in_threadpool
+    task.apply_async(args, task_id=task_id, **route_task(client_id, size))
+
+async def _start_task(task, args: tuple, client_id: str, size: int, background_tasks: BackgroundTasks,
+                      task_id: str = None) -> str:
+    # size - длина текста или закодированных данных. -> task_id
+    task_id = task_id or str(uuid.uuid4())
+    if size <= settings.INLINE_MAX_SIZE:
+        background_tasks.add_task(_run_inline, task, args, task_id)
+    else:
+        await run_in_threadpool(_send_task, task, args, client_id, size, task_id)
+    return task_id
+
+# Дедупликация (app/services/result_cache.py): на готовый результат такого же запроса клиент
+# получает новую задачу из STARTED и COMPLETED без Celery, а запрос, совпавший с еще идущей
+# задачей, - ее task_id и подписку на ее события
+def _lookup_result(operation: str, parts: tuple):
+    fingerprint = request_fingerprint(operation, *parts)
+    return fingerprint, result_cache.get(fingerprint)
+
+async def _replay_result(task_id: str, operation: str, client_id: str, cached: dict):
+    await route_event(client_id, task_id, TaskStartedMessage(task_id=task_id, operation=operation).model_dump())
+    await route_event(client_id, task_id, TaskCompletedMessage(task_id=task_id, operation=operation, **cached).model_dump())
+
+async def _start_deduplicated(task, operation: str, args: tuple, parts: tuple, client_id: str, size: int,
+                              background_tasks: BackgroundTasks) -> str:
+    # parts - все, от чего зависит результат. -> task_id
+    if not result_cache.enabled:
+        return await _start_task(task, args, client_id, size, background_tasks)
+    fingerprint, cached = await run_in_threadpool(_lookup_result, operation, parts)
+    if cached is not None:
+        task_id = str(uuid.uuid4())
+        background_tasks.add_task(_replay_result, task_id, operation, client_id, cached)
+        return task_id
+    # Присоединяем только клиента с сокетом в этом процессе: подписка происходит сразу,
+    # и итог задачи не может ее обогнать
+    task_id = result_cache.join(fingerprint) if manager.is_connected(client_id) else None
+    if task_id is not None:
+        await route_event(client_id, task_id, TaskStartedMessage(task_id=task_id, operation=operation).model_dump())
+        return task_id
+    # Задачу отмечаем идущей до отправки: пока apply_async ждет redis в другом потоке,
+    # event loop может успеть получить ее итог
+    task_id = str(uuid.uuid4())
+    result_cache.track(fingerprint, task_id)
+    try:
+        return await _start_task(task, args, client_id, size, background_tasks, task_id)
+    except BaseException:
+        result_cache.untrack(task_id)
+        raise
+
 @router.post("/encode/{client_id}", response_model=EncodeRestResponse)
-async def trigger_encode(request: EncodeRestRequest, client_id: str = Path(..., description="Уникальный ID клиента для WebSocket")):
+async def trigger_encode(request: EncodeRestRequest, background_tasks: BackgroundTasks,
+                         client_id: str = Path(..., description="Уникальный ID клиента для WebSocket")):
     if not client_id:
         raise HTTPException(status_code=400, detail="client_id is required as a path parameter for WebSocket notifications.")
     
-    celery_task = encode_task.delay(request.text, request.key, client_id)
-    return EncodeRestResponse(task_id=celery_task.id, message=f"Encode task {celery_task.id} started for client {client_id}")
+    # Общий словарь передаем задаче готовым: воркеру не нужен доступ к реестру
+    shared_codes = await run_in_threadpool(_shared_dictionary, request.dictionary) if request.dictionary is not None else None
+    task_id = await _start_deduplicated(
+        encode_task, "encode", (request.text, request.key, client_id, shared_codes, request.code_format, request.index_interval),
+        (request.text, request.key, shared_codes, request.code_format, request.index_interval),
+        client_id, len(request.text), background_tasks
+    )
+    return EncodeRestResponse(task_id=task_id, message=f"Encode task {task_id} started for client {client_id}")
+
+def _decode_request_codes(request: DecodeRestRequest):
+    # None - encoded_data это контейнер
+    if request.dictionary is None and request.code_table is None and request.huffman_codes is None:
+        # Контейнер разбирает воркер, здесь только проверяем заголовок
+        if not is_base64_container(request.encoded_data):
+            raise HTTPException(status_code=400, detail="One of huffman_codes, code_table or dictionary is required unless encoded_data is a container.")
+        return None
+    huffman_codes = _decode_codes(request.dictionary, request.code_table, request.huffman_codes)
+    if request.padding is None:
+        raise HTTPException(status_code=400, detail="padding is required unless encoded_data is a container.")
+    return huffman_codes
+
+# Частичное декодирование идет мимо Celery: по индексу блоков читаются только байты
+# нужного диапазона, работы на O(диапазона). Объявлен раньше /decode/{client_id}
+@router.post("/decode/range", response_model=DecodeRangeRestResponse)
+async def decode_range(request: DecodeRangeRestRequest):
+    huffman_codes = await run_in_threadpool(_decode_request_codes, request)
+    try:
+        if huffman_codes is None:
+            decoded_text = await run_in_threadpool(
+                decode_container_range_base64, request.encoded_data, request.key, request.block_index, request.start, request.end
+            )
+        else:
+            decoded_text = await run_in_threadpool(
+                decode_range_base64, request.encoded_data, request.key, huffman_codes, request.padding,
+                request.block_index, request.start, request.end
+            )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return DecodeRangeRestResponse(decoded_text=decoded_text, start=request.start, end=request.start + len(decoded_text))
 
 @router.post("/decode/{client_id}", response_model=DecodeRestResponse)
-async def trigger_decode(request: DecodeRestRequest, client_id: str = Path(..., description="Уникальный ID клиента для WebSocket")):
+async def trigger_decode(request: DecodeRestRequest, background_tasks: BackgroundTasks,
+                         client_id: str = Path(..., description="Уникальный ID клиента для WebSocket")):
     if not client_id:
         raise HTTPException(status_code=400, detail="client_id is required as a path parameter for WebSocket notifications.")
 
-    celery_task = decode_task.delay(
-        request.encoded_data, 
-        request.key, 
-        request.huffman_codes, 
-        request.padding,
-        client_id
+    huffman_codes = await run_in_threadpool(_decode_request_codes, request)
+    task_id = await _start_deduplicated(
+        decode_task, "decode", (request.encoded_data, request.key, huffman_codes, request.padding, client_id),
+        (request.encoded_data, request.key, huffman_codes, request.padding),
+        client_id, len(request.encoded_data), background_tasks
     )
-    return DecodeRestResponse(task_id=celery_task.id, message=f"Decode task {celery_task.id} started for client {client_id}")
+    return DecodeRestResponse(task_id=task_id, message=f"Decode task {task_id} started for client {client_id}")
+
+# Пакеты: словари и таблицы кодов разбираются здесь, как и для одиночных запросов.
+# Элемент, отклоненный на этом шаге, уходит воркеру с готовой ошибкой, чтобы
+# нумерация результатов совпадала с запросом
+
+def _batch_encode_item(item: EncodeRestRequest) -> dict:
+    try:
+        shared_codes = _shared_dictionary(item.dictionary) if item.dictionary is not None else None
+    except HTTPException as e:
+        return {"error": str(e.detail)}
+    return {"text": item.text, "key": item.key, "huffman_codes": shared_codes, "code_format": item.code_format,
+            "index_interval": item.index_interval}
+
+def _batch_decode_item(item: DecodeRestRequest) -> dict:
+    try:
+        huffman_codes = _decode_request_codes(item)
+    except HTTPException as e:
+        return {"error": str(e.detail)}
+    return {"encoded_data": item.encoded_data, "key": item.key, "huffman_codes": huffman_codes, "padding": item.padding}
+
+async def _start_batch(chunk_task, items: list, client_id: str, operation: str) -> BatchRestResponse:
+    if len(items) > settings.BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"Batch is limited to {settings.BATCH_MAX_ITEMS} items.")
+    batch_id = str(uuid.uuid4())
+    # STARTED отправляем до запуска: итоговое событие не должно обогнать подписку.
+    # Через route_event, так как сокет клиента может держать другой процесс API
+    await route_event(client_id, batch_id, TaskStartedMessage(task_id=batch_id, operation=operation).model_dump())
+    chunk_count = await run_in_threadpool(dispatch_batch, batch_id, chunk_task, items, client_id, operation)
+    return BatchRestResponse(
+        task_id=batch_id,
+        item_count=len(items),
+        chunk_count=chunk_count,
+        message=f"Batch {batch_id} of {len(items)} items started for client {client_id}"
+    )
+
+@router.post("/encode/batch/{client_id}", response_model=BatchRestResponse)
+async def trigger_encode_batch(request: EncodeBatchRestRequest, client_id: str = Path(..., description="Уникальный ID клиента для WebSocket")):
+    items = await run_in_threadpool(lambda: [_batch_encode_item(item) for item in request.items])
+    return await _start_batch(encode_batch_chunk, items, client_id, "encode_batch")
+
+@router.post("/decode/batch/{client_id}", response_model=BatchRestResponse)
+async def trigger_decode_batch(request: DecodeBatchRestRequest, client_id: str = Path(..., description="Уникальный ID клиента для WebSocket")):
+    items = await run_in_threadpool(lambda: [_batch_decode_item(item) for item in request.items])
+    return await _start_batch(decode_batch_chunk, items, client_id, "decode_batch")
+
+# Потоковый режим для больших текстов идет мимо Celery: загрузка копится во временном
+# файле (в памяти только первые STREAM_SPOOL_MEMORY байт), ответ отдается кусками
+STREAM_SPOOL_MEMORY = 8 << 20
+
+def _spool_chunk(spool, chunk: bytes, text_decoder=None, frequency: Counter = None):
+    spool.write(chunk)
+    if frequency is not None:
+        frequency.update(text_decoder.decode(chunk))
+
+async def _spool_upload(request: Request, frequency: Counter = None):
+    # Первый проход по загрузке: складываем ее на диск и, если нужно, считаем частоты
+    spool = tempfile.SpooledTemporaryFile(max_size=STREAM_SPOOL_MEMORY)
+    text_decoder = codecs.getincrementaldecoder('utf-8')()
+    try:
+        async for chunk in request.stream():
+            await run_in_threadpool(_spool_chunk, spool, chunk, text_decoder, frequency)
+        if frequency is not None:
+            frequency.update(text_decoder.decode(b"", final=True))
+    except UnicodeDecodeError:
+        spool.close()
+        raise HTTPException(status_code=400, detail="Request body must be UTF-8 text.")
+    except BaseException:
+        spool.close()
+        raise
+    spool.seek(0)
+    return spool
+
+def _close_after(chunks, spool):
+    try:
+        yield from chunks
+    finally:
+        spool.close()
+
+@router.post("/stream/encode", response_class=StreamingResponse,
+             openapi_extra=_request_body_doc(f"Текст в UTF-8 (chunked), ключ в заголовке {KEY_HEADER}"))
+async def encode_stream(request: Request):
+    key = unquote(_required_header(request, KEY_HEADER))
+    dictionary = request.headers.get(DICTIONARY_HEADER)
+    shared_codes = await run_in_threadpool(_shared_dictionary, dictionary) if dictionary is not None else None
+    frequency = Counter()
+    spool = await _spool_upload(request, frequency)
+    if shared_codes is None:
+        huffman_codes = cached_huffman_codes(frequency)
+    else:
+        huffman_codes = shared_codes
+        try:
+            check_codes_cover(frequency, huffman_codes)
+        except ValueError as e:
+            spool.close()
+            raise HTTPException(status_code=400, detail=str(e))
+    bit_length = encoded_bit_length(frequency, huffman_codes)
+    if request.headers.get(CODE_FORMAT_HEADER) == "container":
+        return StreamingResponse(
+            _close_after(iter_container_chunks(spool, huffman_codes, key, bit_length), spool),
+            media_type=BINARY_MEDIA_TYPE,
+            headers={"Content-Length": str(container_stream_size(huffman_codes, bit_length))}
+        )
+    try:
+        code_headers = _code_headers(request, huffman_codes)
+    except HTTPException:
+        spool.close()
+        raise
+    return StreamingResponse(
+        _close_after(iter_encoded_chunks(spool, huffman_codes, key), spool),
+        media_type=BINARY_MEDIA_TYPE,
+        headers={
+            **code_headers,
+            PADDING_HEADER: str(-bit_length % 8),
+            "Content-Length": str((bit_length + 7) // 8),
+        }
+    )
+
+@router.post("/stream/decode", response_class=StreamingResponse,
+             openapi_extra=_request_body_doc(f"Зашифрованные байты (chunked), ключ/коды/padding в заголовках {KEY_HEADER}, {CODES_HEADER} или {CODE_TABLE_HEADER}, {PADDING_HEADER}; либо контейнер и только ключ"))
+async def decode_stream(request: Request):
+    if _is_container_request(request):
+        key = unquote(_required_header(request, KEY_HEADER))
+        spool = await _spool_upload(request)
+        try:
+            huffman_codes, padding, size = await run_in_threadpool(open_container_stream, spool)
+        except ValueError as e:
+            spool.close()
+            raise HTTPException(status_code=400, detail=str(e))
+    else:
+        key, huffman_codes, padding = await run_in_threadpool(_binary_decode_params, request)
+        spool = await _spool_upload(request)
+        size = None
+    return StreamingResponse(
+        _close_after(iter_decoded_chunks(spool, huffman_codes, key, padding, size), spool),
+        media_type=BINARY_MEDIA_TYPE
+    )
+
+@router.get("/result/{task_id}", response_class=StreamingResponse)
+async def get_result(request: Request, task_id: str = Path(..., description="ID задачи из события COMPLETED с result_ref")):
+    # Результат из хранилища кусками. Блоб адресуется по содержимому, поэтому его id - готовый ETag
+    opened = await run_in_threadpool(get_result_store().open, task_id)
+    if opened is None:
+        raise HTTPException(status_code=404, detail=f"Result of task {task_id} not found or expired.")
+    record, chunks = opened
+    etag = f'"{record["blob_id"]}"'
+    if request.headers.get("if-none-match") == etag:
+        chunks.close()
+        return Response(status_code=304, headers={"ETag": etag})
+    return StreamingResponse(
+        chunks,
+        media_type=record["content_type"],
+        headers={"Content-Length": str(record["size"]), "ETag": etag}
+    )
+
+@router.put("/dictionaries/{name}", response_model=SharedDictionaryResponse)
+async def put_shared_dictionary(name: str, request: SharedDictionaryRequest):
+    if request.huffman_codes is not None:
+        huffman_codes = request.huffman_codes
+        try:
+            validate_codes(huffman_codes)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    elif request.sample_text:
+        _, huffman_codes = build_huffman_tree(request.sample_text)
+    else:
+        raise HTTPException(status_code=400, detail="Either huffman_codes or sample_text is required.")
+    await run_in_threadpool(shared_dictionaries.put, name, huffman_codes)
+    return SharedDictionaryResponse(name=name, huffman_codes=huffman_codes)
+
+@router.get("/dictionaries", response_model=SharedDictionaryListResponse)
+async def list_shared_dictionaries():
+    return SharedDictionaryListResponse(dictionaries=await run_in_threadpool(shared_dictionaries.names))
+
+@router.get("/dictionaries/{name}", response_model=SharedDictionaryResponse)
+async def get_shared_dictionary(name: str):
+    return SharedDictionaryResponse(name=name, huffman_codes=await run_in_threadpool(_shared_dictionary, name))
+
+@router.delete("/dictionaries/{name}")
+async def delete_shared_dictionary(name: str):
+    if not await run_in_threadpool(shared_dictionaries.delete, name):
+        raise HTTPException(status_code=404, detail=f"Shared dictionary '{name}' not found.")
+    return {"status": "deleted", "name": name}
+
+@router.get("/cache/stats", response_model=CodeCacheStatsResponse)
+async def code_cache_stats():
+    # Счетчики процесса API (потоковые эндпоинты и дедупликация); у каждого воркера Celery свой кэш
+    return CodeCacheStatsResponse(huffman_codes=huffman_code_cache.stats(), decode_tables=decode_table_cache.stats(),
+                                  results=result_cache.stats())
+
+# Адаптивная сессия по тому же WebSocket: команды adaptive_start/adaptive_stop - текстом (JSON),
+# данные - бинарными сообщениями, ответ на каждое - бинарное сообщение. Кадры короткие,
+# поэтому обрабатываются прямо в event loop; большие - в пуле потоков
+ADAPTIVE_INLINE_MAX_SIZE = 64 << 10
+
+async def _adaptive_error(websocket: WebSocket, error: str):
+    await websocket.send_json(AdaptiveSessionMessage(type="adaptive_error", error=error).model_dump())
+
+async def _adaptive_control(websocket: WebSocket, session, text: str):
+    # -> сессия после команды (None - нет активной). Прочие текстовые сообщения, как и раньше, игнорируются
+    try:
+        command = json.loads(text)
+    except ValueError:
+        return session
+    action = command.get("action") if isinstance(command, dict) else None
+    if action == "adaptive_start":
+        try:
+            start = AdaptiveSessionStart.model_validate(command)
+        except ValidationError as e:
+            await _adaptive_error(websocket, str(e))
+            return session
+        rebuild_interval = start.rebuild_interval or settings.ADAPTIVE_REBUILD_INTERVAL
+        await websocket.send_json(AdaptiveSessionMessage(
+            type="adaptive_started", mode=start.mode, rebuild_interval=rebuild_interval
+        ).model_dump())
+        return AdaptiveSession(start.mode, start.key, rebuild_interval)
+    if action == "adaptive_stop" and session is not None:
+        await websocket.send_json(AdaptiveSessionMessage(type="adaptive_stopped", mode=session.mode, stats=session.stats()).model_dump())
+        return None
+    return session
+
+async def _adaptive_push(websocket: WebSocket, session, data: bytes):
+    if session is None:
+        await _adaptive_error(websocket, "No adaptive session, send adaptive_start first.")
+        return None
+    if len(data) > settings.ADAPTIVE_MAX_FRAME_SIZE:
+        await _adaptive_error(websocket, f"Adaptive frame is limited to {settings.ADAPTIVE_MAX_FRAME_SIZE} bytes.")
+        return session
+    try:
+        if len(data) < ADAPTIVE_INLINE_MAX_SIZE:
+            out = session.push(data)
+        else:
+            out = await run_in_threadpool(session.push, data)
+    except ValueError as e:
+        # Модель сессии могла разойтись с другой стороной: сессию закрываем
+        await _adaptive_error(websocket, str(e))
+        return None
+    await websocket.send_bytes(out)
+    return session
 
 @router.websocket("/ws/{client_id}")
 async def websocket_endpoint(websocket: WebSocket, client_id: str):
     await manager.connect(websocket, client_id)
+    session = None
     try:
         while True:
-            await websocket.receive_text() 
-            pass 
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(message.get("code", 1000))
+            if message.get("bytes") is not None:
+                session = await _adaptive_push(websocket, session, message["bytes"])
+            elif message.get("text") is not None:
+                session = await _adaptive_control(websocket, session, message["text"])
     except WebSocketDisconnect:
-        manager.disconnect(client_id)
+        manager.disconnect(client_id, websocket)
         print(f"Client {client_id} disconnected from WebSocket.")
     except Exception as e:
         print(f"Error in WebSocket for client {client_id}: {e}")
-        manager.disconnect(client_id)
\ No newline at end of file
+        manager.disconnect(client_id, websocket)
\ No newline at end of file
@@ -1,5 +1,8 @@
 from celery import Celery
+from kombu import Queue
 from app.core.config import settings
+from app.celery.serialization import BINARY_SERIALIZER, register_binary_serializer
+from app.celery.routing import QUEUE_PRIORITY_LEVELS, QUEUE_PRIORITY_SEP
 import redislite
 import os
 
@@ -25,6 +28,18 @@ if "redis://" in settings.CELERY_BROKER_URL:
         print(f"Failed to start redislite server: {e}")
         print("Please ensure redislite is installed correctly (pip install redislite)")
 
+# Двоичный формат регистрируется всегда, когда есть msgpack: воркер примет сообщения
+# в обоих форматах, а в каком отправлять, решает CELERY_SERIALIZER отправителя
+accept_content = ['json']
+if register_binary_serializer(settings.CELERY_COMPRESSION_THRESHOLD, settings.CELERY_COMPRESSION_LEVEL):
+    accept_content.append(BINARY_SERIALIZER)
+if settings.CELERY_SERIALIZER == "msgpack":
+    if BINARY_SERIALIZER not in accept_content:
+        raise RuntimeError("CELERY_SERIALIZER=msgpack requires the msgpack package (pip install msgpack)")
+    serializer = BINARY_SERIALIZER
+else:
+    serializer = 'json'
+
 celery_app = Celery(
     "tasks",
     broker=settings.CELERY_BROKER_URL,
@@ -33,9 +48,20 @@ celery_app = Celery(
 )
 
 celery_app.conf.update(
-    task_serializer='json',
-    result_serializer='json',
-    accept_content=['json'],
+    task_serializer=serializer,
+    result_serializer=serializer,
+    accept_content=accept_content,
+    result_accept_content=accept_content,
+    # Очереди interactive и bulk (см. app/celery/routing.py). Приоритеты redis - отдельные списки
+    # на каждый уровень; воркер берет по одной задаче, иначе запас в prefetch обходит приоритеты
+    task_queues=(Queue(settings.CELERY_INTERACTIVE_QUEUE), Queue(settings.CELERY_BULK_QUEUE)),
+    task_default_queue=settings.CELERY_INTERACTIVE_QUEUE,
+    broker_transport_options={
+        'priority_steps': list(range(QUEUE_PRIORITY_LEVELS)),
+        'sep': QUEUE_PRIORITY_SEP,
+        'queue_order_strategy': 'priority',
+    },
+    worker_prefetch_multiplier=1,
     timezone='Europe/Moscow',
     enable_utc=True,
 )
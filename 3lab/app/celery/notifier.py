@@ -0,0 +1,130 @@
+import os
+import threading
+import time
+from collections import deque
+from typing import Dict, Optional
+import httpx
+from app.core.config import settings
+from app.core.metrics import LatencyHistogram
+
+# Уведомления по HTTP (NOTIFY_TRANSPORT=http): один клиент с keep-alive на процесс воркера,
+# события копятся в очереди и уходят пачками на /internal/notify_client/batch из фонового
+# потока. Задача на отправку не ждет. Неудачная пачка повторяется NOTIFY_MAX_RETRIES раз
+# с растущей паузой, потом выбрасывается. Если очередь переполнена (API недоступен),
+# выбрасываются самые старые PROGRESS, а STARTED/COMPLETED/FAILED - только когда других нет
+TERMINAL_STATUSES = ("COMPLETED", "FAILED")
+NOTIFY_RETRY_DELAY = 0.1 # секунд перед первым повтором, дальше вдвое больше
+
+class NotificationBatcher:
+    def __init__(self, url: str, batch_size: int, flush_interval: float, max_retries: int, max_pending: int, timeout: float):
+        self.url = url
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self._events = deque()
+        self._condition = threading.Condition()
+        self._flush_now = False # есть COMPLETED/FAILED: отправить, не дожидаясь flush_interval
+        self._in_flight = 0 # событий в пачке, которая отправляется прямо сейчас
+        self._pid = None
+        self._client: Optional[httpx.Client] = None
+        self.sent = 0
+        self.batches = 0
+        self.retries = 0
+        self.failed = 0 # событий в пачках, которые так и не ушли
+        self.dropped = 0 # событий, выброшенных из переполненной очереди
+        self.latency = LatencyHistogram() # время одного POST
+
+    def _ensure_started(self):
+        # Поток и соединения не переживают fork: в каждом процессе prefork поднимаем свои
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._events = deque()
+        self._condition = threading.Condition()
+        self._client = httpx.Client(
+            timeout=self.timeout,
+            limits=httpx.Limits(max_connections=1, max_keepalive_connections=1)
+        )
+        threading.Thread(target=self._run, name="notification-batcher", daemon=True).start()
+
+    def send(self, task_id: str, client_id: str, message_data: dict):
+        self._ensure_started()
+        event = {"client_id": client_id, "task_id": task_id, "message_data": message_data, "sent_at": time.time()}
+        with self._condition:
+            if len(self._events) >= self.max_pending:
+                self._drop_one()
+            self._events.append(event)
+            if message_data.get("status") in TERMINAL_STATUSES:
+                self._flush_now = True
+            if self._flush_now or len(self._events) >= self.batch_size:
+                self._condition.notify()
+
+    def _drop_one(self):
+        for i, event in enumerate(self._events):
+            if event["message_data"].get("status") == "PROGRESS":
+                del self._events[i]
+                break
+        else:
+            self._events.popleft()
+        self.dropped += 1
+
+    def _run(self):
+        while True:
+            with self._condition:
+                # Ждем до flush_interval: прогресс уходит с задержкой не больше нее
+                self._condition.wait_for(lambda: self._flush_now or len(self._events) >= self.batch_size,
+                                         timeout=self.flush_interval)
+                batch = [self._events.popleft() for _ in range(min(self.batch_size, len(self._events)))]
+                self._flush_now = bool(self._events) and self._flush_now
+                self._in_flight = len(batch)
+            if batch:
+                self._post(batch)
+            self._in_flight = 0
+
+    def _post(self, batch: list):
+        payload = {"events": batch, "worker": {"pid": self._pid, **self.counters()}}
+        for attempt in range(self.max_retries + 1):
+            started = time.perf_counter()
+            try:
+                response = self._client.post(self.url, json=payload)
+                response.raise_for_status()
+                self.latency.observe(time.perf_counter() - started)
+                self.sent += len(batch)
+                self.batches += 1
+                return
+            except httpx.HTTPError as e:
+                self.latency.observe(time.perf_counter() - started)
+                if attempt == self.max_retries:
+                    print(f"Dropping {len(batch)} notifications after {attempt + 1} attempts: {e}")
+                    self.failed += len(batch)
+                    return
+                self.retries += 1
+                time.sleep(NOTIFY_RETRY_DELAY * (2 ** attempt))
+
+    def flush(self, timeout: float = 5.0):
+        # Дождаться, пока очередь опустеет (например, перед выходом процесса)
+        if self._pid != os.getpid():
+            return
+        deadline = time.monotonic() + timeout
+        while (self._events or self._in_flight) and time.monotonic() < deadline:
+            with self._condition:
+                self._flush_now = True
+                self._condition.notify()
+            time.sleep(self.flush_interval / 2)
+
+    def counters(self) -> Dict[str, int]:
+        return {"sent": self.sent, "batches": self.batches, "retries": self.retries, "failed": self.failed, "dropped": self.dropped}
+
+    def stats(self) -> Dict:
+        return {**self.counters(), "pending": len(self._events), "latency": self.latency.snapshot()}
+
+notification_batcher = NotificationBatcher(
+    settings.NOTIFY_URL,
+    settings.NOTIFY_BATCH_SIZE,
+    settings.NOTIFY_FLUSH_INTERVAL,
+    settings.NOTIFY_MAX_RETRIES,
+    settings.NOTIFY_MAX_PENDING,
+    settings.NOTIFY_TIMEOUT,
+)
@@ -0,0 +1,110 @@
+import time
+from typing import Dict, List
+import redis
+from celery.signals import task_prerun, task_postrun
+from app.core.config import settings
+from app.core.metrics import LatencyHistogram
+
+# Маршрутизация задач по размеру и справедливость между клиентами. Маленькие задачи идут
+# в очередь CELERY_INTERACTIVE_QUEUE, большие - в CELERY_BULK_QUEUE, и у каждой может быть
+# свой пул воркеров (-Q interactive / -Q bulk): 50 МБ текста не держат за собой сотни коротких
+# запросов. Приоритет внутри очереди (в redis первым уходит 0) зависит от того, сколько задач
+# клиента уже ждет или выполняется: первые CELERY_CLIENT_FAIR_SHARE идут с приоритетом 0,
+# следующие - на ступень ниже, до QUEUE_PRIORITY_LEVELS - 1. Клиент, заваливший очередь,
+# не обгоняет того, кто прислал одну задачу, но свободные воркеры без дела не стоят.
+# Счетчики клиентов и время ожидания лежат в redis брокера, общем для API и воркеров
+QUEUE_PRIORITY_LEVELS = 10
+QUEUE_PRIORITY_SEP = ":" # список приоритета p > 0 в redis - "<очередь>:<p>"
+CLIENT_PENDING_KEY = "queue:client:{}"
+CLIENT_PENDING_TTL = 3600 # секунд: счетчик задач, потерянных воркером, не живет вечно
+QUEUE_WAIT_KEY = "queue:wait:{}"
+# Заголовки сообщения задачи, воркер видит их как атрибуты self.request
+ENQUEUED_AT_HEADER = "enqueued_at"
+FAIR_CLIENT_HEADER = "fair_client"
+
+_client = None
+
+def _get_client() -> redis.Redis:
+    global _client
+    if _client is None:
+        _client = redis.Redis.from_url(settings.CELERY_BROKER_URL)
+    return _client
+
+def queue_for_size(size: int) -> str:
+    return settings.CELERY_BULK_QUEUE if size >= settings.CELERY_BULK_MIN_SIZE else settings.CELERY_INTERACTIVE_QUEUE
+
+def route_tasks(client_id: str, sizes: List[int]) -> List[Dict]:
+    # Занимает за клиентом len(sizes) задач -> параметры apply_async для каждой.
+    # size - длина текста или закодированных данных задачи
+    key = CLIENT_PENDING_KEY.format(client_id)
+    with _get_client().pipeline() as pipe:
+        pipe.incrby(key, len(sizes))
+        pipe.expire(key, CLIENT_PENDING_TTL)
+        pending, _ = pipe.execute()
+    first = pending - len(sizes)
+    headers = {ENQUEUED_AT_HEADER: time.time(), FAIR_CLIENT_HEADER: client_id}
+    return [{
+        "queue": queue_for_size(size),
+        "priority": min((first + i) // settings.CELERY_CLIENT_FAIR_SHARE, QUEUE_PRIORITY_LEVELS - 1),
+        "headers": headers,
+    } for i, size in enumerate(sizes)]
+
+def route_task(client_id: str, size: int) -> Dict:
+    return route_tasks(client_id, [size])[0]
+
+@task_prerun.connect
+def _record_queue_wait(task=None, **kwargs):
+    # Время от постановки в очередь до начала выполнения, гистограммой на очередь
+    enqueued_at = getattr(task.request, ENQUEUED_AT_HEADER, None)
+    queue = (task.request.delivery_info or {}).get("routing_key")
+    if enqueued_at is None or not queue:
+        return
+    wait = max(time.time() - enqueued_at, 0.0)
+    key = QUEUE_WAIT_KEY.format(queue)
+    try:
+        with _get_client().pipeline(transaction=False) as pipe:
+            pipe.hincrby(key, str(LatencyHistogram().bucket_for(wait)), 1)
+            pipe.hincrbyfloat(key, "total_ms", wait * 1000)
+            pipe.execute()
+    except redis.RedisError as e:
+        print(f"Error recording queue wait for task {task.request.id}: {e}")
+
+@task_postrun.connect
+def _release_client_slot(task=None, **kwargs):
+    client_id = getattr(task.request, FAIR_CLIENT_HEADER, None)
+    if not client_id:
+        return
+    try:
+        _get_client().decr(CLIENT_PENDING_KEY.format(client_id))
+    except redis.RedisError as e:
+        print(f"Error releasing queue slot of client {client_id}: {e}")
+
+def _priority_keys(queue: str) -> List[str]:
+    return [queue] + [f"{queue}{QUEUE_PRIORITY_SEP}{priority}" for priority in range(1, QUEUE_PRIORITY_LEVELS)]
+
+def queue_stats(client_limit: int) -> Dict:
+    client = _get_client()
+    queues = []
+    for name in (settings.CELERY_INTERACTIVE_QUEUE, settings.CELERY_BULK_QUEUE):
+        with client.pipeline(transaction=False) as pipe:
+            for key in _priority_keys(name):
+                pipe.llen(key)
+            pipe.hgetall(QUEUE_WAIT_KEY.format(name))
+            *depths, wait_raw = pipe.execute()
+        wait = LatencyHistogram()
+        wait.add_counts([int(wait_raw.get(str(i).encode(), 0)) for i in range(len(wait.counts))],
+                        float(wait_raw.get(b"total_ms", 0)))
+        queues.append({
+            "name": name,
+            "depth": sum(depths),
+            "depth_by_priority": {str(priority): depth for priority, depth in enumerate(depths) if depth},
+            "wait": wait.snapshot(),
+        })
+    keys = list(client.scan_iter(match=CLIENT_PENDING_KEY.format("*"), count=1000))
+    pending = zip(keys, client.mget(keys)) if keys else []
+    clients = sorted(
+        ({"client_id": key.decode()[len(CLIENT_PENDING_KEY.format("")):], "pending": int(value)}
+         for key, value in pending if value is not None and int(value) > 0),
+        key=lambda item: item["pending"], reverse=True
+    )
+    return {"queues": queues, "clients": clients[:client_limit]}
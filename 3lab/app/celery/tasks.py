@@ -1,108 +1,209 @@
 import asyncio
+from celery import chord
 from app.celery.celery_app import celery_app
+from app.core.config import settings
 from app.services.encryption_service import perform_encode, perform_decode
+from app.services.code_table import code_table_fields
+from app.services.container import perform_encode_container, perform_decode_container
+from app.services.block_codec import BLOCK_MIN_TEXT_SIZE, build_block_index, perform_encode_blocks
+from app.websocket.event_channel import publish_event
+from app.celery.notifier import notification_batcher
+from celery.signals import worker_process_shutdown
 from app.schemas.encryption_schemas import (
     TaskStartedMessage, TaskProgressMessage, TaskCompletedMessage, TaskFailedMessage,
-    EncodeResultMessage, DecodeResultMessage
+    EncodeResultMessage, DecodeResultMessage, BatchItemResult, BatchResultMessage, ResultReference
 )
+from app.services.result_store import get_result_store
+from app.celery.routing import route_tasks
+from pydantic import BaseModel
 import uuid
 import time
-import httpx
 
-FASTAPI_NOTIFICATION_URL = "http://127.0.0.1:8000/encryption/internal/notify_client"
+def send_notification(task_id: str, client_id: str, message_data: dict):
+    # Уведомление не должно ронять задачу: ошибки только печатаем
+    if settings.NOTIFY_TRANSPORT == "pubsub":
+        try:
+            publish_event(task_id, client_id, message_data)
+        except Exception as e:
+            print(f"Error publishing notification for task {task_id} to client {client_id}: {e}")
+        return
+    notification_batcher.send(task_id, client_id, message_data) # пачкой из фонового потока
 
-def send_notification_to_fastapi(task_id: str, client_id: str, message_data: dict):
-    payload = {
-        "client_id": client_id,
-        "task_id": task_id,
-        "message_data": message_data
+@worker_process_shutdown.connect
+def _flush_notifications(**kwargs):
+    notification_batcher.flush()
+
+def _progress_notifier(client_id: str):
+    # Прогресс идет по мере обработки байтов, а клиенту уходит не чаще PROGRESS_MAX_RATE раз
+    # в секунду: промежуточные значения между отправками пропускаются, 100% - всегда
+    min_interval = 1.0 / settings.PROGRESS_MAX_RATE if settings.PROGRESS_MAX_RATE > 0 else 0.0
+    last_sent = -min_interval
+
+    def progress_callback(current_task_id, op, progress_percentage):
+        nonlocal last_sent
+        now = time.monotonic()
+        if progress_percentage < 100 and now - last_sent < min_interval:
+            return
+        last_sent = now
+        progress_msg = TaskProgressMessage(
+            task_id=current_task_id, 
+            operation=op, 
+            progress=progress_percentage
+        ).model_dump()
+        send_notification(current_task_id, client_id, progress_msg)
+    return progress_callback
+
+def _completed_message(task_id: str, operation: str, result: BaseModel) -> dict:
+    # Большой результат - в хранилище: в событии, в бэкенде Celery и по WebSocket идет только
+    # ссылка, а данные сериализуются один раз, сразу в блоб
+    data = result.model_dump_json().encode('utf-8')
+    if len(data) > settings.RESULT_INLINE_MAX_SIZE:
+        try:
+            record = get_result_store().put(task_id, data, "application/json")
+            result_ref = ResultReference(url=f"/encryption/result/{task_id}", **record)
+            return TaskCompletedMessage(task_id=task_id, operation=operation, result_ref=result_ref).model_dump()
+        except Exception as e: # хранилище недоступно: отдаем как раньше, целиком
+            print(f"Error storing result of task {task_id}: {e}. Sending it inline.")
+    return TaskCompletedMessage(task_id=task_id, operation=operation, result=result).model_dump()
+
+def _encode_result(text: str, key: str, task_id: str, progress_callback, huffman_codes: dict = None,
+                   code_format: str = "map", index_interval: int = None) -> EncodeResultMessage:
+    if settings.BLOCK_ENCODE_WORKERS > 1 and len(text) >= BLOCK_MIN_TEXT_SIZE: # блоками на нескольких ядрах
+        result_data = perform_encode_blocks(
+            text, key, task_id, progress_callback, settings.BLOCK_ENCODE_WORKERS, huffman_codes, code_format == "container"
+        )
+        codes_for_schema = {} if code_format == "container" else code_table_fields(result_data.get("huffman_codes"), code_format)
+    elif code_format == "container": # таблица кодов внутри контейнера
+        result_data = perform_encode_container(text, key, task_id, progress_callback, huffman_codes)
+        codes_for_schema = {}
+    else:
+        result_data = perform_encode(text, key, task_id, progress_callback, huffman_codes)
+        codes_for_schema = code_table_fields(result_data.get("huffman_codes"), code_format)
+
+    result_for_schema = {
+        "encoded_data": result_data.get("encoded_data"),
+        **codes_for_schema,
+        "padding": result_data.get("padding")
     }
-    try:
-        with httpx.Client(timeout=10.0) as client:
-            response = client.post(FASTAPI_NOTIFICATION_URL, json=payload)
-            response.raise_for_status()
-    except httpx.HTTPStatusError as e:
-        print(f"HTTP StatusError sending notification for task {task_id} to client {client_id}: {e.response.status_code} - {e.response.text}")
-    except httpx.RequestError as e:
-        print(f"HTTP RequestError sending notification for task {task_id} to client {client_id}: {e}")
-    except Exception as e:
-        print(f"Unexpected error sending notification for task {task_id} to client {client_id}: {e}")
+    if index_interval:
+        result_for_schema["block_index"] = build_block_index(text, result_data["huffman_codes"], index_interval)
+    return EncodeResultMessage(**result_for_schema)
+
+def _decode_result(encoded_data: str, key: str, huffman_codes: dict, padding: int, task_id: str, progress_callback) -> DecodeResultMessage:
+    if huffman_codes is None:
+        result_data = perform_decode_container(encoded_data, key, task_id, progress_callback)
+    else:
+        result_data = perform_decode(encoded_data, key, huffman_codes, padding, task_id, progress_callback)
+    return DecodeResultMessage(**result_data)
 
 @celery_app.task(bind=True)
-def encode_task(self, text: str, key: str, client_id: str):
+def encode_task(self, text: str, key: str, client_id: str, huffman_codes: dict = None, code_format: str = "map",
+                index_interval: int = None):
     task_id = str(self.request.id) if self.request.id else str(uuid.uuid4())
     operation = "encode"
     
     print(f"[Celery Worker] Starting encode task {task_id} for client {client_id}")
     start_msg = TaskStartedMessage(task_id=task_id, operation=operation).model_dump()
-    send_notification_to_fastapi(task_id, client_id, start_msg)
+    send_notification(task_id, client_id, start_msg)
 
-    def progress_callback(current_task_id, op, progress_percentage):
-        progress_msg = TaskProgressMessage(
-            task_id=current_task_id, 
-            operation=op, 
-            progress=progress_percentage
-        ).model_dump()
-        send_notification_to_fastapi(current_task_id, client_id, progress_msg)
-        if progress_percentage < 100 : time.sleep(0.05)
+    progress_callback = _progress_notifier(client_id)
 
     try:
-        time.sleep(0.1)
-        result_data = perform_encode(text, key, task_id, progress_callback)
-        
-        result_for_schema = {
-            "encoded_data": result_data.get("encoded_data"),
-            "huffman_codes": result_data.get("huffman_codes"),
-            "padding": result_data.get("padding")
-        }
-        completed_result = EncodeResultMessage(**result_for_schema)
-        completed_msg = TaskCompletedMessage(
-            task_id=task_id, 
-            operation=operation, 
-            result=completed_result
-        ).model_dump()
-        send_notification_to_fastapi(task_id, client_id, completed_msg)
+        completed_result = _encode_result(text, key, task_id, progress_callback, huffman_codes, code_format, index_interval)
+        completed_msg = _completed_message(task_id, operation, completed_result)
+        send_notification(task_id, client_id, completed_msg)
         print(f"[Celery Worker] Encode task {task_id} completed.")
         return completed_msg
     except Exception as e:
         print(f"[Celery Worker] Error in encode_task {task_id}: {e}")
         error_msg = TaskFailedMessage(task_id=task_id, operation=operation, error=str(e)).model_dump()
-        send_notification_to_fastapi(task_id, client_id, error_msg)
+        send_notification(task_id, client_id, error_msg)
         raise
 
 @celery_app.task(bind=True)
 def decode_task(self, encoded_data: str, key: str, huffman_codes: dict, padding: int, client_id: str):
+    # huffman_codes=None: encoded_data - контейнер, таблица и длина потока внутри него
     task_id = str(self.request.id) if self.request.id else str(uuid.uuid4())
     operation = "decode"
 
     print(f"[Celery Worker] Starting decode task {task_id} for client {client_id}")
     start_msg = TaskStartedMessage(task_id=task_id, operation=operation).model_dump()
-    send_notification_to_fastapi(task_id, client_id, start_msg)
+    send_notification(task_id, client_id, start_msg)
 
-    def progress_callback(current_task_id, op, progress_percentage):
-        progress_msg = TaskProgressMessage(
-            task_id=current_task_id, 
-            operation=op, 
-            progress=progress_percentage
-        ).model_dump()
-        send_notification_to_fastapi(current_task_id, client_id, progress_msg)
-        if progress_percentage < 100 : time.sleep(0.05)
+    progress_callback = _progress_notifier(client_id)
 
     try:
-        time.sleep(0.1)
-        result_data = perform_decode(encoded_data, key, huffman_codes, padding, task_id, progress_callback)
-
-        completed_result = DecodeResultMessage(**result_data)
-        completed_msg = TaskCompletedMessage(
-            task_id=task_id, 
-            operation=operation, 
-            result=completed_result
-        ).model_dump()
-        send_notification_to_fastapi(task_id, client_id, completed_msg)
+        completed_result = _decode_result(encoded_data, key, huffman_codes, padding, task_id, progress_callback)
+        completed_msg = _completed_message(task_id, operation, completed_result)
+        send_notification(task_id, client_id, completed_msg)
         print(f"[Celery Worker] Decode task {task_id} completed.")
         return completed_msg
     except Exception as e:
         print(f"[Celery Worker] Error in decode_task {task_id}: {e}")
         error_msg = TaskFailedMessage(task_id=task_id, operation=operation, error=str(e)).model_dump()
-        send_notification_to_fastapi(task_id, client_id, error_msg)
-        raise
\ No newline at end of file
+        send_notification(task_id, client_id, error_msg)
+        raise
+
+# Пакеты: элементы режутся на куски по BATCH_CHUNK_SIZE, куски идут группой задач,
+# а chord собирает их результаты в одно событие COMPLETED. Для отдельных элементов
+# событий нет. Ошибка элемента попадает в его результат и не валит кусок
+
+def _no_progress(task_id, op, progress_percentage):
+    pass
+
+def _run_batch_items(index_offset: int, items: list, handle) -> list:
+    results = []
+    for index, item in enumerate(items, index_offset):
+        if "error" in item: # элемент отклонен еще в API (например, нет словаря)
+            results.append(BatchItemResult(index=index, error=item["error"]).model_dump())
+            continue
+        try:
+            results.append(BatchItemResult(index=index, result=handle(item)).model_dump())
+        except Exception as e:
+            results.append(BatchItemResult(index=index, error=str(e)).model_dump())
+    return results
+
+@celery_app.task
+def encode_batch_chunk(index_offset: int, items: list) -> list:
+    return _run_batch_items(index_offset, items, lambda item: _encode_result(
+        item["text"], item["key"], "", _no_progress, item.get("huffman_codes"), item.get("code_format", "map"),
+        item.get("index_interval")
+    ))
+
+@celery_app.task
+def decode_batch_chunk(index_offset: int, items: list) -> list:
+    return _run_batch_items(index_offset, items, lambda item: _decode_result(
+        item["encoded_data"], item["key"], item.get("huffman_codes"), item.get("padding"), "", _no_progress
+    ))
+
+@celery_app.task(bind=True)
+def batch_completed(self, chunk_results: list, client_id: str, operation: str, started_at: float):
+    task_id = str(self.request.id)
+    items = [item for chunk in chunk_results for item in chunk]
+    failed = sum(1 for item in items if item["error"] is not None)
+    elapsed = time.time() - started_at
+    completed_result = BatchResultMessage(
+        items=items,
+        succeeded=len(items) - failed,
+        failed=failed,
+        elapsed_seconds=elapsed,
+        items_per_second=len(items) / elapsed if elapsed > 0 else 0.0
+    )
+    completed_msg = _completed_message(task_id, operation, completed_result)
+    send_notification(task_id, client_id, completed_msg)
+    print(f"[Celery Worker] {operation} {task_id} completed: {len(items)} items, {failed} failed.")
+    return completed_msg
+
+def _batch_item_size(item: dict) -> int:
+    return len(item.get("text") or item.get("encoded_data") or "")
+
+def dispatch_batch(batch_id: str, chunk_task, items: list, client_id: str, operation: str) -> int:
+    # batch_id станет id итоговой задачи, по нему же клиент подписан на событие. -> число кусков.
+    # Каждый кусок - отдельная задача клиента для маршрутизации: большой пакет уходит в bulk
+    # и с каждым куском теряет приоритет, итоговая задача легкая и идет в interactive
+    size = settings.BATCH_CHUNK_SIZE
+    chunks = [items[start:start + size] for start in range(0, len(items), size)]
+    routes = route_tasks(client_id, [sum(_batch_item_size(item) for item in chunk) for chunk in chunks])
+    header = [chunk_task.s(index * size, chunk).set(**route) for index, (chunk, route) in enumerate(zip(chunks, routes))]
+    chord(header)(batch_completed.s(client_id, operation, time.time()).set(task_id=batch_id))
+    return len(header)
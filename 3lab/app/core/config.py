@@ -1,9 +1,72 @@
+import os
+import tempfile
+from typing import Literal, Optional
 from pydantic_settings import BaseSettings
 
 class Settings(BaseSettings):
     CELERY_BROKER_URL: str = "redis://localhost:6379/0"
     CELERY_RESULT_BACKEND: str = "redis://localhost:6379/1"
     REDISLITE_RDB_FILE: str = "./redislite_app.rdb"
+    # Сериализация сообщений Celery: json или msgpack (pip install msgpack) со сжатием zlib тел
+    # больше порога. Воркер принимает оба формата, так что переключать можно по одному процессу
+    CELERY_SERIALIZER: Literal["json", "msgpack"] = "json"
+    CELERY_COMPRESSION_THRESHOLD: int = 16 << 10 # байт msgpack
+    CELERY_COMPRESSION_LEVEL: int = 1
+    # Задачи с текстом/данными от CELERY_BULK_MIN_SIZE символов идут в очередь bulk, остальные -
+    # в interactive. Воркер без -Q берет обе, для отдельных пулов: -Q interactive и -Q bulk.
+    # Задачи клиента сверх CELERY_CLIENT_FAIR_SHARE уже ждущих получают приоритет ниже
+    CELERY_INTERACTIVE_QUEUE: str = "interactive"
+    CELERY_BULK_QUEUE: str = "bulk"
+    CELERY_BULK_MIN_SIZE: int = 256 << 10
+    CELERY_CLIENT_FAIR_SHARE: int = 2
+    # Задачи с текстом/данными до INLINE_MAX_SIZE символов выполняются в процессе API, мимо брокера,
+    # с теми же событиями по WebSocket (0 - все через Celery)
+    INLINE_MAX_SIZE: int = 4 << 10
+    # Как события задач попадают из воркеров в API: pubsub - канал redis, http - POST на /internal/notify_client
+    NOTIFY_TRANSPORT: Literal["pubsub", "http"] = "pubsub"
+    EVENTS_REDIS_URL: str = "redis://localhost:6379/0"
+    EVENTS_CHANNEL: str = "encryption:events"
+    # HTTP-транспорт: пачки событий из фонового потока каждого процесса воркера
+    NOTIFY_URL: str = "http://127.0.0.1:8000/encryption/internal/notify_client/batch"
+    NOTIFY_BATCH_SIZE: int = 50
+    NOTIFY_FLUSH_INTERVAL: float = 0.02 # секунд, дольше прогресс в очереди не ждет
+    NOTIFY_MAX_RETRIES: int = 3
+    NOTIFY_MAX_PENDING: int = 10_000 # событий в очереди процесса, сверх - выбрасываются
+    NOTIFY_TIMEOUT: float = 5.0
+    # Не больше стольких событий PROGRESS в секунду на задачу (0 - без ограничения)
+    PROGRESS_MAX_RATE: float = 10.0
+    # Очередь отправки по WebSocket на соединение: сверх нее выбрасывается старый PROGRESS, а если
+    # его нет - клиент отключается. Так же отключается клиент, который дольше таймаута не принимает сообщение
+    WS_SEND_QUEUE_SIZE: int = 256
+    WS_SEND_TIMEOUT: float = 10.0
+    # Результаты больше RESULT_INLINE_MAX_SIZE байт (в JSON) уходят в хранилище, событие COMPLETED
+    # несет ссылку на GET /encryption/result/{task_id}. disk - каталог, общий для воркеров и API
+    # на одной машине, redis - блобы в redis. 0 - по ссылке все результаты
+    RESULT_STORE: Literal["disk", "redis"] = "disk"
+    RESULT_STORE_DIR: str = os.path.join(tempfile.gettempdir(), "3lab_results")
+    RESULT_STORE_REDIS_URL: str = "redis://localhost:6379/0"
+    RESULT_INLINE_MAX_SIZE: int = 64 << 10
+    RESULT_TTL_SECONDS: float = 3600.0
+    # Кэш результатов одинаковых запросов encode/decode в процессе API (0 записей - выключен)
+    # и, если задан RESULT_CACHE_REDIS_URL, в redis, общем для процессов API
+    RESULT_CACHE_MAX_ENTRIES: int = 1024
+    RESULT_CACHE_MAX_BYTES: int = 64 << 20
+    RESULT_CACHE_TTL_SECONDS: float = 600.0 # не больше RESULT_TTL_SECONDS: ссылки result_ref должны жить
+    RESULT_CACHE_REDIS_URL: Optional[str] = None
+    CODE_CACHE_MAX_ENTRIES: int = 256
+    CODE_CACHE_TTL_SECONDS: float = 600.0
+    # Общие словари (PUT /dictionaries/{name}) - в redis, общем для процессов API; замену словаря
+    # другие процессы видят с задержкой до SHARED_DICTIONARY_CACHE_TTL_SECONDS
+    SHARED_DICTIONARY_REDIS_URL: str = "redis://localhost:6379/0"
+    SHARED_DICTIONARY_CACHE_TTL_SECONDS: float = 5.0
+    BATCH_CHUNK_SIZE: int = 200 # элементов пакета на одну задачу Celery
+    BATCH_MAX_ITEMS: int = 50_000
+    # Процессов на воркер Celery для блочного кодирования больших текстов (0/1 - выключено).
+    # У каждого процесса воркера свой пул, поэтому при prefork -c N процессов будет N * BLOCK_ENCODE_WORKERS
+    BLOCK_ENCODE_WORKERS: int = 0
+    # Адаптивные сессии по WebSocket: перестройка кодов каждые N символов и предел одного кадра
+    ADAPTIVE_REBUILD_INTERVAL: int = 4096
+    ADAPTIVE_MAX_FRAME_SIZE: int = 1 << 20
 
     class Config:
         env_file = ".env"
@@ -0,0 +1,50 @@
+import bisect
+from typing import Dict, List, Optional
+
+# Гистограмма задержек: счетчики одного процесса, корзины в миллисекундах
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+class LatencyHistogram:
+    def __init__(self, buckets_ms=LATENCY_BUCKETS_MS):
+        self.buckets_ms = buckets_ms
+        self.counts = [0] * (len(buckets_ms) + 1) # последний - больше самой верхней границы
+        self.count = 0
+        self.total_ms = 0.0
+
+    def bucket_for(self, seconds: float) -> int:
+        return bisect.bisect_left(self.buckets_ms, seconds * 1000)
+
+    def observe(self, seconds: float):
+        self.counts[self.bucket_for(seconds)] += 1
+        self.count += 1
+        self.total_ms += seconds * 1000
+
+    def add_counts(self, counts: List[int], total_ms: float):
+        # Счетчики, накопленные в другом месте (например, воркерами в redis) по тем же корзинам
+        for i, count in enumerate(counts):
+            self.counts[i] += count
+        self.count += sum(counts)
+        self.total_ms += total_ms
+
+    def quantile_ms(self, q: float) -> Optional[float]:
+        # Верхняя граница корзины, в которую попадает квантиль
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets_ms, self.counts):
+            seen += count
+            if seen >= rank:
+                return float(bound)
+        return float("inf")
+
+    def snapshot(self) -> Dict:
+        buckets = {f"le_{bound}ms": count for bound, count in zip(self.buckets_ms, self.counts)}
+        buckets["inf"] = self.counts[-1]
+        return {
+            "count": self.count,
+            "mean_ms": self.total_ms / self.count if self.count else None,
+            "p50_ms": self.quantile_ms(0.5),
+            "p99_ms": self.quantile_ms(0.99),
+            "buckets": buckets,
+        }
@@ -1,25 +1,152 @@
 from pydantic import BaseModel, Field
-from typing import Dict, Optional, Any, Literal
+from typing import Dict, List, Optional, Any, Literal, Tuple
 
 class BaseRequest(BaseModel):
     key: str
 
 class EncodeRestRequest(BaseRequest):
     text: str
+    dictionary: Optional[str] = None # имя общего словаря вместо построения дерева
+    # compact: в результате code_table вместо huffman_codes;
+    # container: encoded_data - контейнер (base64) с таблицей и длиной потока внутри
+    code_format: Literal["map", "compact", "container"] = "map"
+    # Контрольная точка индекса для частичного декодирования каждые index_interval символов
+    index_interval: Optional[int] = Field(None, ge=1024)
 
 class EncodeRestResponse(BaseModel):
     task_id: str
     message: str = "Encode task started"
 
 class DecodeRestRequest(BaseRequest):
-    encoded_data: str
-    huffman_codes: Dict[str, str]
-    padding: int
+    encoded_data: str # без таблицы кодов ожидается контейнер
+    huffman_codes: Optional[Dict[str, str]] = None # можно не передавать, если указан dictionary или code_table
+    padding: Optional[int] = None # для контейнера не нужен
+    dictionary: Optional[str] = None
+    code_table: Optional[str] = None # компактная таблица (base64) из результата с code_format="compact"
 
 class DecodeRestResponse(BaseModel):
     task_id: str
     message: str = "Decode task started"
 
+class DecodeRangeRestRequest(DecodeRestRequest):
+    block_index: List[Tuple[int, int]] # из результата кодирования с index_interval
+    start: int = Field(0, ge=0) # символы [start, end)
+    end: Optional[int] = Field(None, ge=0) # None - до конца текста
+
+class DecodeRangeRestResponse(BaseModel):
+    decoded_text: str
+    start: int
+    end: int
+
+# Пакетный режим: массив обычных запросов, одно событие COMPLETED на весь пакет
+
+class EncodeBatchRestRequest(BaseModel):
+    items: List[EncodeRestRequest] = Field(..., min_length=1)
+
+class DecodeBatchRestRequest(BaseModel):
+    items: List[DecodeRestRequest] = Field(..., min_length=1)
+
+class BatchRestResponse(BaseModel):
+    task_id: str
+    item_count: int
+    chunk_count: int
+    message: str = "Batch started"
+
+class SharedDictionaryRequest(BaseModel):
+    # Либо готовая таблица кодов, либо образец текста, по которому она строится
+    huffman_codes: Optional[Dict[str, str]] = None
+    sample_text: Optional[str] = None
+
+class SharedDictionaryResponse(BaseModel):
+    name: str
+    huffman_codes: Dict[str, str]
+
+class SharedDictionaryListResponse(BaseModel):
+    dictionaries: List[str]
+
+class CacheStats(BaseModel):
+    size: int
+    max_entries: int
+    hits: int
+    misses: int
+    evictions: int
+
+class ResultCacheStats(CacheStats):
+    bytes: int
+    max_bytes: int
+    coalesced: int # запросов, присоединенных к идущей задаче с тем же отпечатком
+    in_flight: int
+
+class CodeCacheStatsResponse(BaseModel):
+    huffman_codes: CacheStats
+    decode_tables: CacheStats
+    results: ResultCacheStats
+
+class LatencyHistogramStats(BaseModel):
+    count: int
+    mean_ms: Optional[float] = None
+    p50_ms: Optional[float] = None # верхняя граница корзины
+    p99_ms: Optional[float] = None
+    buckets: Dict[str, int]
+
+class ClientQueueStats(BaseModel):
+    client_id: str
+    subscriptions: int
+    depth: int # сообщений в очереди отправки сейчас
+    max_depth: int
+    sent: int
+    coalesced: int # PROGRESS, замененных более свежими
+    dropped: int # PROGRESS, выброшенных из переполненной очереди
+    connected_seconds: float
+    sending_seconds: Optional[float] = None # сколько длится текущая отправка, если она идет
+
+class ConnectionQueueStatsResponse(BaseModel):
+    connections: int # в этом процессе API
+    queued_messages: int
+    queue_size: int
+    coalesced_progress: int
+    dropped_progress: int
+    slow_disconnects: int # клиентов, отключенных за переполнение очереди или зависшую отправку
+    clients: List[ClientQueueStats] # с самой длинной очередью первыми
+
+class QueueStats(BaseModel):
+    name: str
+    depth: int # задач ждет в очереди
+    depth_by_priority: Dict[str, int] # приоритет (0 - первым) -> задач, только непустые
+    wait: LatencyHistogramStats # от постановки в очередь до начала выполнения, по всем воркерам
+
+class ClientPendingStats(BaseModel):
+    client_id: str
+    pending: int # задач клиента в очередях и в работе
+
+class QueueStatsResponse(BaseModel):
+    queues: List[QueueStats]
+    clients: List[ClientPendingStats] # с наибольшим числом задач первыми
+
+class NotificationStatsResponse(BaseModel):
+    received: int # событий от воркеров в этом процессе API (pub/sub и HTTP)
+    not_connected: int # из них для клиентов без сокета в этом процессе
+    forwarded: int # переданных через канал процессу с сокетом клиента
+    errors: int
+    latency: LatencyHistogramStats # от отправки воркером до передачи в ConnectionManager
+    workers: Dict[str, Dict[str, int]] # pid -> sent, batches, retries, failed, dropped (HTTP-транспорт)
+
+# Адаптивная сессия по WebSocket: управление - JSON, данные - бинарные сообщения.
+# encode: клиент шлет UTF-8, сервер отвечает кадрами; decode: наоборот
+
+class AdaptiveSessionStart(BaseModel):
+    action: Literal["adaptive_start"]
+    mode: Literal["encode", "decode"]
+    key: str
+    rebuild_interval: Optional[int] = Field(None, ge=1) # по умолчанию из настроек
+
+class AdaptiveSessionMessage(BaseModel):
+    type: Literal["adaptive_started", "adaptive_stopped", "adaptive_error"]
+    mode: Optional[str] = None
+    rebuild_interval: Optional[int] = None
+    stats: Optional[Dict[str, int]] = None # frames, symbols, bytes_in, bytes_out, alphabet_size, rebuilds
+    error: Optional[str] = None
+
 class WebSocketMessageBase(BaseModel):
     task_id: str
     operation: str # "encode" или "decode"
@@ -33,15 +160,38 @@ class TaskProgressMessage(WebSocketMessageBase):
 
 class EncodeResultMessage(BaseModel):
     encoded_data: str
-    huffman_codes: Dict[str, str]
+    huffman_codes: Optional[Dict[str, str]] = None
+    code_table: Optional[str] = None
     padding: int
+    block_index: Optional[List[Tuple[int, int]]] = None # [(символ, бит), ...] при index_interval
 
 class DecodeResultMessage(BaseModel):
     decoded_text: str
 
+class BatchItemResult(BaseModel):
+    index: int
+    result: Optional[Any] = None # EncodeResultMessage или DecodeResultMessage
+    error: Optional[str] = None
+
+class BatchResultMessage(BaseModel):
+    items: List[BatchItemResult]
+    succeeded: int
+    failed: int
+    elapsed_seconds: float
+    items_per_second: float
+
+class ResultReference(BaseModel):
+    # Результат в хранилище: забирать GET url, тело - JSON того же вида, что и result
+    url: str
+    blob_id: str # blake2b содержимого, одинаковые результаты - один блоб
+    size: int # байт
+    content_type: str
+    expires_at: float # unix time, после - 404
+
 class TaskCompletedMessage(WebSocketMessageBase):
     status: Literal["COMPLETED"] = "COMPLETED"
-    result: Any
+    result: Any = None
+    result_ref: Optional[ResultReference] = None # вместо result, если он больше RESULT_INLINE_MAX_SIZE
 
 class TaskFailedMessage(WebSocketMessageBase):
     status: Literal["FAILED"] = "FAILED"
@@ -0,0 +1,166 @@
+import codecs
+from collections import Counter
+from typing import Dict
+from app.services.encryption_service import (
+    build_huffman_codes, build_decode_table, code_value_table, pack_into, decode_bits_from, xor_cipher_inplace
+)
+from app.services.code_table import read_varint, write_varint
+
+# Адаптивный режим для источников, которые шлют текст непрерывно (например, логи): весь текст
+# заранее не нужен и таблица кодов не передается. Кодер и декодер ведут одну и ту же модель
+# частот и одинаково обновляют ее после каждого кадра. Кадр:
+#   заголовок  два varint: длина новых символов в байтах, длина данных в битах
+#   символы    символы, которых еще не было в модели, в UTF-8 - каждый передается один раз
+#   данные     коды Хаффмана текста кадра по модели, дополненной новыми символами
+# Символы и данные шифруются XOR одним ключевым потоком на всю сессию.
+# Кадры обычно короткие (строка лога), поэтому заголовок - varint, а не поля фиксированной длины
+ADAPTIVE_REBUILD_INTERVAL = 4096
+
+class AdaptiveHuffmanModel:
+    # Периодическая перестройка вместо FGK/Vitter: частоты копятся после каждого кадра, а коды
+    # строятся заново (тем же каноническим построителем), когда появились новые символы или
+    # с прошлой перестройки набралось rebuild_interval символов
+    def __init__(self, rebuild_interval: int = ADAPTIVE_REBUILD_INTERVAL):
+        self.rebuild_interval = rebuild_interval
+        self.frequency = Counter()
+        self.codes: Dict[str, str] = {}
+        self.version = 0 # растет при каждой перестройке, по нему кэшируются таблицы
+        self.pending = 0 # символов с прошлой перестройки
+        self.stale = False
+
+    def new_symbols(self, text: str) -> str:
+        # Порядок не важен, лишь бы декодер добавил их в том же: он получает их готовой строкой
+        return "".join(sorted(set(text).difference(self.frequency)))
+
+    def add_symbols(self, symbols: str):
+        for char in symbols:
+            self.frequency[char] = 1
+        if symbols:
+            self.stale = True
+
+    def prepare(self) -> Dict[str, str]:
+        # Коды для следующего кадра
+        if self.stale or self.pending >= self.rebuild_interval:
+            self.codes = build_huffman_codes(self.frequency)
+            self.version += 1
+            self.pending = 0
+            self.stale = False
+        return self.codes
+
+    def update(self, text: str):
+        self.frequency.update(text)
+        self.pending += len(text)
+
+class AdaptiveEncoder:
+    def __init__(self, key: str, rebuild_interval: int = ADAPTIVE_REBUILD_INTERVAL):
+        self.model = AdaptiveHuffmanModel(rebuild_interval)
+        self.key = key
+        self.offset = 0 # позиция в ключевом потоке сессии
+        self._table = None
+        self._table_version = -1
+
+    def encode(self, text: str) -> bytes:
+        symbols = self.model.new_symbols(text)
+        self.model.add_symbols(symbols)
+        codes = self.model.prepare()
+        if self._table_version != self.model.version:
+            self._table = code_value_table(codes)
+            self._table_version = self.model.version
+
+        body = bytearray(symbols.encode('utf-8', 'surrogatepass'))
+        symbols_size = len(body)
+        acc, nbits = pack_into(body, text, self._table)
+        if nbits: # Кадр выравнивается по байту
+            body.append((acc << (8 - nbits)) & 0xFF)
+        bit_length = (len(body) - symbols_size) * 8 - (-nbits % 8)
+        xor_cipher_inplace(body, self.key, self.offset)
+        self.offset += len(body)
+        self.model.update(text)
+        header = bytearray()
+        write_varint(header, symbols_size)
+        write_varint(header, bit_length)
+        return bytes(header + body)
+
+class AdaptiveDecoder:
+    def __init__(self, key: str, rebuild_interval: int = ADAPTIVE_REBUILD_INTERVAL):
+        self.model = AdaptiveHuffmanModel(rebuild_interval)
+        self.key = key
+        self.offset = 0
+        self._decode_table = None
+        self._table_version = -1
+
+    def decode(self, frame: bytes) -> str:
+        # После ошибки модель расходится с кодером: сессию нужно начинать заново
+        try:
+            symbols_size, pos = read_varint(frame, 0)
+            bit_length, pos = read_varint(frame, pos)
+        except ValueError:
+            raise ValueError("Adaptive frame is truncated")
+        body = bytearray(memoryview(frame)[pos:])
+        if len(body) != symbols_size + (bit_length + 7) // 8:
+            raise ValueError("Adaptive frame size does not match its header")
+        xor_cipher_inplace(body, self.key, self.offset)
+        self.offset += len(body)
+        try:
+            symbols = body[:symbols_size].decode('utf-8', 'surrogatepass')
+        except UnicodeDecodeError:
+            raise ValueError("Adaptive frame symbols are not valid UTF-8")
+        if set(symbols).intersection(self.model.frequency):
+            raise ValueError("Adaptive frame does not match the session model")
+
+        self.model.add_symbols(symbols)
+        codes = self.model.prepare()
+        if self._table_version != self.model.version:
+            self._decode_table = build_decode_table(codes) if codes else None
+            self._table_version = self.model.version
+        text = ""
+        if bit_length:
+            if self._decode_table is None:
+                raise ValueError("Adaptive frame does not match the session model")
+            with memoryview(body) as view:
+                text, stop, broken = decode_bits_from(view[symbols_size:], 0, bit_length, self._decode_table)
+            if broken or stop != bit_length:
+                raise ValueError("Adaptive frame does not match the session model")
+        self.model.update(text)
+        return text
+
+class AdaptiveSession:
+    # Сессия одного WebSocket-соединения. encode: на входе куски UTF-8 (символ может быть
+    # разрезан между кусками), на выходе кадры. decode: на входе кадры, на выходе UTF-8
+    def __init__(self, mode: str, key: str, rebuild_interval: int = ADAPTIVE_REBUILD_INTERVAL):
+        self.mode = mode
+        if mode == "encode":
+            self.coder = AdaptiveEncoder(key, rebuild_interval)
+            self.text_decoder = codecs.getincrementaldecoder('utf-8')()
+        else:
+            self.coder = AdaptiveDecoder(key, rebuild_interval)
+        self.frames = 0
+        self.symbols = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def push(self, data: bytes) -> bytes:
+        if self.mode == "encode":
+            try:
+                text = self.text_decoder.decode(data)
+            except UnicodeDecodeError:
+                raise ValueError("Adaptive session input must be UTF-8 text")
+            out = self.coder.encode(text)
+        else:
+            text = self.coder.decode(data)
+            out = text.encode('utf-8', 'surrogatepass')
+        self.frames += 1
+        self.symbols += len(text)
+        self.bytes_in += len(data)
+        self.bytes_out += len(out)
+        return out
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "frames": self.frames,
+            "symbols": self.symbols,
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "alphabet_size": len(self.coder.model.frequency),
+            "rebuilds": self.coder.model.version,
+        }
@@ -0,0 +1,106 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Optional
+import redis
+from app.core.config import settings
+
+SHARED_DICTIONARIES_KEY = "dictionaries"
+
+def frequency_fingerprint(frequency: Dict[str, int]) -> str:
+    # Одинаковая гистограмма частот дает один и тот же отпечаток, порядок символов не важен
+    return hashlib.blake2b(repr(sorted(frequency.items())).encode('utf-8', 'surrogatepass'), digest_size=16).hexdigest()
+
+def codes_fingerprint(codes: Dict[str, str]) -> str:
+    return hashlib.blake2b(repr(sorted(codes.items())).encode('utf-8', 'surrogatepass'), digest_size=16).hexdigest()
+
+class CodeTableCache:
+    # LRU с TTL для таблиц кодов. Значения общие для всех запросов, менять их нельзя
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_or_build(self, key: str, build: Callable):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            if entry is not None: # Протухла по TTL
+                del self._entries[key]
+                self.evictions += 1
+            self.misses += 1
+
+        value = build()
+        with self._lock:
+            self._entries[key] = (value, now + self.ttl_seconds)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return value
+
+    def discard(self, key: str):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+class SharedDictionaryRegistry:
+    # Именованные таблицы кодов от клиентов: кодирование по ним не строит дерево вовсе.
+    # Хранятся в хеше redis, общем для всех процессов API (uvicorn --workers N), перед ним -
+    # LRU с TTL процесса. Отсутствие словаря не кэшируется, так что PUT в одном процессе сразу
+    # виден в остальных, а замену или удаление другие процессы увидят не позже чем через TTL
+    def __init__(self, redis_url: str, max_entries: int, ttl_seconds: float):
+        self.client = redis.Redis.from_url(redis_url)
+        self._cache = CodeTableCache(max_entries, ttl_seconds)
+
+    def _load(self, name: str) -> Dict[str, str]:
+        data = self.client.hget(SHARED_DICTIONARIES_KEY, name)
+        if data is None:
+            raise KeyError(name)
+        return json.loads(data)
+
+    def put(self, name: str, codes: Dict[str, str]):
+        self.client.hset(SHARED_DICTIONARIES_KEY, name, json.dumps(codes, ensure_ascii=False))
+        self._cache.discard(name)
+
+    def get(self, name: str) -> Optional[Dict[str, str]]:
+        try:
+            return self._cache.get_or_build(name, lambda: self._load(name))
+        except KeyError:
+            return None
+
+    def delete(self, name: str) -> bool:
+        self._cache.discard(name)
+        return bool(self.client.hdel(SHARED_DICTIONARIES_KEY, name))
+
+    def names(self):
+        return sorted(name.decode('utf-8') for name in self.client.hkeys(SHARED_DICTIONARIES_KEY))
+
+huffman_code_cache = CodeTableCache(settings.CODE_CACHE_MAX_ENTRIES, settings.CODE_CACHE_TTL_SECONDS)
+decode_table_cache = CodeTableCache(settings.CODE_CACHE_MAX_ENTRIES, settings.CODE_CACHE_TTL_SECONDS)
+shared_dictionaries = SharedDictionaryRegistry(
+    settings.SHARED_DICTIONARY_REDIS_URL, settings.CODE_CACHE_MAX_ENTRIES, settings.SHARED_DICTIONARY_CACHE_TTL_SECONDS
+)
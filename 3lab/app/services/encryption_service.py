@@ -1,9 +1,22 @@
-import heapq
 from collections import Counter
+from itertools import repeat
 import base64
-from typing import Dict, Tuple, Optional
+import sys
+from typing import Callable, Dict, Tuple, Optional
+from app.services.code_cache import huffman_code_cache, decode_table_cache, frequency_fingerprint, codes_fingerprint
+
+try:
+    import numpy as np
+except ImportError: # NumPy необязателен, без него работает чистый Python
+    np = None
+
+# Коды длиннее не строим: таблица декодера остается неглубокой, а упаковка - в машинных словах.
+# Если символов больше 2**MAX_CODE_LENGTH, предел поднимается до минимально возможного
+MAX_CODE_LENGTH = 15
 
 class HuffmanNode:
+    __slots__ = ('char', 'freq', 'left', 'right')
+
     def __init__(self, char, freq):
         self.char = char
         self.freq = freq
@@ -13,69 +26,394 @@ class HuffmanNode:
     def __lt__(self, other):
         return self.freq < other.freq
 
+def huffman_code_lengths(frequency: Dict[str, int], max_length: int = MAX_CODE_LENGTH) -> Dict[str, int]:
+    # Дерево строим на массивах: листья отсортированы по (частота, символ), а новые узлы
+    # появляются в порядке неубывания веса, поэтому вместо кучи хватает двух очередей.
+    # При равных частотах порядок задан символом, так что результат не зависит от запуска
+    symbols = sorted(frequency, key=lambda char: (frequency[char], char))
+    n = len(symbols)
+    if n == 0:
+        return {}
+    if n == 1:
+        return {symbols[0]: 1}
+
+    weight = [frequency[char] for char in symbols]
+    weight.extend(repeat(0, n - 1))
+    parent = [0] * (2 * n - 1)
+    leaf = 0 # следующий лист
+    node = n # следующий внутренний узел для слияния
+    for new in range(n, 2 * n - 1):
+        pair = []
+        for _ in range(2):
+            if leaf < n and (node >= new or weight[leaf] <= weight[node]):
+                pair.append(leaf)
+                leaf += 1
+            else:
+                pair.append(node)
+                node += 1
+        weight[new] = weight[pair[0]] + weight[pair[1]]
+        parent[pair[0]] = parent[pair[1]] = new
+
+    # Глубины считаем без рекурсии: родитель всегда создан позже потомка
+    depth = [0] * (2 * n - 1)
+    for i in range(2 * n - 3, -1, -1):
+        depth[i] = depth[parent[i]] + 1
+
+    max_length = max(max_length, (n - 1).bit_length())
+    if max(depth[:n]) <= max_length:
+        return {symbols[i]: depth[i] for i in range(n)}
+    return _limit_code_lengths(symbols, depth[:n], max_length)
+
+def _limit_code_lengths(symbols, lengths, max_length: int) -> Dict[str, int]:
+    # Длинные коды укорачиваем до max_length, затем восстанавливаем неравенство Крафта,
+    # удлиняя самые длинные из оставшихся коротких кодов (как в zlib/miniz)
+    count = [0] * (max_length + 1)
+    for length in lengths:
+        count[min(length, max_length)] += 1
+    total = sum(count[length] << (max_length - length) for length in range(1, max_length + 1))
+    while total > (1 << max_length):
+        count[max_length] -= 1
+        for length in range(max_length - 1, 0, -1):
+            if count[length]:
+                count[length] -= 1
+                count[length + 1] += 2
+                break
+        total -= 1
+
+    # Короткие коды достаются частым символам: symbols отсортированы по возрастанию частоты
+    result = {}
+    i = len(symbols)
+    for length in range(1, max_length + 1):
+        for _ in range(count[length]):
+            i -= 1
+            result[symbols[i]] = length
+    return result
+
+def canonical_codes(lengths: Dict[str, int]) -> Dict[str, str]:
+    # Канонический код: символы по (длина, символ), коды идут подряд.
+    # Таблица целиком восстанавливается по одним длинам
+    codes: Dict[str, str] = {}
+    code = 0
+    prev_length = 0
+    for char in sorted(lengths, key=lambda char: (lengths[char], char)):
+        length = lengths[char]
+        code <<= length - prev_length
+        codes[char] = format(code, f'0{length}b')
+        code += 1
+        prev_length = length
+    return codes
+
+def build_huffman_codes(frequency: Dict[str, int], max_length: int = MAX_CODE_LENGTH) -> Dict[str, str]:
+    return canonical_codes(huffman_code_lengths(frequency, max_length))
+
+def build_code_tree(codes: Dict[str, str]) -> Optional[HuffmanNode]:
+    # Дерево по готовым кодам, если оно действительно нужно (для кодирования и декодирования не нужно)
+    if not codes:
+        return None
+    root = HuffmanNode(None, 0)
+    for char, code in codes.items():
+        node = root
+        for bit in code:
+            attr = 'left' if bit == '0' else 'right'
+            child = getattr(node, attr)
+            if child is None:
+                child = HuffmanNode(None, 0)
+                setattr(node, attr, child)
+            node = child
+        node.char = char
+    return root
+
 def build_huffman_tree(text: str) -> Tuple[Optional[HuffmanNode], Dict[str, str]]:
     if not text:
         return None, {}
+    return build_huffman_tree_from_frequency(Counter(text))
 
-    frequency = Counter(text)
-    priority_queue = [HuffmanNode(char, freq) for char, freq in frequency.items()]
-    heapq.heapify(priority_queue)
+def build_huffman_tree_from_frequency(frequency: Dict[str, int]) -> Tuple[Optional[HuffmanNode], Dict[str, str]]:
+    # Частоты можно набрать заранее, например по кускам потокового текста
+    codes = build_huffman_codes(frequency)
+    return build_code_tree(codes), codes
 
-    if not priority_queue: 
-        return None, {}
-        
-    while len(priority_queue) > 1:
-        left = heapq.heappop(priority_queue)
-        right = heapq.heappop(priority_queue)
-        merged = HuffmanNode(None, left.freq + right.freq)
-        merged.left = left
-        merged.right = right
-        heapq.heappush(priority_queue, merged)
-    
-    if not priority_queue: 
-        return None, {}
+# Таблицы кодов из кэша: повторяющиеся документы не перестраивают дерево и таблицу декодера
 
-    root = priority_queue[0]
-    codes: Dict[str, str] = {}
-    
-    if not root.left and not root.right: # Случай с одним уникальным символом
-        if root.char is not None:
-            codes[root.char] = "0"
-        return root, codes
-
-    def generate_codes(node: Optional[HuffmanNode], current_code: str):
-        if node is None:
-            return
-        if node.char is not None:
-            codes[node.char] = current_code
-            return
-        generate_codes(node.left, current_code + "0")
-        generate_codes(node.right, current_code + "1")
-
-    generate_codes(root, "")
-    return root, codes
+def cached_huffman_codes(frequency: Dict[str, int]) -> Dict[str, str]:
+    return huffman_code_cache.get_or_build(
+        frequency_fingerprint(frequency), lambda: build_huffman_codes(frequency)
+    )
+
+def cached_decode_table(codes: Dict[str, str]):
+    return decode_table_cache.get_or_build(codes_fingerprint(codes), lambda: build_decode_table(codes))
+
+def validate_codes(codes: Dict[str, str]):
+    # Таблица от клиента (общий словарь) должна быть префиксным кодом из '0'/'1'
+    if not codes:
+        raise ValueError("Code table is empty")
+    for symbol, code in codes.items():
+        if not isinstance(code, str) or not code or code.strip("01"):
+            raise ValueError(f"Code for symbol {symbol!r} must be a non-empty string of '0' and '1'")
+    ordered = sorted(codes.values())
+    for shorter, longer in zip(ordered, ordered[1:]):
+        if longer.startswith(shorter):
+            raise ValueError(f"Code {shorter!r} is a prefix of {longer!r}")
+
+def check_codes_cover(frequency: Dict[str, int], codes: Dict[str, str]):
+    missing = [char for char in frequency if char not in codes]
+    if missing:
+        raise ValueError(f"Code table has no codes for symbols: {''.join(sorted(missing))[:50]!r}")
+
+# Сколько символов кодируем между сбросами аккумулятора в bytearray
+PACK_CHUNK_CHARS = 64
+# С какого размера текста (в символах) кодируем через NumPy, если он установлен
+NUMPY_PACK_MIN_SIZE = 1 << 20
+# Длиннее этого коды не влезают в uint64
+NUMPY_PACK_MAX_CODE_LEN = 63
+# NumPy пакует текст кусками по столько символов: массивы кодов и бит (байт на бит потока)
+# живут только для куска, и лишняя память не растет с размером текста
+NUMPY_PACK_CHUNK_CHARS = 1 << 16
+# Символ без кода пропускаем: он дает ноль бит
+_NO_CODE = (0, 0)
+# Прогресс считается по обработанной работе: текст пакуется, поток шифруется и декодируется
+# кусками такого размера (в символах или байтах), и после каждого куска вызывается progress
+PROGRESS_CHUNK_SIZE = 1 << 18
+
+def code_value_table(codes: Dict[str, str]) -> Dict[str, Tuple[int, int]]:
+    return {symbol: (int(code, 2) if code else 0, len(code)) for symbol, code in codes.items()}
+
+def pack_into(out: bytearray, text: str, table: Dict[str, Tuple[int, int]], acc: int = 0, nbits: int = 0) -> Tuple[int, int]:
+    # Дописывает в out целые байты, возвращает остаток аккумулятора (не больше 7 бит)
+    get = table.get
+    no_code = repeat(_NO_CODE)
+    for start in range(0, len(text), PACK_CHUNK_CHARS):
+        for value, length in map(get, text[start:start + PACK_CHUNK_CHARS], no_code):
+            acc = (acc << length) | value
+            nbits += length
+        nbytes = nbits >> 3
+        nbits &= 7
+        out += (acc >> nbits).to_bytes(nbytes, 'big')
+        acc &= (1 << nbits) - 1
+    return acc, nbits
+
+def _pack_into_numpy(out: bytearray, text: str, table: Dict[str, Tuple[int, int]], acc: int = 0, nbits: int = 0) -> Tuple[int, int]:
+    # То же, что pack_into, но векторно, кусками по NUMPY_PACK_CHUNK_CHARS символов
+    symbols = [(ord(symbol), value, length) for symbol, (value, length) in table.items() if len(symbol) == 1]
+    if not symbols or not text:
+        return acc, nbits
+    # Плотная таблица код символа -> номер в symbols, -1 для символов без кода.
+    # Покрывает все символы Unicode: не больше 4 МБ, зато одна на весь текст
+    lookup = np.full(max(max(cp for cp, _, _ in symbols), sys.maxunicode) + 1, -1, dtype=np.int32)
+    lookup[[cp for cp, _, _ in symbols]] = np.arange(len(symbols), dtype=np.int32)
+    values = np.array([value for _, value, _ in symbols], dtype=np.uint64)
+    lengths = np.array([length for _, _, length in symbols], dtype=np.int64)
+    for start in range(0, len(text), NUMPY_PACK_CHUNK_CHARS):
+        acc, nbits = _pack_chunk_numpy(out, text[start:start + NUMPY_PACK_CHUNK_CHARS], lookup, values, lengths, acc, nbits)
+    return acc, nbits
+
+def _pack_chunk_numpy(out: bytearray, text: str, lookup, values, lengths, acc: int, nbits: int) -> Tuple[int, int]:
+    codepoints = np.frombuffer(text.encode('utf-32-le', 'surrogatepass'), dtype=np.uint32)
+    idx = lookup[codepoints]
+    if (idx < 0).any(): # Символ без кода пропускаем
+        idx = idx[idx >= 0]
+    code_lengths = lengths[idx]
+    ends = np.cumsum(code_lengths) + nbits # первые nbits бит - остаток аккумулятора
+    total = int(ends[-1]) if len(ends) else nbits
+    if total == nbits:
+        return acc, nbits
+
+    # Раскладываем коды по длинам: каждый бит каждого кода пишем ровно один раз
+    bits = np.zeros(total, dtype=np.uint8)
+    for j in range(nbits):
+        bits[j] = (acc >> (nbits - 1 - j)) & 1
+    for length in np.unique(lengths):
+        group = np.flatnonzero(code_lengths == length)
+        if not len(group):
+            continue
+        group_values = values[idx[group]]
+        group_starts = ends[group] - length
+        for j in range(int(length)):
+            bits[group_starts + j] = (group_values >> np.uint64(length - 1 - j)) & np.uint64(1)
+    packed = np.packbits(bits)
+    whole = total >> 3
+    out += packed[:whole].tobytes()
+    nbits = total & 7
+    return (int(packed[whole]) >> (8 - nbits) if nbits else 0), nbits
+
+def pack_codes(text: str, codes: Dict[str, str], progress: Optional[Callable[[int], None]] = None) -> Tuple[bytearray, int]:
+    # Упаковывает коды символов сразу в байты, строку из '0'/'1' не собираем.
+    # Возвращает байты (последний добит нулями) и число значащих бит.
+    # progress(символов) - после каждых PROGRESS_CHUNK_SIZE символов
+    table = code_value_table(codes)
+    pack = pack_into
+    if (np is not None and len(text) >= NUMPY_PACK_MIN_SIZE and table
+            and max(length for _, length in table.values()) <= NUMPY_PACK_MAX_CODE_LEN):
+        pack = _pack_into_numpy
+    step = PROGRESS_CHUNK_SIZE if progress is not None else max(len(text), 1)
+    out = bytearray()
+    acc = nbits = 0
+    for start in range(0, len(text), step):
+        part = text[start:start + step]
+        acc, nbits = pack(out, part, table, acc, nbits)
+        if progress is not None:
+            progress(len(part))
+    bit_length = len(out) * 8 + nbits
+    if nbits:
+        out.append((acc << (8 - nbits)) & 0xFF)
+    return out, bit_length
 
 def huffman_encode(text: str, codes: Dict[str, str]) -> Tuple[str, int]:
     if not text or not codes:
         return "", 0
-    encoded_text = "".join(codes[char] for char in text if char in codes)
-    
-    padding = 0
-    if encoded_text:
-        padding = 8 - (len(encoded_text) % 8)
-        if padding == 8: 
-            padding = 0
-        encoded_text += "0" * padding
-    else: # Если текст был, но не нашлось символов в codes
+    byte_array, bit_length = pack_codes(text, codes)
+    if not bit_length: # Если текст был, но не нашлось символов в codes
         return "", 0
-
-    byte_array = bytearray()
-    for i in range(0, len(encoded_text), 8):
-        byte = encoded_text[i:i+8]
-        byte_array.append(int(byte, 2))
-    
+    padding = -bit_length % 8
     return base64.b64encode(byte_array).decode('utf-8'), padding
 
+# Ширина корневой таблицы декодера: за один шаг снимаем до DECODE_TABLE_BITS бит,
+# более длинные коды уходят в подтаблицы следующего уровня
+DECODE_TABLE_BITS = 10
+DECODE_SUBTABLE_BITS = 8
+# Кусок при декодировании с прогрессом должен вмещать самый длинный код
+DECODE_MIN_CHUNK_BITS = 64
+
+def _build_decode_table(entries, table_bits: int, sub_bits: int = DECODE_SUBTABLE_BITS):
+    # entries - список (символ, значение кода как int, длина кода)
+    # Ячейка таблицы: None (нет такого кода), (символ, длина) или (None, (подтаблица, ширина))
+    width = min(table_bits, max(length for _, _, length in entries))
+    table = [None] * (1 << width)
+    long_codes = {}
+    # Сначала длинные коды, потом короткие: короткий код перекрывает ячейку,
+    # как и при побитовом поиске, где совпадает самый короткий префикс
+    for symbol, value, length in sorted(entries, key=lambda e: -e[2]):
+        if length > width:
+            prefix = value >> (length - width)
+            rest = length - width
+            long_codes.setdefault(prefix, []).append((symbol, value & ((1 << rest) - 1), rest))
+            table[prefix] = long_codes
+        else:
+            shift = width - length
+            first = value << shift
+            for idx in range(first, first + (1 << shift)):
+                table[idx] = (symbol, length)
+    for prefix, sub_entries in long_codes.items():
+        if table[prefix] is long_codes:
+            table[prefix] = (None, _build_decode_table(sub_entries, sub_bits, sub_bits))
+    return table, width
+
+def _build_multi_table(table, width: int):
+    # Для каждого значения из width бит заранее декодируем все целые коды, что в него влезли:
+    # основной цикл за один шаг выдает сразу несколько символов
+    multi = []
+    for idx in range(1 << width):
+        symbols = []
+        used = 0
+        while used < width:
+            entry = table[((idx << used) & ((1 << width) - 1))]
+            if entry is None or entry[0] is None or used + entry[1] > width:
+                break
+            symbols.append(entry[0])
+            used += entry[1]
+        multi.append(("".join(symbols), used))
+    return multi
+
+def build_decode_table(codes: Dict[str, str], table_bits: int = DECODE_TABLE_BITS):
+    entries = []
+    for symbol, code in codes.items():
+        # Пустые и не двоичные коды побитовый декодер никогда не находил
+        if code and not code.strip("01"):
+            entries.append((symbol, int(code, 2), len(code)))
+    if not entries:
+        return None
+    table, width = _build_decode_table(entries, table_bits)
+    return table, width, _build_multi_table(table, width)
+
+def decode_bits(data: bytes, bit_length: int, decode_table, progress: Optional[Callable[[int], None]] = None) -> str:
+    # Декодирует первые bit_length бит из data, читая сразу по width бит через таблицу.
+    # progress(байт) - после каждых PROGRESS_CHUNK_SIZE байт потока
+    if decode_table is None or bit_length <= 0:
+        return ""
+    if progress is None:
+        return decode_bits_from(data, 0, bit_length, decode_table)[0]
+    parts = []
+    start = 0
+    step = max(PROGRESS_CHUNK_SIZE * 8, DECODE_MIN_CHUNK_BITS)
+    while start < bit_length:
+        # Код на границе куска остается недекодированным, с него начинается следующий кусок
+        end = min(start + step, bit_length)
+        text, stop, broken = decode_bits_from(data, start, end, decode_table)
+        parts.append(text)
+        progress((stop >> 3) - (start >> 3))
+        if broken or end == bit_length or stop == start:
+            break
+        start = stop
+    return "".join(parts)
+
+def decode_bits_from(data: bytes, start_bit: int, bit_length: int, decode_table) -> Tuple[str, int, bool]:
+    # Декодирует биты data с позиции start_bit до bit_length. Возвращает текст, позицию
+    # начала первого недекодированного кода и признак битого потока (такого кода нет)
+    root, root_width, multi = decode_table
+    root_mask = (1 << root_width) - 1
+    out = []
+    append = out.append
+    pos = start_bit >> 3
+    nbits = 0
+    acc = 0
+    if start_bit & 7: # Начинаем с середины байта: берем только его младшие биты
+        nbits = 8 - (start_bit & 7)
+        acc = data[pos]
+        pos += 1
+    size = len(data)
+    remaining = bit_length - start_bit
+    while remaining > 0:
+        if nbits < root_width:
+            # Держим в аккумуляторе только неразобранные биты
+            acc &= (1 << nbits) - 1
+            while nbits < root_width:
+                if pos < size:
+                    acc = (acc << 8) | data[pos]
+                    pos += 1
+                    nbits += 8
+                else: # Хвост добиваем нулями, remaining не даст их декодировать
+                    acc <<= root_width - nbits
+                    nbits = root_width
+        chunk, used = multi[(acc >> (nbits - root_width)) & root_mask]
+        if used and used <= remaining:
+            append(chunk)
+            nbits -= used
+            remaining -= used
+            continue
+
+        # Медленный путь: один символ с длинным кодом (через подтаблицы) или хвост потока
+        code_start = bit_length - remaining
+        table, width = root, root_width
+        while True:
+            if nbits < width:
+                acc &= (1 << nbits) - 1
+                while nbits < width:
+                    if pos < size:
+                        acc = (acc << 8) | data[pos]
+                        pos += 1
+                        nbits += 8
+                    else:
+                        acc <<= width - nbits
+                        nbits = width
+            entry = table[(acc >> (nbits - width)) & ((1 << width) - 1)]
+            if entry is None: # Такой последовательности бит нет ни в одном коде
+                return "".join(out), code_start, True
+            symbol, length = entry
+            if symbol is None:
+                if width > remaining:
+                    return "".join(out), code_start, False
+                nbits -= width
+                remaining -= width
+                table, width = length
+                continue
+            if length > remaining: # Незавершенный код в конце отбрасываем
+                return "".join(out), code_start, False
+            append(symbol)
+            nbits -= length
+            remaining -= length
+            break
+    return "".join(out), bit_length, False
+
 def huffman_decode(encoded_data: str, codes: Dict[str, str], padding: int) -> str:
     if not encoded_data or not codes:
         return ""
@@ -83,68 +421,158 @@ def huffman_decode(encoded_data: str, codes: Dict[str, str], padding: int) -> st
         byte_array = base64.b64decode(encoded_data.encode('utf-8'))
     except Exception:
         return "" # Ошибка декодирования base64
-        
-    encoded_text = ""
-    for byte_val in byte_array:
-        encoded_text += bin(byte_val)[2:].rjust(8, '0')
-
-    if padding > 0 and len(encoded_text) > padding:
-        encoded_text = encoded_text[:-padding]
-    elif padding > 0 and len(encoded_text) <= padding:
+
+    bit_length = len(byte_array) * 8
+    if padding > 0 and bit_length > padding:
+        bit_length -= padding
+    elif padding > 0 and bit_length <= padding:
         return "" # Некорректный padding
 
-    decoded_text = ""
-    current_code = ""
-    reversed_codes = {v: k for k, v in codes.items()}
-    
-    for bit in encoded_text:
-        current_code += bit
-        if current_code in reversed_codes:
-            decoded_text += reversed_codes[current_code]
-            current_code = ""
-    
-    if current_code and current_code in reversed_codes: # Проверка остатка
-         decoded_text += reversed_codes[current_code]
-    elif current_code: # Если остался незавершенный код
-        pass # Можно логировать ошибку или возвращать частичный результат/ошибку
-        
-    return decoded_text
+    return decode_bits(byte_array, bit_length, cached_decode_table(codes))
 
-def xor_cipher(data_bytes: bytes, key: str) -> bytes:
+# Ключ размножаем блоками такого размера (кратного длине ключа) и XOR-им блок целиком
+XOR_CHUNK_SIZE = 1 << 20
+
+def xor_cipher_inplace(buffer, key: str, offset: int = 0, progress: Optional[Callable[[int], None]] = None):
+    # XOR прямо в buffer (bytearray или записываемый memoryview), без промежуточных копий.
+    # offset - позиция первого байта buffer в общем потоке, от нее зависит байт ключа.
+    # progress(байт) - после каждого блока
     key_bytes = key.encode('utf-8')
     key_len = len(key_bytes)
     if not key_len: # Пустой ключ не шифрует
+        return buffer
+    shift = offset % key_len
+    key_bytes = key_bytes[shift:] + key_bytes[:shift]
+    view = memoryview(buffer).cast('B')
+    size = len(view)
+    chunk = key_len * max(1, (XOR_CHUNK_SIZE if progress is None else PROGRESS_CHUNK_SIZE) // key_len)
+    if np is not None:
+        data = np.frombuffer(view, dtype=np.uint8)
+        keystream = np.resize(np.frombuffer(key_bytes, dtype=np.uint8), min(chunk, size))
+        for start in range(0, size, chunk):
+            part = data[start:start + chunk]
+            np.bitwise_xor(part, keystream[:len(part)], out=part)
+            if progress is not None:
+                progress(len(part))
+        return buffer
+    # Без NumPy: блок и ключевой поток как два больших int, один XOR на блок
+    keystream = int.from_bytes(key_bytes * (chunk // key_len), 'big')
+    for start in range(0, size, chunk):
+        part = view[start:start + chunk]
+        part_len = len(part)
+        stream = keystream if part_len == chunk else keystream >> ((chunk - part_len) * 8)
+        part[:] = (int.from_bytes(part, 'big') ^ stream).to_bytes(part_len, 'big')
+        if progress is not None:
+            progress(part_len)
+    return buffer
+
+def xor_cipher(data_bytes: bytes, key: str) -> bytes:
+    if not key: # Пустой ключ не шифрует
         return data_bytes
-    return bytes([data_bytes[i] ^ key_bytes[i % key_len] for i in range(len(data_bytes))])
+    return bytes(xor_cipher_inplace(bytearray(data_bytes), key))
 
 def xor_decipher(ciphered_bytes: bytes, key: str) -> bytes:
     return xor_cipher(ciphered_bytes, key) # XOR обратим
 
+def encode_bytes(text: str, key: str, huffman_codes: Optional[Dict[str, str]] = None) -> Tuple[bytearray, Dict[str, str], int]:
+    # Весь конвейер на байтах: Хаффман пакуется сразу в bytearray, XOR идет на месте.
+    # В base64 результат переводится один раз, уже на границе API.
+    # huffman_codes - готовая таблица (общий словарь), иначе берется из кэша по частотам
+    if not text:
+        return bytearray(), huffman_codes or {}, 0
+    frequency = Counter(text)
+    if huffman_codes is None:
+        huffman_codes = cached_huffman_codes(frequency)
+    else:
+        check_codes_cover(frequency, huffman_codes)
+    payload, bit_length = pack_codes(text, huffman_codes)
+    if not bit_length:
+        return bytearray(), huffman_codes, 0
+    xor_cipher_inplace(payload, key)
+    return payload, huffman_codes, -bit_length % 8
+
+def _payload_bit_length(payload_size: int, padding: int) -> int:
+    bit_length = payload_size * 8
+    if padding > 0:
+        bit_length -= padding
+    return bit_length
+
+def decode_bytes(payload, key: str, huffman_codes: Dict[str, str], padding: int) -> str:
+    # bytearray расшифровывается на месте, bytes сначала копируется
+    if not payload or not huffman_codes:
+        return ""
+    if not isinstance(payload, bytearray):
+        payload = bytearray(payload)
+    xor_cipher_inplace(payload, key)
+    return decode_bits(payload, _payload_bit_length(len(payload), padding), cached_decode_table(huffman_codes))
+
 # Эти функции будут вызываться задачами Celery
 # Они возвращают результат напрямую, а не task_id
 
-def perform_encode(text: str, key: str, task_id: str, send_progress_update) -> Dict:
-    if not text:
-        send_progress_update(task_id, "encode", 100)
-        return {"encoded_data": "", "key": key, "huffman_codes": {}, "padding": 0}
+class ProgressTracker:
+    # Прогресс задачи по обработанным байтам (символам) всех проходов: подсчет частот,
+    # упаковка, XOR, декодирование. Объем прохода можно добавить, когда он станет известен.
+    # send_progress_update зовется только при смене целого процента, до finish - не больше 99.
+    # Сколько событий в секунду уходит клиенту, ограничивает уже задача
+    def __init__(self, task_id: str, operation: str, send_progress_update, total: int):
+        self.task_id = task_id
+        self.operation = operation
+        self.send_progress_update = send_progress_update
+        self.total = total
+        self.done = 0
+        self.percentage = 0
 
-    send_progress_update(task_id, "encode", 10) # 1. Начало
-    _, huffman_codes = build_huffman_tree(text)
-    send_progress_update(task_id, "encode", 30) # 2. Дерево построено
+    def expect(self, amount: int):
+        self.total += amount
 
-    huffman_encoded_str, padding = huffman_encode(text, huffman_codes)
-    send_progress_update(task_id, "encode", 60) # 3. Хаффман кодирование завершено
+    def advance(self, amount: int):
+        self.done += amount
+        percentage = min(self.done * 100 // self.total, 99) if self.total else 0
+        if percentage > self.percentage:
+            self.percentage = percentage
+            self.send_progress_update(self.task_id, self.operation, percentage)
 
-    if not huffman_encoded_str:
-        send_progress_update(task_id, "encode", 100)
-        return {"encoded_data": "", "key": key, "huffman_codes": huffman_codes, "padding": 0}
+    def finish(self):
+        self.percentage = 100
+        self.send_progress_update(self.task_id, self.operation, 100)
 
-    huffman_encoded_bytes = base64.b64decode(huffman_encoded_str.encode('utf-8'))
-    send_progress_update(task_id, "encode", 80) # 4. Декодировано из Base64 для XOR
-    
-    xor_ciphered_bytes = xor_cipher(huffman_encoded_bytes, key)
-    final_encoded_data = base64.b64encode(xor_ciphered_bytes).decode('utf-8')
-    send_progress_update(task_id, "encode", 100) # 5. Готово
+def encode_bytes_tracked(text: str, key: str, huffman_codes: Optional[Dict[str, str]],
+                         progress: ProgressTracker) -> Tuple[bytearray, Dict[str, str], int]:
+    # encode_bytes для задач: частоты, упаковка и XOR идут кусками, после каждого - progress
+    frequency = Counter()
+    for start in range(0, len(text), PROGRESS_CHUNK_SIZE):
+        part = text[start:start + PROGRESS_CHUNK_SIZE]
+        frequency.update(part)
+        progress.advance(len(part))
+    if huffman_codes is None:
+        huffman_codes = cached_huffman_codes(frequency)
+    else: # Общий словарь: дерево не строим, только проверяем, что все символы есть
+        check_codes_cover(frequency, huffman_codes)
+    # Длина потока известна по частотам еще до упаковки: это объем XOR
+    progress.expect((sum(count * len(huffman_codes[char]) for char, count in frequency.items()) + 7) // 8)
+    payload, bit_length = pack_codes(text, huffman_codes, progress.advance)
+    if not bit_length:
+        return bytearray(), huffman_codes, 0
+    xor_cipher_inplace(payload, key, progress=progress.advance)
+    return payload, huffman_codes, -bit_length % 8
+
+def decode_bytes_tracked(payload: bytearray, key: str, huffman_codes: Dict[str, str], padding: int,
+                         progress: ProgressTracker) -> str:
+    # decode_bytes для задач: payload расшифровывается на месте. Объем - XOR и декодирование
+    progress.expect(2 * len(payload))
+    xor_cipher_inplace(payload, key, progress=progress.advance)
+    decode_table = cached_decode_table(huffman_codes) if huffman_codes else None
+    return decode_bits(payload, _payload_bit_length(len(payload), padding), decode_table, progress.advance)
+
+def perform_encode(text: str, key: str, task_id: str, send_progress_update, huffman_codes: Optional[Dict[str, str]] = None) -> Dict:
+    progress = ProgressTracker(task_id, "encode", send_progress_update, 2 * len(text))
+    if not text:
+        progress.finish()
+        return {"encoded_data": "", "key": key, "huffman_codes": huffman_codes or {}, "padding": 0}
+
+    payload, huffman_codes, padding = encode_bytes_tracked(text, key, huffman_codes, progress)
+    final_encoded_data = base64.b64encode(payload).decode('utf-8')
+    progress.finish()
     
     return {
         "encoded_data": final_encoded_data,
@@ -154,28 +582,19 @@ def perform_encode(text: str, key: str, task_id: str, send_progress_update) -> D
     }
 
 def perform_decode(encoded_data: str, key: str, huffman_codes: Dict[str, str], padding: int, task_id: str, send_progress_update) -> Dict:
+    progress = ProgressTracker(task_id, "decode", send_progress_update, 0)
     if not encoded_data:
-        send_progress_update(task_id, "decode", 100)
+        progress.finish()
         return {"decoded_text": ""}
 
-    send_progress_update(task_id, "decode", 10) # 1. Начало
     try:
-        ciphered_bytes = base64.b64decode(encoded_data.encode('utf-8'))
+        payload = bytearray(base64.b64decode(encoded_data.encode('utf-8')))
     except Exception as e:
         # Здесь можно логировать ошибку e
-        send_progress_update(task_id, "decode", 100) 
+        progress.finish()
         raise ValueError(f"Invalid base64 data for task {task_id}")
-        
-    send_progress_update(task_id, "decode", 30) # 2. Декодировано из Base64
-
-    xor_deciphered_bytes = xor_decipher(ciphered_bytes, key)
-    send_progress_update(task_id, "decode", 60) # 3. XOR расшифровка
-    
-    # Для huffman_decode, данные должны быть снова в base64
-    xor_deciphered_base64_str = base64.b64encode(xor_deciphered_bytes).decode('utf-8')
-    send_progress_update(task_id, "decode", 80) # 4. Подготовлено для Хаффмана
 
-    decoded_text = huffman_decode(xor_deciphered_base64_str, huffman_codes, padding)
-    send_progress_update(task_id, "decode", 100) # 5. Готово
+    decoded_text = decode_bytes_tracked(payload, key, huffman_codes, padding, progress)
+    progress.finish()
 
-    return {"decoded_text": decoded_text} 
\ No newline at end of file
+    return {"decoded_text": decoded_text}
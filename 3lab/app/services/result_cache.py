@@ -0,0 +1,167 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+import redis
+from app.core.config import settings
+
+# Дедупликация одинаковых запросов encode/decode в процессе API. Отпечаток - blake2b от операции
+# и всех параметров, от которых зависит результат (client_id в него не входит).
+# Готовые результаты (поля result/result_ref события COMPLETED) лежат в LRU, ограниченном
+# числом записей и байтами, и, если задан RESULT_CACHE_REDIS_URL, еще и в redis, общем для
+# процессов API. Пока задача выполняется, ее отпечаток помнится как "в работе": повторный
+# такой же запрос получает тот же task_id и подписывается на ее события через task_subscribers.
+# Заполняется кэш событиями, которые проходят через процесс API (deliver_event)
+RESULT_CACHE_REDIS_KEY = "result:cache:{}"
+
+def request_fingerprint(operation: str, *parts) -> str:
+    # Части с длиной впереди: ("ab", "c") и ("a", "bc") дают разные отпечатки
+    digest = hashlib.blake2b(operation.encode("utf-8"), digest_size=20)
+    for part in parts:
+        if isinstance(part, str):
+            data = part.encode("utf-8", "surrogatepass")
+        else:
+            data = json.dumps(part, sort_keys=True, ensure_ascii=False).encode("utf-8", "surrogatepass")
+        digest.update(len(data).to_bytes(8, "little"))
+        digest.update(data)
+    return digest.hexdigest()
+
+class ResultCache:
+    def __init__(self, max_entries: int, max_bytes: int, ttl_seconds: float, redis_url: Optional[str] = None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.redis = redis.Redis.from_url(redis_url) if redis_url else None
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict() # отпечаток -> (JSON, когда протухнет)
+        self._bytes = 0
+        self._in_flight: Dict[str, tuple] = {} # отпечаток -> (task_id, когда забыть)
+        self._in_flight_keys: Dict[str, str] = {} # task_id -> отпечаток
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.coalesced = 0 # запросов, присоединенных к уже идущей задаче
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def get(self, fingerprint: str) -> Optional[Dict]:
+        # -> {"result": ..., "result_ref": ...} готового результата или None
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(fingerprint)
+            if entry is not None and entry[1] > now:
+                self._entries.move_to_end(fingerprint)
+                self.hits += 1
+                return json.loads(entry[0])
+            if entry is not None: # протух по TTL
+                self._remove(fingerprint)
+                self.evictions += 1
+        if self.redis is not None:
+            try:
+                data = self.redis.get(RESULT_CACHE_REDIS_KEY.format(fingerprint))
+            except redis.RedisError as e:
+                print(f"Error reading result cache from redis: {e}")
+                data = None
+            if data is not None:
+                self._store(fingerprint, data)
+                with self._lock:
+                    self.hits += 1
+                return json.loads(data)
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, fingerprint: str, value: Dict):
+        data = json.dumps(value, ensure_ascii=False).encode("utf-8")
+        self._store(fingerprint, data)
+        if self.redis is not None:
+            try:
+                self.redis.set(RESULT_CACHE_REDIS_KEY.format(fingerprint), data, ex=int(self.ttl_seconds))
+            except redis.RedisError as e:
+                print(f"Error writing result cache to redis: {e}")
+
+    def _store(self, fingerprint: str, data: bytes):
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            if fingerprint in self._entries:
+                self._remove(fingerprint)
+            self._entries[fingerprint] = (data, time.monotonic() + self.ttl_seconds)
+            self._bytes += len(data)
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _remove(self, fingerprint: str):
+        data, _ = self._entries.pop(fingerprint)
+        self._bytes -= len(data)
+
+    def track(self, fingerprint: str, task_id: str):
+        # Задача запущена: такие же запросы до ее завершения присоединяются к ней
+        with self._lock:
+            self._in_flight[fingerprint] = (task_id, time.monotonic() + self.ttl_seconds)
+            self._in_flight_keys[task_id] = fingerprint
+
+    def join(self, fingerprint: str) -> Optional[str]:
+        # -> task_id идущей задачи с тем же отпечатком или None. Задача, о завершении
+        # которой так и не пришло событие, забывается через TTL
+        with self._lock:
+            entry = self._in_flight.get(fingerprint)
+            if entry is None:
+                return None
+            if entry[1] <= time.monotonic():
+                self._forget(fingerprint)
+                return None
+            self.coalesced += 1
+            return entry[0]
+
+    def untrack(self, task_id: str):
+        # Задачу так и не удалось запустить
+        with self._lock:
+            fingerprint = self._in_flight_keys.get(task_id)
+            if fingerprint is not None:
+                self._forget(fingerprint)
+
+    def _forget(self, fingerprint: str):
+        task_id, _ = self._in_flight.pop(fingerprint)
+        self._in_flight_keys.pop(task_id, None)
+
+    def observe_event(self, task_id: str, message_data: Dict) -> Optional[Tuple[str, Dict]]:
+        # Итог задачи из _in_flight забывает ее. -> (отпечаток, значение) для put, если это COMPLETED:
+        # сохраняет вызывающий, вне event loop (put может ходить в redis)
+        status = message_data.get("status")
+        if status not in ("COMPLETED", "FAILED") or task_id not in self._in_flight_keys:
+            return None
+        with self._lock:
+            fingerprint = self._in_flight_keys.get(task_id)
+            if fingerprint is None:
+                return None
+            self._forget(fingerprint)
+        if status != "COMPLETED":
+            return None
+        return fingerprint, {"result": message_data.get("result"), "result_ref": message_data.get("result_ref")}
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "coalesced": self.coalesced,
+                "in_flight": len(self._in_flight),
+            }
+
+result_cache = ResultCache(
+    settings.RESULT_CACHE_MAX_ENTRIES,
+    settings.RESULT_CACHE_MAX_BYTES,
+    settings.RESULT_CACHE_TTL_SECONDS,
+    settings.RESULT_CACHE_REDIS_URL,
+)
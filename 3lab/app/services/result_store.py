@@ -0,0 +1,172 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from typing import Dict, Iterator, Optional, Tuple
+import redis
+from app.core.config import settings
+
+# Хранилище больших результатов задач. Результат кладет воркер, в событии COMPLETED и в
+# бэкенде Celery остается только ссылка, а клиент забирает данные GET /encryption/result/{task_id}.
+# Блоб адресуется по содержимому (blake2b), одинаковые результаты хранятся один раз.
+# Запись задачи: task_id -> {"blob_id", "size", "content_type", "expires_at"}. И записи, и блобы
+# живут RESULT_TTL_SECONDS; повторная запись того же блоба продлевает ему жизнь
+RESULT_READ_CHUNK_SIZE = 1 << 20
+RESULT_SWEEP_INTERVAL = 60.0 # секунд между проходами очистки на диске
+
+def blob_id_for(data: bytes) -> str:
+    return hashlib.blake2b(data, digest_size=20).hexdigest()
+
+class DiskResultStore:
+    # Каталог, общий для воркеров и API на одной машине:
+    #   blobs/<2 символа>/<blob_id>  tasks/<task_id>.json
+    # Файлы пишутся во временный и переименовываются, читатель не видит недописанного
+    def __init__(self, directory: str, ttl_seconds: float):
+        self.directory = directory
+        self.ttl_seconds = ttl_seconds
+        self._last_sweep = 0.0
+        self._lock = threading.Lock()
+
+    def _blob_path(self, blob_id: str) -> str:
+        return os.path.join(self.directory, "blobs", blob_id[:2], blob_id)
+
+    def _record_path(self, task_id: str) -> str:
+        return os.path.join(self.directory, "tasks", f"{task_id}.json")
+
+    def _write_atomic(self, path: str, data: bytes):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def put(self, task_id: str, data: bytes, content_type: str) -> Dict:
+        blob_id = blob_id_for(data)
+        blob_path = self._blob_path(blob_id)
+        try:
+            os.utime(blob_path) # уже есть: только продлеваем
+        except FileNotFoundError:
+            self._write_atomic(blob_path, data)
+        record = {"blob_id": blob_id, "size": len(data), "content_type": content_type,
+                  "expires_at": time.time() + self.ttl_seconds}
+        self._write_atomic(self._record_path(task_id), json.dumps(record).encode("utf-8"))
+        self._maybe_sweep()
+        return record
+
+    def get_record(self, task_id: str) -> Optional[Dict]:
+        try:
+            with open(self._record_path(task_id), "rb") as f:
+                record = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+        if record["expires_at"] < time.time():
+            return None
+        return record
+
+    def open(self, task_id: str) -> Optional[Tuple[Dict, Iterator[bytes]]]:
+        record = self.get_record(task_id)
+        if record is None:
+            return None
+        try:
+            f = open(self._blob_path(record["blob_id"]), "rb")
+        except FileNotFoundError:
+            return None
+        return record, self._read_chunks(f)
+
+    def _read_chunks(self, f) -> Iterator[bytes]:
+        with f:
+            while True:
+                chunk = f.read(RESULT_READ_CHUNK_SIZE)
+                if not chunk:
+                    return
+                yield chunk
+
+    def _maybe_sweep(self):
+        now = time.time()
+        with self._lock:
+            if now - self._last_sweep < RESULT_SWEEP_INTERVAL:
+                return
+            self._last_sweep = now
+        self.sweep(now)
+
+    def sweep(self, now: Optional[float] = None) -> int:
+        # Удаляет протухшие записи и блобы, которые никто не продлевал дольше TTL. -> сколько файлов удалено
+        now = now or time.time()
+        removed = 0
+        tasks_dir = os.path.join(self.directory, "tasks")
+        for entry in _scandir(tasks_dir):
+            try:
+                with open(entry.path, "rb") as f:
+                    expired = json.load(f)["expires_at"] < now
+            except (OSError, ValueError, KeyError):
+                expired = entry.name.startswith(".tmp-") and entry.stat().st_mtime + self.ttl_seconds < now
+            if expired:
+                removed += _unlink(entry.path)
+        for shard in _scandir(os.path.join(self.directory, "blobs")):
+            for entry in _scandir(shard.path):
+                if entry.stat().st_mtime + self.ttl_seconds < now:
+                    removed += _unlink(entry.path)
+        return removed
+
+def _scandir(path: str):
+    try:
+        return list(os.scandir(path))
+    except FileNotFoundError:
+        return []
+
+def _unlink(path: str) -> int:
+    try:
+        os.unlink(path)
+        return 1
+    except FileNotFoundError: # уже удалил другой процесс
+        return 0
+
+class RedisResultStore:
+    # Блобы и записи в redis с EXPIRE: подходит, когда воркеры и API на разных машинах.
+    # Блоб читается кусками через GETRANGE, целиком в память API не поднимается
+    def __init__(self, url: str, ttl_seconds: float):
+        self.client = redis.Redis.from_url(url)
+        self.ttl_seconds = ttl_seconds
+
+    def put(self, task_id: str, data: bytes, content_type: str) -> Dict:
+        blob_id = blob_id_for(data)
+        ttl = int(self.ttl_seconds)
+        blob_key = f"result:blob:{blob_id}"
+        if not self.client.expire(blob_key, ttl): # уже есть: только продлеваем
+            self.client.set(blob_key, data, ex=ttl)
+        record = {"blob_id": blob_id, "size": len(data), "content_type": content_type,
+                  "expires_at": time.time() + self.ttl_seconds}
+        self.client.set(f"result:task:{task_id}", json.dumps(record), ex=ttl)
+        return record
+
+    def get_record(self, task_id: str) -> Optional[Dict]:
+        raw = self.client.get(f"result:task:{task_id}")
+        return json.loads(raw) if raw is not None else None
+
+    def open(self, task_id: str) -> Optional[Tuple[Dict, Iterator[bytes]]]:
+        record = self.get_record(task_id)
+        if record is None or not self.client.exists(f"result:blob:{record['blob_id']}"):
+            return None
+        return record, self._read_chunks(f"result:blob:{record['blob_id']}", record["size"])
+
+    def _read_chunks(self, key: str, size: int) -> Iterator[bytes]:
+        for start in range(0, size, RESULT_READ_CHUNK_SIZE):
+            yield self.client.getrange(key, start, min(start + RESULT_READ_CHUNK_SIZE, size) - 1)
+
+_result_store = None
+
+def get_result_store():
+    # Одно хранилище на процесс, по настройкам RESULT_STORE*
+    global _result_store
+    if _result_store is None:
+        if settings.RESULT_STORE == "redis":
+            _result_store = RedisResultStore(settings.RESULT_STORE_REDIS_URL, settings.RESULT_TTL_SECONDS)
+        else:
+            _result_store = DiskResultStore(settings.RESULT_STORE_DIR, settings.RESULT_TTL_SECONDS)
+    return _result_store
@@ -0,0 +1,149 @@
+import codecs
+import zlib
+from typing import BinaryIO, Dict, Iterator, Optional, Tuple
+from app.services.encryption_service import (
+    cached_decode_table, decode_bits_from, xor_cipher_inplace, code_value_table, pack_into
+)
+from app.services.container import (
+    CONTAINER_HEADER, CHECKSUM_SIZE, FLAG_CHECKSUM,
+    container_header, container_payload_size, checksum_trailer, is_container, read_container_header
+)
+
+# Сколько байт читаем из буфера загрузки за один шаг: от этого зависит пиковая память
+STREAM_CHUNK_SIZE = 1 << 20
+
+def iter_text_chunks(source: BinaryIO, chunk_size: int = STREAM_CHUNK_SIZE) -> Iterator[str]:
+    # UTF-8 декодируем по кускам: символ, разрезанный границей куска, доберется в следующем
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    while True:
+        raw = source.read(chunk_size)
+        text = decoder.decode(raw, final=not raw)
+        if text:
+            yield text
+        if not raw:
+            return
+
+def encoded_bit_length(frequency: Dict[str, int], huffman_codes: Dict[str, str]) -> int:
+    # Длина потока известна заранее по частотам, поэтому padding можно отдать до данных
+    return sum(count * len(huffman_codes.get(char, "")) for char, count in frequency.items())
+
+class HuffmanStreamEncoder:
+    # Кодирует текст по кускам одной таблицей: куски склеиваются по битам,
+    # ключ XOR продолжается с того места, где остановился предыдущий кусок
+    def __init__(self, huffman_codes: Dict[str, str], key: str):
+        self.table = code_value_table(huffman_codes)
+        self.key = key
+        self.acc = 0
+        self.nbits = 0
+        self.offset = 0
+
+    def encode(self, text: str) -> bytearray:
+        out = bytearray()
+        self.acc, self.nbits = pack_into(out, text, self.table, self.acc, self.nbits)
+        return self._cipher(out)
+
+    def finish(self) -> bytearray:
+        out = bytearray()
+        if self.nbits: # Последний байт добиваем нулями, как и при обычном кодировании
+            out.append((self.acc << (8 - self.nbits)) & 0xFF)
+            self.acc = 0
+            self.nbits = 0
+        return self._cipher(out)
+
+    def _cipher(self, out: bytearray) -> bytearray:
+        xor_cipher_inplace(out, self.key, self.offset)
+        self.offset += len(out)
+        return out
+
+class HuffmanStreamDecoder:
+    # Декодирует поток по кускам. Последние padding бит могут оказаться добивкой,
+    # поэтому их не трогаем: после последнего куска разобрано ровно то же, что и целиком
+    def __init__(self, huffman_codes: Dict[str, str], key: str, padding: int):
+        self.decode_table = cached_decode_table(huffman_codes) if huffman_codes else None
+        self.key = key
+        self.padding = max(padding, 0)
+        self.pending = bytearray()
+        self.bit_pos = 0
+        self.offset = 0
+        self.broken = self.decode_table is None
+
+    def decode(self, chunk: bytes) -> str:
+        if self.broken or not chunk:
+            return ""
+        start = len(self.pending)
+        self.pending += chunk
+        with memoryview(self.pending) as view:
+            xor_cipher_inplace(view[start:], self.key, self.offset)
+        self.offset += len(chunk)
+
+        limit = len(self.pending) * 8 - self.padding
+        if limit <= self.bit_pos:
+            return ""
+        text, stop, self.broken = decode_bits_from(self.pending, self.bit_pos, limit, self.decode_table)
+        # Разобранные байты выкидываем, недоразобранный код остается на следующий кусок
+        del self.pending[:stop >> 3]
+        self.bit_pos = stop & 7
+        return text
+
+def iter_encoded_chunks(source: BinaryIO, huffman_codes: Dict[str, str], key: str) -> Iterator[bytes]:
+    encoder = HuffmanStreamEncoder(huffman_codes, key)
+    for text in iter_text_chunks(source):
+        out = encoder.encode(text)
+        if out:
+            yield bytes(out)
+    tail = encoder.finish()
+    if tail:
+        yield bytes(tail)
+
+def iter_decoded_chunks(source: BinaryIO, huffman_codes: Dict[str, str], key: str, padding: int,
+                        size: Optional[int] = None) -> Iterator[bytes]:
+    # size - сколько байт данных читать (у контейнера за ними идет контрольная сумма)
+    decoder = HuffmanStreamDecoder(huffman_codes, key, padding)
+    while size is None or size > 0:
+        raw = source.read(STREAM_CHUNK_SIZE if size is None else min(size, STREAM_CHUNK_SIZE))
+        if not raw:
+            return
+        if size is not None:
+            size -= len(raw)
+        text = decoder.decode(raw)
+        if text:
+            yield text.encode('utf-8')
+
+# Контейнер потоком: заголовок и таблица известны до данных, CRC32 считается по ходу и идет последним
+
+def container_stream_size(huffman_codes: Dict[str, str], bit_length: int) -> int:
+    return len(container_header(huffman_codes, bit_length)) + container_payload_size(bit_length) + CHECKSUM_SIZE
+
+def iter_container_chunks(source: BinaryIO, huffman_codes: Dict[str, str], key: str, bit_length: int) -> Iterator[bytes]:
+    yield container_header(huffman_codes, bit_length)
+    crc = 0
+    for chunk in iter_encoded_chunks(source, huffman_codes, key):
+        crc = zlib.crc32(chunk, crc)
+        yield chunk
+    yield checksum_trailer(crc)
+
+def open_container_stream(source: BinaryIO) -> Tuple[Dict[str, str], int, int]:
+    # Разбирает заголовок и сверяет CRC32 до того, как начнется ответ: после первого
+    # отданного куска сообщить об ошибке уже нельзя. -> (коды, padding, размер данных);
+    # source остается на начале данных
+    head = source.read(CONTAINER_HEADER.size)
+    if len(head) == CONTAINER_HEADER.size and is_container(head):
+        head += source.read(CONTAINER_HEADER.unpack_from(head)[3])
+    huffman_codes, bit_length, start, flags = read_container_header(head)
+    size = container_payload_size(bit_length)
+
+    remaining = size
+    crc = 0
+    while remaining:
+        raw = source.read(min(remaining, STREAM_CHUNK_SIZE))
+        if not raw:
+            raise ValueError("Container is truncated")
+        crc = zlib.crc32(raw, crc)
+        remaining -= len(raw)
+    trailer = source.read(CHECKSUM_SIZE + 1)
+    if len(trailer) != (CHECKSUM_SIZE if flags & FLAG_CHECKSUM else 0):
+        raise ValueError("Container size does not match its header")
+    if flags & FLAG_CHECKSUM and trailer != checksum_trailer(crc):
+        raise ValueError("Container checksum mismatch")
+    source.seek(start)
+    return huffman_codes, size * 8 - bit_length, size
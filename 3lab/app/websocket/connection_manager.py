@@ -1,33 +1,121 @@
 from fastapi import WebSocket
-from typing import Dict, List, DefaultDict
-from collections import defaultdict
+from typing import Dict, Set, DefaultDict, Optional
+from collections import defaultdict, OrderedDict
+from app.core.config import settings
+import asyncio
+import itertools
 import json
+import time
+
+# Код закрытия для клиента, который не успевает читать (RFC 6455: Try Again Later)
+SLOW_CONSUMER_CLOSE_CODE = 1013
+# Старое соединение клиента, переподключившегося с тем же client_id (RFC 6455: Normal Closure)
+REPLACED_CLOSE_CODE = 1000
+
+class ClientOutbox:
+    # Исходящие JSON-сообщения одного соединения. Их отправляет отдельная задача на клиента,
+    # так что медленный клиент не задерживает раздачу событий остальным.
+    # PROGRESS задачи хранится под ключом ("progress", task_id) и заменяется новым на своем
+    # месте: пока клиент не успевает читать, у него копится только последнее состояние
+    def __init__(self, websocket: WebSocket):
+        self.websocket = websocket
+        self.messages: OrderedDict = OrderedDict()
+        self.sender: Optional[asyncio.Task] = None
+        self.connected_at = time.time()
+        self.sending_since: Optional[float] = None # time.monotonic() начала текущей отправки
+        self.sent = 0
+        self.coalesced = 0 # PROGRESS, замененных более свежими до отправки
+        self.dropped = 0 # PROGRESS, выброшенных из переполненной очереди
+        self.max_depth = 0
+
+    def drop_oldest_progress(self) -> bool:
+        for key in self.messages:
+            if key[0] == "progress":
+                del self.messages[key]
+                self.dropped += 1
+                return True
+        return False
+
+    def stats(self) -> Dict:
+        return {
+            "depth": len(self.messages),
+            "max_depth": self.max_depth,
+            "sent": self.sent,
+            "coalesced": self.coalesced,
+            "dropped": self.dropped,
+            "connected_seconds": time.time() - self.connected_at,
+            "sending_seconds": time.monotonic() - self.sending_since if self.sending_since is not None else None,
+        }
 
 class ConnectionManager:
-    def __init__(self):
+    def __init__(self, queue_size: int = settings.WS_SEND_QUEUE_SIZE, send_timeout: float = settings.WS_SEND_TIMEOUT):
         # Храним активные соединения: client_id -> WebSocket
         self.active_connections: Dict[str, WebSocket] = {}
-        # Храним задачи, на которые подписан клиент: client_id -> List[task_id]
-        self.client_subscriptions: DefaultDict[str, List[str]] = defaultdict(list)
-        # Храним клиентов, подписанных на задачу: task_id -> List[client_id]
-        self.task_subscribers: DefaultDict[str, List[str]] = defaultdict(list)
+        # Храним задачи, на которые подписан клиент: client_id -> Set[task_id]
+        self.client_subscriptions: DefaultDict[str, Set[str]] = defaultdict(set)
+        # Храним клиентов, подписанных на задачу: task_id -> Set[client_id]
+        self.task_subscribers: DefaultDict[str, Set[str]] = defaultdict(set)
+        # Очереди отправки: client_id -> ClientOutbox. Очередь ограничена queue_size сообщениями,
+        # отправка одного сообщения - send_timeout секундами, иначе клиент отключается
+        self.outboxes: Dict[str, ClientOutbox] = {}
+        self.queue_size = queue_size
+        self.send_timeout = send_timeout
+        self._message_ids = itertools.count()
+        self.coalesced_progress = 0
+        self.dropped_progress = 0
+        self.slow_disconnects = 0
 
     async def connect(self, websocket: WebSocket, client_id: str):
         await websocket.accept()
+        outbox = ClientOutbox(websocket)
+        old_outbox = self.outboxes.get(client_id)
+        if old_outbox is not None:
+            # Переподключение с тем же client_id: подписки остаются за клиентом, неотправленные
+            # сообщения переходят в новую очередь, а старое соединение закрываем
+            if old_outbox.sender is not None:
+                old_outbox.sender.cancel()
+            outbox.messages = old_outbox.messages
+            asyncio.create_task(self._close_quietly(old_outbox.websocket, REPLACED_CLOSE_CODE))
+            print(f"Client {client_id} reconnected. Closing its previous connection.")
         self.active_connections[client_id] = websocket
+        self.outboxes[client_id] = outbox
+        if outbox.messages:
+            outbox.sender = asyncio.create_task(self._send_outbox(client_id, outbox))
         print(f"Client {client_id} connected. Total clients: {len(self.active_connections)}")
 
-    def disconnect(self, client_id: str):
+    def disconnect(self, client_id: str, websocket: WebSocket = None):
+        # websocket - соединение, которое закрылось. Если клиент уже переподключился,
+        # зарегистрировано другое, и трогать его подписки и очередь нельзя
+        if websocket is not None and self.active_connections.get(client_id) is not websocket:
+            return
         if client_id in self.active_connections:
             # Перед удалением соединения, отписываем клиента от всех его задач
-            tasks_to_cleanup = list(self.client_subscriptions.get(client_id, []))
+            tasks_to_cleanup = list(self.client_subscriptions.get(client_id, ()))
             for task_id in tasks_to_cleanup:
                 self.unsubscribe(client_id, task_id)
             del self.active_connections[client_id]
+            outbox = self.outboxes.pop(client_id, None)
+            if outbox is not None and outbox.sender is not None and outbox.sender is not asyncio.current_task():
+                outbox.sender.cancel()
             if client_id in self.client_subscriptions:
                  del self.client_subscriptions[client_id]
             print(f"Client {client_id} disconnected. Total clients: {len(self.active_connections)}")
 
+    def _disconnect_slow(self, client_id: str, reason: str):
+        # Клиент не читает: соединение закрываем, а не копим сообщения или теряем итоги задач
+        outbox = self.outboxes.get(client_id)
+        print(f"Client {client_id} is too slow ({reason}). Disconnecting.")
+        self.slow_disconnects += 1
+        self.disconnect(client_id)
+        if outbox is not None:
+            asyncio.create_task(self._close_quietly(outbox.websocket, SLOW_CONSUMER_CLOSE_CODE))
+
+    async def _close_quietly(self, websocket: WebSocket, code: int):
+        try:
+            await asyncio.wait_for(websocket.close(code=code), self.send_timeout)
+        except Exception:
+            pass
+
     async def send_personal_message(self, message: str, client_id: str):
         if client_id in self.active_connections:
             websocket = self.active_connections[client_id]
@@ -35,51 +123,113 @@ class ConnectionManager:
                 await websocket.send_text(message)
             except Exception as e:
                 print(f"Error sending text to client {client_id}: {e}. Disconnecting.")
-                self.disconnect(client_id)
+                self.disconnect(client_id, websocket)
 
     async def send_personal_message_json(self, data: dict, client_id: str, task_id_for_subscription: str = None):
         if client_id in self.active_connections:
-            websocket = self.active_connections[client_id]
+            outbox = self.outboxes[client_id]
+            status = data.get("status")
             # Если это сообщение о старте задачи, подписываем клиента на эту задачу
-            if task_id_for_subscription and data.get("status") == "STARTED":
+            if task_id_for_subscription and status == "STARTED":
                 self.subscribe(client_id, task_id_for_subscription)
             
             # Если это сообщение о завершении или ошибке, отписываем клиента от задачи
-            if task_id_for_subscription and data.get("status") in ["COMPLETED", "FAILED"]:
+            if task_id_for_subscription and status in ["COMPLETED", "FAILED"]:
                 self.unsubscribe(client_id, task_id_for_subscription)
-                
-            try:
-                await websocket.send_json(data)
-            except Exception as e:
-                print(f"Error sending json to client {client_id}: {e}. Disconnecting.")
-                self.disconnect(client_id)
+
+            messages = outbox.messages
+            if task_id_for_subscription and status == "PROGRESS":
+                key = ("progress", task_id_for_subscription)
+                if key in messages:
+                    outbox.coalesced += 1
+                    self.coalesced_progress += 1
+                elif len(messages) >= self.queue_size:
+                    # Место - за счет самого старого прогресса другой задачи
+                    self.dropped_progress += 1
+                    if not outbox.drop_oldest_progress():
+                        # Очередь забита итогами задач: выбрасываем этот прогресс
+                        outbox.dropped += 1
+                        return
+                messages[key] = data
+            else:
+                if task_id_for_subscription and status in ["COMPLETED", "FAILED"]:
+                    # Итог задачи делает ее неотправленный прогресс ненужным
+                    if messages.pop(("progress", task_id_for_subscription), None) is not None:
+                        outbox.coalesced += 1
+                        self.coalesced_progress += 1
+                if len(messages) >= self.queue_size:
+                    if not outbox.drop_oldest_progress():
+                        # Остальные сообщения выбрасывать нельзя: клиент потерял бы итог задачи
+                        self._disconnect_slow(client_id, f"send queue is full ({len(messages)} messages)")
+                        return
+                    self.dropped_progress += 1
+                messages[("message", next(self._message_ids))] = data
+            outbox.max_depth = max(outbox.max_depth, len(messages))
+            if outbox.sender is None:
+                outbox.sender = asyncio.create_task(self._send_outbox(client_id, outbox))
+
+    async def _send_outbox(self, client_id: str, outbox: ClientOutbox):
+        messages = outbox.messages
+        try:
+            while messages:
+                _, data = messages.popitem(last=False)
+                outbox.sending_since = time.monotonic()
+                await asyncio.wait_for(outbox.websocket.send_json(data), self.send_timeout)
+                outbox.sending_since = None
+                outbox.sent += 1
+        except asyncio.TimeoutError:
+            if self.outboxes.get(client_id) is outbox:
+                self._disconnect_slow(client_id, f"send took longer than {self.send_timeout} s")
+        except Exception as e:
+            print(f"Error sending json to client {client_id}: {e}. Disconnecting.")
+            self.disconnect(client_id, outbox.websocket)
+        finally:
+            outbox.sender = None
+
+    def queue_stats(self, limit: int = 100) -> Dict:
+        # Сводка по очередям отправки и limit соединений с самой длинной очередью
+        outboxes = sorted(self.outboxes.items(), key=lambda item: len(item[1].messages), reverse=True)
+        return {
+            "connections": len(self.outboxes),
+            "queued_messages": sum(len(outbox.messages) for outbox in self.outboxes.values()),
+            "queue_size": self.queue_size,
+            "coalesced_progress": self.coalesced_progress,
+            "dropped_progress": self.dropped_progress,
+            "slow_disconnects": self.slow_disconnects,
+            "clients": [
+                {"client_id": client_id, "subscriptions": len(self.client_subscriptions.get(client_id, ())), **outbox.stats()}
+                for client_id, outbox in outboxes[:limit]
+            ],
+        }
     
+    def is_connected(self, client_id: str) -> bool:
+        # Сокет клиента в этом процессе. При uvicorn --workers N клиент может быть подключен к другому
+        return client_id in self.active_connections
+
     def subscribe(self, client_id: str, task_id: str):
-        if client_id not in self.client_subscriptions[client_id]:
-            self.client_subscriptions[client_id].append(task_id)
-        if client_id not in self.task_subscribers[task_id]:
-            self.task_subscribers[task_id].append(client_id)
+        self.client_subscriptions[client_id].add(task_id)
+        self.task_subscribers[task_id].add(client_id)
         print(f"Client {client_id} subscribed to task {task_id}")
 
     def unsubscribe(self, client_id: str, task_id: str):
-        if task_id in self.client_subscriptions.get(client_id, []):
-            self.client_subscriptions[client_id].remove(task_id)
-            if not self.client_subscriptions[client_id]: # если список подписок пуст
+        tasks = self.client_subscriptions.get(client_id)
+        if tasks is not None and task_id in tasks:
+            tasks.discard(task_id)
+            if not tasks: # если подписок не осталось
                 del self.client_subscriptions[client_id]
 
-        if client_id in self.task_subscribers.get(task_id, []):
-            self.task_subscribers[task_id].remove(client_id)
-            if not self.task_subscribers[task_id]: # если список подписчиков пуст
+        subscribers = self.task_subscribers.get(task_id)
+        if subscribers is not None and client_id in subscribers:
+            subscribers.discard(client_id)
+            if not subscribers: # если подписчиков не осталось
                 del self.task_subscribers[task_id]
         print(f"Client {client_id} unsubscribed from task {task_id}")
 
-    async def broadcast_to_task_subscribers(self, task_id: str, message_data: dict):
-        # Эта функция не используется напрямую Celery задачами в текущей реализации,
-        # так как Celery задачи отправляют сообщение конкретному client_id, который инициировал задачу.
-        # Но она может быть полезна для других сценариев.
-        subscribers = list(self.task_subscribers.get(task_id, [])) # Копируем список для безопасной итерации
-        print(f"Broadcasting to subscribers of task {task_id}: {subscribers}")
+    async def broadcast_to_task_subscribers(self, task_id: str, message_data: dict, exclude: str = None):
+        # События задачи адресованы клиенту, который ее запустил (exclude - ему уже отправлено).
+        # Остальные подписчики - клиенты, присоединенные к той же задаче дедупликацией запросов
+        subscribers = [client_id for client_id in self.task_subscribers.get(task_id, ()) if client_id != exclude] # копия: отправка отписывает
         for client_id in subscribers:
-            await self.send_personal_message_json(message_data, client_id)
+            await self.send_personal_message_json(message_data, client_id, task_id_for_subscription=task_id)
 
 manager = ConnectionManager() 
\ No newline at end of file
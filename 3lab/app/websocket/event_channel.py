@@ -0,0 +1,114 @@
+import asyncio
+import json
+import time
+from typing import Dict
+import redis
+import redis.asyncio as aioredis
+from app.core.config import settings
+from app.core.metrics import LatencyHistogram
+from app.websocket.connection_manager import manager
+from app.services.result_cache import result_cache
+
+# События задач (STARTED/PROGRESS/COMPLETED/FAILED) идут от воркеров Celery через pub/sub
+# того же redis(lite), что служит брокером: воркер публикует, процесс API подписан один раз
+# и раздает события по WebSocket через ConnectionManager. Формат - тот же, что у
+# /internal/notify_client: {"client_id", "task_id", "message_data", "sent_at"}.
+# При uvicorn --workers N подписан каждый процесс, и событие доставляет тот, у кого сокет клиента
+EVENTS_RECONNECT_DELAY = 1.0 # секунд между попытками переподписаться
+
+_publisher = None
+_async_publisher = None
+
+def _get_publisher() -> redis.Redis:
+    # Клиент на процесс: пул соединений redis-py сам пересоздается после fork воркера
+    global _publisher
+    if _publisher is None:
+        _publisher = redis.Redis.from_url(settings.EVENTS_REDIS_URL)
+    return _publisher
+
+def publish_event(task_id: str, client_id: str, message_data: dict):
+    payload = {"client_id": client_id, "task_id": task_id, "message_data": message_data, "sent_at": time.time()}
+    _get_publisher().publish(settings.EVENTS_CHANNEL, json.dumps(payload))
+
+def _get_async_publisher() -> aioredis.Redis:
+    global _async_publisher
+    if _async_publisher is None:
+        _async_publisher = aioredis.Redis.from_url(settings.EVENTS_REDIS_URL)
+    return _async_publisher
+
+class DeliveryStats:
+    # Счетчики процесса API по обоим транспортам. Задержка - от отправки воркером до передачи
+    # в ConnectionManager (часы воркера и API на одной машине). Счетчики воркеров приходят
+    # вместе с пачками HTTP-транспорта, хранится последний снимок по pid
+    def __init__(self):
+        self.received = 0
+        self.not_connected = 0 # клиент подключен не к этому процессу (или уже отключился)
+        self.forwarded = 0 # события, переданные другим процессам через канал
+        self.errors = 0
+        self.latency = LatencyHistogram()
+        self.workers: Dict[int, Dict[str, int]] = {}
+
+    def snapshot(self) -> Dict:
+        return {
+            "received": self.received,
+            "not_connected": self.not_connected,
+            "forwarded": self.forwarded,
+            "errors": self.errors,
+            "latency": self.latency.snapshot(),
+            "workers": {str(pid): counters for pid, counters in self.workers.items()},
+        }
+
+delivery_stats = DeliveryStats()
+
+async def deliver_event(client_id: str, task_id: str, message_data: dict, sent_at: float = None):
+    delivery_stats.received += 1
+    # Итог задачи, запущенной этим процессом, попадает в кэш результатов (после отправки)
+    to_cache = result_cache.observe_event(task_id, message_data)
+    connected = manager.is_connected(client_id)
+    if not connected and task_id not in manager.task_subscribers:
+        delivery_stats.not_connected += 1
+    else:
+        if sent_at is not None:
+            delivery_stats.latency.observe(max(time.time() - sent_at, 0.0))
+        if connected:
+            await manager.send_personal_message_json(data=message_data, client_id=client_id, task_id_for_subscription=task_id)
+        # Клиенты, присоединенные к задаче дедупликацией; STARTED они уже получили при подписке
+        if task_id in manager.task_subscribers and message_data.get("status") != "STARTED":
+            await manager.broadcast_to_task_subscribers(task_id, message_data, exclude=client_id)
+    if to_cache is not None:
+        await asyncio.to_thread(result_cache.put, *to_cache)
+
+async def route_event(client_id: str, task_id: str, message_data: dict, sent_at: float = None):
+    # Для событий, пришедших в процесс не из канала (HTTP-транспорт, STARTED пакета от API):
+    # если сокета клиента здесь нет, событие уходит в канал, и его доставит процесс с сокетом
+    if manager.is_connected(client_id):
+        await deliver_event(client_id, task_id, message_data, sent_at)
+        return
+    delivery_stats.forwarded += 1
+    payload = {"client_id": client_id, "task_id": task_id, "message_data": message_data, "sent_at": sent_at or time.time()}
+    await _get_async_publisher().publish(settings.EVENTS_CHANNEL, json.dumps(payload))
+
+async def listen_events():
+    # Фоновая задача процесса API: одна подписка на весь процесс, при обрыве - переподписка
+    while True:
+        client = aioredis.Redis.from_url(settings.EVENTS_REDIS_URL)
+        try:
+            async with client.pubsub() as pubsub:
+                await pubsub.subscribe(settings.EVENTS_CHANNEL)
+                print(f"Subscribed to task events on channel {settings.EVENTS_CHANNEL}")
+                async for message in pubsub.listen():
+                    if message["type"] != "message":
+                        continue
+                    try:
+                        event = json.loads(message["data"])
+                        await deliver_event(event["client_id"], event["task_id"], event["message_data"], event.get("sent_at"))
+                    except (ValueError, KeyError, TypeError) as e:
+                        delivery_stats.errors += 1
+                        print(f"Malformed task event on channel {settings.EVENTS_CHANNEL}: {e}")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Task event channel error: {e}. Resubscribing in {EVENTS_RECONNECT_DELAY} s")
+            await asyncio.sleep(EVENTS_RECONNECT_DELAY)
+        finally:
+            await client.aclose()
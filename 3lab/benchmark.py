@@ -0,0 +1,365 @@
+# benchmark.py
+# Замер пропускной способности кодека на синтетических корпусах.
+#   python benchmark.py run --sizes 1K,1M --output baseline.json
+#   python benchmark.py run --baseline baseline.json --output current.json
+#   python benchmark.py compare baseline.json current.json --threshold 0.1
+# Регрессия - падение MB/s или рост пиковой памяти больше порога; тогда код выхода 1.
+# Сообщения Celery в форматах json и msgpack_zlib (размер и время сериализации; с --live
+# еще задержка от постановки задачи до STARTED на работающем воркере):
+#   python benchmark.py broker --sizes 1K,64K,1M --live
+import argparse
+import base64
+import json
+import platform
+import random
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+from app.services.code_cache import huffman_code_cache, decode_table_cache
+from app.services.encryption_service import (
+    np, build_huffman_tree, huffman_encode, huffman_decode, xor_cipher_inplace, perform_encode, perform_decode
+)
+
+SIZE_UNITS = {"K": 1 << 10, "M": 1 << 20}
+DEFAULT_SIZES = "1K,64K,1M,10M,100M"
+# С такого размера замер идет один раз: прогон и так длится секунды
+SINGLE_RUN_SIZE = 10 << 20
+# Быстрее этого время в основном шум, по нему регрессию не ищем
+MIN_COMPARE_SECONDS = 0.001
+BENCH_KEY = "benchmark-key"
+
+ASCII_WORDS = ("the", "quick", "brown", "fox", "jumps", "over", "lazy", "dog", "encode", "decode",
+               "huffman", "table", "stream", "payload", "request", "server", "client", "data")
+CYRILLIC_WORDS = ("кодирование", "декодирование", "запрос", "ответ", "ключ", "сервер", "клиент", "данные",
+                  "таблица", "символ", "поток", "задача", "шифр", "текст", "и", "в", "на", "не")
+
+def _words_corpus(words, punctuation: str, rng: random.Random, chars: int) -> str:
+    parts = []
+    total = 0
+    while total < chars:
+        word = rng.choice(words)
+        if rng.random() < 0.1:
+            word += rng.choice(punctuation)
+        parts.append(word)
+        total += len(word) + 1
+    return " ".join(parts)
+
+def _ascii_corpus(rng: random.Random, chars: int) -> str:
+    return _words_corpus(ASCII_WORDS, ".,!?;:", rng, chars)
+
+def _cyrillic_corpus(rng: random.Random, chars: int) -> str:
+    # Как test.txt: русский текст с вкраплениями латиницы и цифр
+    return _words_corpus(CYRILLIC_WORDS + ("FastAPI", "curl", "JSON", "2lab", "8000"), ".,!?:-«»", rng, chars)
+
+def _random_corpus(rng: random.Random, chars: int) -> str:
+    # Высокая энтропия: равномерно по 4096 кодовым точкам, коды длиной ~12 бит
+    return "".join(chr(0x4E00 + rng.randrange(4096)) for _ in range(chars))
+
+def _single_corpus(rng: random.Random, chars: int) -> str:
+    return "a" * chars
+
+CORPORA = {"ascii": _ascii_corpus, "cyrillic": _cyrillic_corpus, "random": _random_corpus, "single": _single_corpus}
+# Больших корпусов не генерируем целиком: кусок такого размера повторяется
+CORPUS_CHUNK_CHARS = 1 << 20
+
+def make_corpus(name: str, size: int, seed: int = 0) -> str:
+    # Текст размером size байт в UTF-8 (с точностью до символа)
+    chunk = CORPORA[name](random.Random(seed), min(size, CORPUS_CHUNK_CHARS))
+    bytes_per_char = len(chunk.encode("utf-8")) / len(chunk)
+    chars = max(1, int(size / bytes_per_char))
+    return (chunk * (chars // len(chunk) + 1))[:chars]
+
+def _no_progress(task_id, op, progress_percentage):
+    pass
+
+def _clear_caches():
+    # Кэш таблиц кодов иначе превращает повторные прогоны в поиск по словарю
+    huffman_code_cache.clear()
+    decode_table_cache.clear()
+
+def _perform_encode_args(ctx: dict) -> tuple:
+    _clear_caches()
+    return ctx["text"], BENCH_KEY, "bench", _no_progress
+
+def _perform_decode_args(ctx: dict) -> tuple:
+    _clear_caches()
+    return ctx["encoded"]["encoded_data"], BENCH_KEY, ctx["codes"], ctx["padding"], "bench", _no_progress
+
+# Этап: (подготовка(контекст) -> аргументы, замеряемая функция). Подготовка в замер не входит
+
+STAGES = {
+    "build_huffman_tree": (lambda ctx: (ctx["text"],), build_huffman_tree),
+    "huffman_encode": (lambda ctx: (ctx["text"], ctx["codes"]), huffman_encode),
+    "xor_cipher": (lambda ctx: (bytearray(ctx["packed"]), BENCH_KEY), xor_cipher_inplace),
+    "huffman_decode": (lambda ctx: (ctx["packed_base64"], ctx["codes"], ctx["padding"]), huffman_decode),
+    "perform_encode": (_perform_encode_args, perform_encode),
+    "perform_decode": (_perform_decode_args, perform_decode),
+}
+
+def _context(text: str) -> dict:
+    _, codes = build_huffman_tree(text)
+    packed_base64, padding = huffman_encode(text, codes)
+    return {
+        "text": text,
+        "codes": codes,
+        "packed": base64.b64decode(packed_base64),
+        "packed_base64": packed_base64,
+        "padding": padding,
+        "encoded": perform_encode(text, BENCH_KEY, "bench", _no_progress, codes),
+    }
+
+def _measure_time(setup, func, ctx: dict, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        args = setup(ctx)
+        started = time.perf_counter()
+        func(*args)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+def _measure_memory(setup, func, ctx: dict):
+    # -> (пик памяти за этап, число блоков, выделенных этапом и живых после него).
+    # Под tracemalloc код идет в разы медленнее, поэтому это отдельный прогон
+    args = setup(ctx)
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        tracemalloc.reset_peak()
+        result = func(*args)
+        peak = tracemalloc.get_traced_memory()[1]
+        after = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+    del result
+    blocks = sum(stat.count_diff for stat in after.compare_to(before, "filename") if stat.count_diff > 0)
+    return peak, blocks
+
+def parse_size(value: str) -> int:
+    value = value.strip().upper().rstrip("B")
+    if value and value[-1] in SIZE_UNITS:
+        return int(float(value[:-1]) * SIZE_UNITS[value[-1]])
+    return int(value)
+
+def format_size(size: int) -> str:
+    for unit in ("M", "K"):
+        if size >= SIZE_UNITS[unit] and size % SIZE_UNITS[unit] == 0:
+            return f"{size // SIZE_UNITS[unit]}{unit}"
+    return str(size)
+
+def run_benchmarks(sizes, corpora, stages, repeat: int, memory: bool = True) -> dict:
+    results = {}
+    for corpus in corpora:
+        for size in sizes:
+            text = make_corpus(corpus, size)
+            text_bytes = len(text.encode("utf-8"))
+            ctx = _context(text)
+            for stage in stages:
+                setup, func = STAGES[stage]
+                seconds = _measure_time(setup, func, ctx, 1 if size >= SINGLE_RUN_SIZE else repeat)
+                entry = {
+                    "text_bytes": text_bytes,
+                    "seconds": seconds,
+                    "mb_per_s": text_bytes / (1 << 20) / seconds if seconds > 0 else None,
+                }
+                if memory:
+                    entry["peak_memory_bytes"], entry["allocated_blocks"] = _measure_memory(setup, func, ctx)
+                name = f"{corpus}/{format_size(size)}/{stage}"
+                results[name] = entry
+                print(_format_entry(name, entry), flush=True)
+            del ctx, text
+    return results
+
+def _format_entry(name: str, entry: dict) -> str:
+    line = f"{name:<40} {entry['seconds'] * 1000:>10.2f} ms"
+    if entry["mb_per_s"] is not None:
+        line += f" {entry['mb_per_s']:>9.2f} MB/s"
+    if "peak_memory_bytes" in entry:
+        line += f" {entry['peak_memory_bytes'] / (1 << 20):>9.2f} MB peak {entry['allocated_blocks']:>8} blocks"
+    return line
+
+def compare_results(baseline: dict, current: dict, threshold: float) -> list:
+    # -> список регрессий (строки отчета); сравниваются только замеры, что есть в обоих файлах
+    regressions = []
+    for name, entry in current["results"].items():
+        base = baseline["results"].get(name)
+        if base is None:
+            continue
+        if base["mb_per_s"] and entry["mb_per_s"] and base["seconds"] >= MIN_COMPARE_SECONDS:
+            change = entry["mb_per_s"] / base["mb_per_s"] - 1
+            if change < -threshold:
+                regressions.append(f"{name}: {base['mb_per_s']:.2f} -> {entry['mb_per_s']:.2f} MB/s ({change:+.0%})")
+        if base.get("peak_memory_bytes") and entry.get("peak_memory_bytes"):
+            change = entry["peak_memory_bytes"] / base["peak_memory_bytes"] - 1
+            if change > threshold:
+                regressions.append(f"{name}: peak memory {base['peak_memory_bytes']} -> {entry['peak_memory_bytes']} bytes ({change:+.0%})")
+    return regressions
+
+def _report_regressions(baseline: dict, current: dict, threshold: float) -> int:
+    regressions = compare_results(baseline, current, threshold)
+    if baseline.get("machine") != current.get("machine"):
+        print("Внимание: базовый замер сделан на другой машине, сравнение неточное")
+    if not regressions:
+        print(f"Регрессий больше {threshold:.0%} нет")
+        return 0
+    print(f"Регрессии больше {threshold:.0%}:")
+    for line in regressions:
+        print("  " + line)
+    return 1
+
+BROKER_SERIALIZERS = ("json", "msgpack_zlib")
+
+def _task_body(args: tuple) -> tuple:
+    # Тело сообщения Celery (протокол 2): (args, kwargs, embed)
+    return args, {}, {"callbacks": None, "errbacks": None, "chain": None, "chord": None}
+
+def _broker_messages(text: str) -> dict:
+    result = perform_encode(text, BENCH_KEY, "bench", _no_progress)
+    return {
+        "encode_task": (text, BENCH_KEY, "bench-client"),
+        "decode_task": (result["encoded_data"], BENCH_KEY, result["huffman_codes"], result["padding"], "bench-client"),
+    }
+
+def _measure_serializer(body: tuple, serializer: str, repeat: int) -> dict:
+    from kombu.serialization import dumps, loads
+    best_dumps = best_loads = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        content_type, encoding, data = dumps(body, serializer=serializer)
+        best_dumps = min(best_dumps, time.perf_counter() - started)
+        started = time.perf_counter()
+        loads(data, content_type, encoding)
+        best_loads = min(best_loads, time.perf_counter() - started)
+    size = len(data if isinstance(data, bytes) else data.encode("utf-8"))
+    # Транспорт redis кладет тело в JSON-конверт в base64
+    return {"body_bytes": size, "wire_bytes": (size + 2) // 3 * 4, "dumps_ms": best_dumps * 1000, "loads_ms": best_loads * 1000}
+
+def _enqueue_to_started(task, args: tuple, serializer: str, repeat: int) -> float:
+    # Медиана времени от apply_async до события STARTED в канале событий (нужен воркер).
+    # Задачи идут по одной: следующая ставится после COMPLETED предыдущей
+    import redis
+    from app.core.config import settings
+    subscriber = redis.Redis.from_url(settings.EVENTS_REDIS_URL).pubsub(ignore_subscribe_messages=True)
+    subscriber.subscribe(settings.EVENTS_CHANNEL)
+    timings = []
+    try:
+        for _ in range(repeat):
+            started = time.perf_counter()
+            task_id = task.apply_async(args, serializer=serializer).id
+            while True:
+                # None приходит и на служебные сообщения подписки, поэтому срок считаем сами
+                message = subscriber.get_message(timeout=1.0)
+                if message is None:
+                    if time.perf_counter() - started > 30:
+                        raise TimeoutError("No STARTED event within 30 s: is the Celery worker running?")
+                    continue
+                event = json.loads(message["data"])
+                if event["task_id"] != task_id:
+                    continue
+                status = event["message_data"]["status"]
+                if status == "STARTED":
+                    timings.append(time.perf_counter() - started)
+                elif status in ("COMPLETED", "FAILED"): # следующую задачу - на свободный воркер
+                    break
+    finally:
+        subscriber.close()
+    return sorted(timings)[len(timings) // 2]
+
+def run_broker_benchmarks(sizes, corpora, repeat: int, live: bool) -> dict:
+    from app.celery.celery_app import accept_content
+    from app.celery import tasks
+    serializers = [name for name in BROKER_SERIALIZERS if name in accept_content]
+    if len(serializers) < len(BROKER_SERIALIZERS):
+        print("msgpack не установлен: замер только для json")
+    results = {}
+    for corpus in corpora:
+        for size in sizes:
+            for task_name, args in _broker_messages(make_corpus(corpus, size)).items():
+                for serializer in serializers:
+                    entry = _measure_serializer(_task_body(args), serializer, repeat)
+                    if live:
+                        entry["enqueue_to_started_ms"] = _enqueue_to_started(getattr(tasks, task_name), args, serializer, repeat) * 1000
+                    name = f"{corpus}/{format_size(size)}/{task_name}/{serializer}"
+                    results[name] = entry
+                    line = (f"{name:<48} {entry['body_bytes']:>11} B тело {entry['wire_bytes']:>11} B в redis "
+                            f"{entry['dumps_ms']:>8.2f} ms dumps {entry['loads_ms']:>8.2f} ms loads")
+                    if live:
+                        line += f" {entry['enqueue_to_started_ms']:>8.2f} ms до STARTED"
+                    print(line, flush=True)
+    return results
+
+def _load(path: str) -> dict:
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+def _machine() -> dict:
+    return {"python": platform.python_version(), "platform": platform.platform(), "numpy": np is not None}
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Бенчмарк кодека Хаффман + XOR")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", help="прогнать замеры")
+    run.add_argument("--sizes", default=DEFAULT_SIZES, help=f"размеры текста через запятую (по умолчанию {DEFAULT_SIZES})")
+    run.add_argument("--corpora", default=",".join(CORPORA), help="корпуса через запятую")
+    run.add_argument("--stages", default=",".join(STAGES), help="этапы через запятую")
+    run.add_argument("--repeat", type=int, default=3, help="прогонов на замер, берется лучший")
+    run.add_argument("--no-memory", action="store_true", help="без прогона под tracemalloc")
+    run.add_argument("--output", help="сохранить результаты в JSON (базовый замер)")
+    run.add_argument("--baseline", help="сравнить с базовым замером")
+    run.add_argument("--threshold", type=float, default=0.1, help="порог регрессии, доля (0.1 = 10%%)")
+
+    compare = commands.add_parser("compare", help="сравнить два сохраненных замера")
+    compare.add_argument("baseline")
+    compare.add_argument("current")
+    compare.add_argument("--threshold", type=float, default=0.1)
+
+    broker = commands.add_parser("broker", help="размер и скорость сообщений Celery: json против msgpack_zlib")
+    broker.add_argument("--sizes", default="1K,64K,1M", help="размеры текста через запятую")
+    broker.add_argument("--corpora", default="cyrillic", help="корпуса через запятую")
+    broker.add_argument("--repeat", type=int, default=5, help="прогонов на замер")
+    broker.add_argument("--live", action="store_true", help="еще и задержка до STARTED на работающем воркере")
+    broker.add_argument("--output", help="сохранить результаты в JSON")
+
+    args = parser.parse_args(argv)
+    if args.command == "broker":
+        unknown = set(args.corpora.split(",")) - set(CORPORA)
+        if unknown:
+            parser.error(f"unknown corpora: {', '.join(sorted(unknown))}")
+        results = run_broker_benchmarks([parse_size(size) for size in args.sizes.split(",")],
+                                        args.corpora.split(","), args.repeat, args.live)
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as f:
+                json.dump({"created_at": datetime.now(timezone.utc).isoformat(), "machine": _machine(), "results": results},
+                          f, indent=2, ensure_ascii=False)
+        return 0
+    if args.command == "compare":
+        return _report_regressions(_load(args.baseline), _load(args.current), args.threshold)
+
+    for name, known in (("corpora", CORPORA), ("stages", STAGES)):
+        unknown = set(getattr(args, name).split(",")) - set(known)
+        if unknown:
+            parser.error(f"unknown {name}: {', '.join(sorted(unknown))}")
+    current = {
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "machine": _machine(),
+        "repeat": args.repeat,
+        "results": run_benchmarks(
+            [parse_size(size) for size in args.sizes.split(",")],
+            args.corpora.split(","),
+            args.stages.split(","),
+            args.repeat,
+            memory=not args.no_memory,
+        ),
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(current, f, indent=2, ensure_ascii=False)
+        print(f"Результаты сохранены в {args.output}")
+    if args.baseline:
+        return _report_regressions(_load(args.baseline), current, args.threshold)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
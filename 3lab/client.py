@@ -1,5 +1,6 @@
 # client.py
 import asyncio
+import base64
 import websockets
 import json
 import uuid
@@ -16,10 +17,20 @@ async def listen_to_websocket(websocket: websockets.WebSocketClientProtocol, cli
     print(f"[WS Listener for {client_id}] Ожидание сообщений...")
     try:
         async for message in websocket:
+            if isinstance(message, bytes): # ответ адаптивной сессии
+                print(f"\n[Бинарное сообщение для {client_id}] base64: {base64.b64encode(message).decode()}")
+                try:
+                    print(f"  как текст: {message.decode('utf-8')}")
+                except UnicodeDecodeError:
+                    pass
+                print(f"\nclient@{client_id}> ", end="", flush=True)
+                continue
             try:
                 data = json.loads(message)
                 print(f"\n[Сообщение от сервера для {client_id}]:")
                 print(json.dumps(data, indent=2, ensure_ascii=False))
+                if data.get("result_ref"): # большой результат лежит на сервере
+                    await download_result(data["task_id"], data["result_ref"])
             except json.JSONDecodeError:
                 print(f"\n[Не JSON сообщение от сервера для {client_id}]: {message}")
             print(f"\nclient@{client_id}> ", end="", flush=True)
@@ -35,6 +46,21 @@ async def listen_to_websocket(websocket: websockets.WebSocketClientProtocol, cli
         if websocket == current_websocket:
             current_websocket = None
 
+async def download_result(task_id: str, result_ref: dict):
+    # Результат сохраняется в файл целиком, не печатается: он больше RESULT_INLINE_MAX_SIZE
+    url = BASE_API_URL.rsplit("/encryption", 1)[0] + result_ref["url"]
+    path = f"result_{task_id}.json"
+    try:
+        async with httpx.AsyncClient() as client:
+            async with client.stream("GET", url, timeout=60.0) as response:
+                response.raise_for_status()
+                with open(path, "wb") as f:
+                    async for chunk in response.aiter_bytes():
+                        f.write(chunk)
+        print(f"Результат ({result_ref['size']} байт) сохранен в {path}")
+    except httpx.HTTPError as e:
+        print(f"Не удалось скачать результат {url}: {e}")
+
 async def connect_command(client_id_to_connect: str):
     global current_websocket
     global current_client_id
@@ -74,6 +100,10 @@ def print_help():
     print("  encode <key> <text>   - Отправить задачу кодирования (нужен активный client_id).")
     print("  decode <key> <pad> <b64_data> \"<json_codes>\" - Отправить задачу декодирования.")
     print("                            (pad - padding, json_codes - строка в двойных кавычках)")
+    print("  adaptive <encode|decode> <key> - Начать адаптивную сессию по WebSocket (без таблицы кодов).")
+    print("  push <text>             - Отправить текст в сессию encode, в ответ придет кадр.")
+    print("  pushframe <b64_frame>   - Отправить кадр в сессию decode, в ответ придет текст.")
+    print("  adaptive_stop           - Завершить адаптивную сессию.")
     print("  disconnect              - Отключиться от WebSocket.")
     print("  help                    - Показать это сообщение.")
     print("  exit                    - Выйти из клиента.")
@@ -199,6 +229,25 @@ async def main_loop():
                 continue
             key, padding, encoded_b64, huffman_json_str = decode_args_parts
             await send_decode_request(current_client_id, key, padding, encoded_b64, huffman_json_str)
+        elif cmd in ("adaptive", "push", "pushframe", "adaptive_stop"):
+            if not current_websocket:
+                print("Ошибка: сначала установите активное WebSocket соединение командой 'connect [client_id]'.")
+                continue
+            if cmd == "adaptive":
+                adaptive_args = args_str.split(maxsplit=1)
+                if len(adaptive_args) < 2 or adaptive_args[0] not in ("encode", "decode"):
+                    print("Использование: adaptive <encode|decode> <key>")
+                    continue
+                await current_websocket.send(json.dumps({"action": "adaptive_start", "mode": adaptive_args[0], "key": adaptive_args[1]}))
+            elif cmd == "push":
+                await current_websocket.send(args_str.encode("utf-8"))
+            elif cmd == "pushframe":
+                try:
+                    await current_websocket.send(base64.b64decode(args_str.strip(), validate=True))
+                except ValueError:
+                    print("Ошибка: кадр должен быть в base64.")
+            else:
+                await current_websocket.send(json.dumps({"action": "adaptive_stop"}))
         elif cmd == "help":
             print_help()
         elif cmd == "exit":
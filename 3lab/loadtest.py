@@ -0,0 +1,151 @@
+# loadtest.py
+# Нагрузочный тест доставки событий задач по WebSocket. Клиенты держат соединения с API,
+# события публикуются прямо в канал событий (так же, как это делают воркеры Celery),
+# а клиенты замеряют задержку от публикации до получения. Воркеры Celery не нужны.
+#   uvicorn main:app --port 8000 --workers 4
+#   python loadtest.py --clients 10000 --tasks 20000 --rate 2000
+# Клиентам и серверу нужно по дескриптору на соединение: ulimit -n должен быть больше --clients
+import argparse
+import asyncio
+import json
+import random
+import resource
+import sys
+import time
+import uuid
+
+import httpx
+import redis.asyncio as aioredis
+import websockets
+
+from app.core.config import settings
+
+def _percentile(values: list, q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+class LoadClient:
+    def __init__(self, client_id: str):
+        self.client_id = client_id
+        self.websocket = None
+        self.received = {"STARTED": 0, "PROGRESS": 0, "COMPLETED": 0}
+        self.latencies = [] # секунд от публикации COMPLETED до получения
+
+    async def listen(self):
+        try:
+            async for message in self.websocket:
+                data = json.loads(message)
+                status = data.get("status")
+                if status in self.received:
+                    self.received[status] += 1
+                if status == "COMPLETED":
+                    self.latencies.append(time.time() - data["load_sent_at"])
+        except websockets.exceptions.ConnectionClosed:
+            pass
+
+async def connect_clients(url: str, count: int, concurrency: int, run_id: str):
+    semaphore = asyncio.Semaphore(concurrency)
+    clients = [LoadClient(f"load-{run_id}-{i}") for i in range(count)]
+    failed = 0
+
+    async def connect(client: LoadClient):
+        nonlocal failed
+        async with semaphore:
+            try:
+                client.websocket = await websockets.connect(f"{url}/{client.client_id}", open_timeout=60)
+            except Exception as e:
+                failed += 1
+                if failed <= 5:
+                    print(f"Не удалось подключить {client.client_id}: {type(e).__name__}: {e}")
+
+    await asyncio.gather(*(connect(client) for client in clients))
+    return [client for client in clients if client.websocket is not None], failed
+
+async def publish_tasks(redis_url: str, channel: str, clients: list, tasks: int, rate: float, progress_per_task: int):
+    # Задача: STARTED, progress_per_task раз PROGRESS и COMPLETED одному случайному клиенту
+    publisher = aioredis.Redis.from_url(redis_url)
+    interval = 1.0 / rate if rate > 0 else 0.0
+    started = time.perf_counter()
+    try:
+        for n in range(tasks):
+            client = random.choice(clients)
+            task_id = str(uuid.uuid4())
+            messages = [{"task_id": task_id, "operation": "encode", "status": "STARTED"}]
+            messages += [{"task_id": task_id, "operation": "encode", "status": "PROGRESS",
+                          "progress": (i + 1) * 100 // (progress_per_task + 1)} for i in range(progress_per_task)]
+            messages.append({"task_id": task_id, "operation": "encode", "status": "COMPLETED", "result": None})
+            async with publisher.pipeline(transaction=False) as pipe:
+                for message_data in messages:
+                    message_data["load_sent_at"] = time.time()
+                    pipe.publish(channel, json.dumps({
+                        "client_id": client.client_id, "task_id": task_id,
+                        "message_data": message_data, "sent_at": message_data["load_sent_at"]
+                    }))
+                await pipe.execute()
+            if interval: # темп по расписанию, а не паузой после каждой задачи
+                delay = started + (n + 1) * interval - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+    finally:
+        await publisher.aclose()
+    return time.perf_counter() - started
+
+async def run(args) -> int:
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < args.clients + 100:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (min(hard, args.clients + 1000), hard))
+    run_id = uuid.uuid4().hex[:8]
+
+    started = time.perf_counter()
+    clients, failed = await connect_clients(args.url, args.clients, args.connect_concurrency, run_id)
+    connect_seconds = time.perf_counter() - started
+    print(f"Подключено {len(clients)} из {args.clients} за {connect_seconds:.2f} с "
+          f"({len(clients) / connect_seconds:.0f} соединений/с), ошибок: {failed}")
+    if not clients:
+        return 1
+    listeners = [asyncio.create_task(client.listen()) for client in clients]
+
+    publish_seconds = await publish_tasks(args.redis_url, args.channel, clients, args.tasks, args.rate, args.progress)
+    print(f"Опубликовано {args.tasks} задач ({args.tasks * (args.progress + 2)} событий) за {publish_seconds:.2f} с")
+
+    # Ждем, пока дойдут все COMPLETED, но не дольше --drain-timeout
+    deadline = time.perf_counter() + args.drain_timeout
+    while sum(client.received["COMPLETED"] for client in clients) < args.tasks and time.perf_counter() < deadline:
+        await asyncio.sleep(0.1)
+    total_seconds = time.perf_counter() - started - connect_seconds
+
+    latencies = [latency for client in clients for latency in client.latencies]
+    received = {status: sum(client.received[status] for client in clients) for status in ("STARTED", "PROGRESS", "COMPLETED")}
+    print(f"Получено: STARTED {received['STARTED']}, PROGRESS {received['PROGRESS']} "
+          f"(из {args.tasks * args.progress}, лишние схлопываются), COMPLETED {received['COMPLETED']} из {args.tasks}")
+    print(f"Задержка COMPLETED: p50 {_percentile(latencies, 0.5) * 1000:.1f} мс, p90 {_percentile(latencies, 0.9) * 1000:.1f} мс, "
+          f"p99 {_percentile(latencies, 0.99) * 1000:.1f} мс, max {max(latencies, default=0) * 1000:.1f} мс")
+    print(f"Доставлено {len(latencies) / total_seconds:.0f} задач/с")
+    try:
+        stats = httpx.get(args.url.replace("ws", "http", 1).rsplit("/ws", 1)[0] + "/internal/notify_client/stats").json()
+        print(f"Статистика одного процесса API: {json.dumps(stats, ensure_ascii=False)}")
+    except httpx.HTTPError as e:
+        print(f"Статистику API получить не удалось: {e}")
+
+    for listener in listeners:
+        listener.cancel()
+    await asyncio.gather(*(client.websocket.close() for client in clients), return_exceptions=True)
+    return 0 if received["COMPLETED"] == args.tasks else 1
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Нагрузочный тест доставки событий по WebSocket")
+    parser.add_argument("--url", default="ws://localhost:8000/encryption/ws", help="адрес WebSocket без client_id")
+    parser.add_argument("--redis-url", default=settings.EVENTS_REDIS_URL)
+    parser.add_argument("--channel", default=settings.EVENTS_CHANNEL)
+    parser.add_argument("--clients", type=int, default=10_000)
+    parser.add_argument("--connect-concurrency", type=int, default=200, help="одновременных рукопожатий")
+    parser.add_argument("--tasks", type=int, default=10_000, help="задач, у каждой свой случайный клиент")
+    parser.add_argument("--progress", type=int, default=3, help="событий PROGRESS на задачу")
+    parser.add_argument("--rate", type=float, default=1000.0, help="задач в секунду (0 - без ограничения)")
+    parser.add_argument("--drain-timeout", type=float, default=30.0, help="секунд ждать недоставленные события")
+    return asyncio.run(run(parser.parse_args(argv)))
+
+if __name__ == "__main__":
+    sys.exit(main())
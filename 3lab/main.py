@@ -1,6 +1,8 @@
+import asyncio
 from fastapi import FastAPI
 from app.api import encryption_api
 from app.core.config import settings
+from app.websocket.event_channel import listen_events
 
 app = FastAPI(
     title="Encryption Service with Celery and WebSockets",
@@ -17,10 +19,13 @@ async def startup_event():
     print(f"Celery Backend: {settings.CELERY_RESULT_BACKEND}")
     print("WebSocket endpoint available at /encryption/ws/{client_id}")
     print("REST endpoints available at /encryption/encode/{client_id} and /encryption/decode/{client_id}")
+    # События от воркеров Celery: одна подписка на процесс, раздача по WebSocket
+    app.state.event_listener = asyncio.create_task(listen_events())
 
 @app.on_event("shutdown")
 async def shutdown_event():
     print("Application shutdown...")
+    app.state.event_listener.cancel()
 
 @app.get("/")
 async def root():